@@ -14,6 +14,7 @@ import os
 from pathlib import Path
 
 import sentry_sdk
+from psycopg_pool import ConnectionPool
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -54,6 +55,7 @@ MIDDLEWARE = [
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "sanatorio_allende.auth0_middleware.Auth0Middleware",
+    "sanatorio_allende.db_router.PrimaryStickinessMiddleware",
 ]
 
 ROOT_URLCONF = "liftoff.urls"
@@ -87,6 +89,21 @@ os.environ.setdefault("PGPASSWORD", "")
 os.environ.setdefault("PGHOST", "localhost")
 os.environ.setdefault("PGPORT", "5432")
 
+# Pooled connections (psycopg_pool) shared by the threads of each web and worker
+# process, instead of a new connection per request or run
+DB_POOL = os.environ.get("DB_POOL", "false").lower() == "true"
+DB_POOL_OPTIONS = {
+    "min_size": int(os.environ.get("DB_POOL_MIN_SIZE", 2)),
+    "max_size": int(os.environ.get("DB_POOL_MAX_SIZE", 10)),
+    # Seconds a request waits for a free connection before failing
+    "timeout": float(os.environ.get("DB_POOL_TIMEOUT", 10)),
+    # Seconds an idle connection above min_size is kept
+    "max_idle": float(os.environ.get("DB_POOL_MAX_IDLE", 300)),
+    # Checked out connections are tested first, a sleeping database is
+    # reconnected instead of failing the request
+    "check": ConnectionPool.check_connection,
+}
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.postgresql",
@@ -95,9 +112,115 @@ DATABASES = {
         "PASSWORD": os.environ["PGPASSWORD"],
         "HOST": os.environ["PGHOST"],
         "PORT": os.environ["PGPORT"],
+        # Keep connections open between cycles of the long-running search daemon,
+        # the pool already keeps them open and requires 0
+        "CONN_MAX_AGE": 0 if DB_POOL else int(os.environ.get("DB_CONN_MAX_AGE", 0)),
+        "CONN_HEALTH_CHECKS": (
+            os.environ.get("DB_CONN_HEALTH_CHECKS", "true").lower() == "true"
+        ),
+        "OPTIONS": {"pool": DB_POOL_OPTIONS} if DB_POOL else {},
     }
 }
 
+# Optional streaming replica of the primary. The list endpoints read from it
+# (see sanatorio_allende/db_router.py), writes and the search worker do not.
+# Only used with a shared cache (REDIS_URL), which holds the read-your-writes pins.
+DB_REPLICA_HOST = os.environ.get("DB_REPLICA_HOST")
+if DB_REPLICA_HOST:
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "HOST": DB_REPLICA_HOST,
+        "PORT": os.environ.get("DB_REPLICA_PORT", os.environ["PGPORT"]),
+        # Tests read the replica's rows from the test database of the primary
+        "TEST": {"MIRROR": "default"},
+    }
+DATABASE_ROUTERS = ["sanatorio_allende.db_router.ReadReplicaRouter"]
+# Seconds a user's or patient's lists are read from the primary after a write,
+# longer than the replication lag
+READ_REPLICA_STICKY_SECONDS = int(os.environ.get("READ_REPLICA_STICKY_SECONDS", 10))
+# Seconds the primary serves the reads after the replica refused a connection
+READ_REPLICA_RETRY_SECONDS = float(os.environ.get("READ_REPLICA_RETRY_SECONDS", 30))
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Shared Redis cache when REDIS_URL is set, per-process memory cache otherwise
+
+REDIS_URL = os.environ.get("REDIS_URL")
+
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# Seconds the active push tokens of a user are kept in the cache
+DEVICE_TOKEN_CACHE_TIMEOUT = int(os.environ.get("DEVICE_TOKEN_CACHE_TIMEOUT", 3600))
+
+# Poll the searches of a patient that only differ in the doctor with one
+# request per specialty and branch (IdRecurso 0), splitting the answer by doctor
+SEARCH_GROUPS_ENABLED = (
+    os.environ.get("SEARCH_GROUPS_ENABLED", "false").lower() == "true"
+)
+
+# Event stream of api/best-appointments/events/: seconds between reads of new
+# events, seconds between heartbeats and hours a client can resume after
+APPOINTMENT_EVENTS_POLL_SECONDS = float(
+    os.environ.get("APPOINTMENT_EVENTS_POLL_SECONDS", 1.0)
+)
+APPOINTMENT_EVENTS_HEARTBEAT_SECONDS = float(
+    os.environ.get("APPOINTMENT_EVENTS_HEARTBEAT_SECONDS", 15.0)
+)
+APPOINTMENT_EVENT_RETENTION_HOURS = int(
+    os.environ.get("APPOINTMENT_EVENT_RETENTION_HOURS", 24)
+)
+
+# PostgreSQL LISTEN/NOTIFY change feed (see listen_appointment_changes): the
+# web processes wake up their event stream on each notification
+CHANGE_FEED_ENABLED = os.environ.get("CHANGE_FEED_ENABLED", "true").lower() == "true"
+# Seconds before a lost listener connection is retried, doubled up to the maximum
+CHANGE_FEED_MAX_BACKOFF = float(os.environ.get("CHANGE_FEED_MAX_BACKOFF", 30.0))
+
+# Hours after its date an appointment found is moved to the archive table
+# (see archive_best_appointments)
+BEST_APPOINTMENT_ARCHIVE_AFTER_HOURS = int(
+    os.environ.get("BEST_APPOINTMENT_ARCHIVE_AFTER_HOURS", 24)
+)
+
+# Months of slot history kept (see SlotObservationRepository) and seconds the
+# release-time histograms computed from it are cached
+SLOT_OBSERVATION_RETENTION_MONTHS = int(
+    os.environ.get("SLOT_OBSERVATION_RETENTION_MONTHS", 12)
+)
+SLOT_ANALYTICS_CACHE_SECONDS = int(os.environ.get("SLOT_ANALYTICS_CACHE_SECONDS", 3600))
+
+# Poll searches at the minimum interval around the release windows predicted
+# from the slot history and slower the rest of the time (see
+# services/slot_release_predictor.py), fitted on SLOT_PREDICTION_HISTORY_DAYS
+# and refitted every SLOT_PREDICTION_CACHE_SECONDS
+SLOT_PREDICTION_ENABLED = (
+    os.environ.get("SLOT_PREDICTION_ENABLED", "false").lower() == "true"
+)
+SLOT_PREDICTION_HISTORY_DAYS = int(os.environ.get("SLOT_PREDICTION_HISTORY_DAYS", 56))
+SLOT_PREDICTION_CACHE_SECONDS = int(
+    os.environ.get("SLOT_PREDICTION_CACHE_SECONDS", 6 * 3600)
+)
+
+# Expo push service, overridable to point at a mock (see benchmark_push)
+EXPO_PUSH_URL = os.environ.get("EXPO_PUSH_URL", "https://exp.host/--/api/v2/push/send")
+EXPO_RECEIPT_URL = os.environ.get(
+    "EXPO_RECEIPT_URL", "https://exp.host/--/api/v2/push/getReceipts"
+)
+# Messages per push request, Expo accepts at most 100
+EXPO_PUSH_BATCH_SIZE = int(os.environ.get("EXPO_PUSH_BATCH_SIZE", 100))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -164,6 +287,50 @@ SELENIUM_HOSTNAME = os.environ.get("SELENIUM_HOSTNAME", "localhost")
 SELENIUM_PORT = os.environ.get("SELENIUM_PORT", 4444)
 SELENIUM_IMPLICIT_WAIT = os.environ.get("SELENIUM_IMPLICIT_WAIT", 10)
 
+# Adaptive polling of FindAppointment searches (see services/polling_scheduler.py)
+POLL_MIN_INTERVAL_SECONDS = int(os.environ.get("POLL_MIN_INTERVAL_SECONDS", 60))
+POLL_MAX_INTERVAL_SECONDS = int(os.environ.get("POLL_MAX_INTERVAL_SECONDS", 4 * 3600))
+# Searches due within this margin are polled in the current run
+POLL_SCHEDULE_TOLERANCE_SECONDS = int(
+    os.environ.get("POLL_SCHEDULE_TOLERANCE_SECONDS", 30)
+)
+
+
+# Search daemon (find_appointments --daemon)
+FIND_APPOINTMENTS_TICK_SECONDS = int(
+    os.environ.get("FIND_APPOINTMENTS_TICK_SECONDS", 60)
+)
+# Tokens verified less than this long ago are reused without probing Allende
+ALLENDE_TOKEN_RECHECK_SECONDS = int(
+    os.environ.get("ALLENDE_TOKEN_RECHECK_SECONDS", 600)
+)
+# Patients leased by a search worker replica, expired leases are reclaimed
+WORKER_LEASE_SECONDS = int(os.environ.get("WORKER_LEASE_SECONDS", 300))
+WORKER_BATCH_SIZE = int(os.environ.get("WORKER_BATCH_SIZE", 10))
+
+# Rate limits and circuit breakers around the Allende endpoints
+# (see sanatorio_allende/upstream_guard.py). "default" applies to every endpoint:
+# search, types, doctors, patient, book, cancel and auth.
+ALLENDE_UPSTREAM_LIMITS = {
+    "default": {
+        "rate": float(os.environ.get("ALLENDE_RATE_PER_SECOND", 5)),
+        "burst": int(os.environ.get("ALLENDE_RATE_BURST", 10)),
+        "max_wait": float(os.environ.get("ALLENDE_RATE_MAX_WAIT_SECONDS", 5)),
+        "failure_threshold": int(os.environ.get("ALLENDE_CIRCUIT_FAILURES", 5)),
+        "recovery_timeout": float(
+            os.environ.get("ALLENDE_CIRCUIT_RECOVERY_SECONDS", 30)
+        ),
+        "half_open_max_calls": int(os.environ.get("ALLENDE_CIRCUIT_PROBES", 1)),
+        "timeout": float(os.environ.get("ALLENDE_TIMEOUT_SECONDS", 10)),
+    },
+    # Bookings are user facing, never queue them behind a busy bucket
+    "book": {"max_wait": 1.0},
+    "cancel": {"max_wait": 1.0},
+}
+
+# Metrics export (see sanatorio_allende/metrics.py)
+METRICS_ALLOWED_IPS = os.environ.get("METRICS_ALLOWED_IPS", "127.0.0.1,::1").split(",")
+FIND_APPOINTMENTS_METRICS_FILE = os.environ.get("FIND_APPOINTMENTS_METRICS_FILE")
 
 # Auth0 Configuration
 AUTH0_DOMAIN = os.environ.get("AUTH0_DOMAIN", "daviddanielarch.auth0.com")
@@ -1,12 +1,21 @@
+from typing import Optional
+
 from django import forms
 from django.contrib import admin
+from django.db.models import QuerySet
+from django.http import HttpRequest
 
 from .models import (
     BestAppointmentFound,
+    BestAppointmentFoundArchive,
     DeviceRegistration,
     FindAppointment,
     PacienteAllende,
 )
+from .repositories.device_registration_repository import DeviceRegistrationRepository
+from .repositories.patient_version_repository import PatientVersionRepository
+from .services.appointment_booking import AppointmentBookingService
+from .services.search_fingerprint import SearchFingerprintService
 
 
 class FindAppointmentAdminForm(forms.ModelForm):
@@ -21,10 +30,26 @@ class FindAppointmentAdminForm(forms.ModelForm):
 @admin.register(FindAppointment)
 class FindAppointmentAdmin(admin.ModelAdmin):
     form = FindAppointmentAdminForm
-    list_display = ["doctor_name", "nombre_tipo_prestacion", "active"]
-    list_filter = ["doctor_name", "nombre_tipo_prestacion", "active"]
+    list_display = ["doctor_name", "nombre_tipo_prestacion", "active", "auto_book"]
+    list_filter = ["doctor_name", "nombre_tipo_prestacion", "active", "auto_book"]
     search_fields = ["doctor_name"]
-    list_editable = ["active"]
+    list_editable = ["active", "auto_book"]
+
+    def save_model(
+        self,
+        request: HttpRequest,
+        obj: FindAppointment,
+        form: forms.ModelForm,
+        change: bool,
+    ) -> None:
+        super().save_model(request, obj, form, change)
+        PatientVersionRepository.bump(obj.patient_id)
+        SearchFingerprintService.reset(obj.id)
+        if change:
+            # Prebuilt booking payloads embed the search IDs
+            AppointmentBookingService.invalidate_booking_payloads(
+                appointment_wanted_id=obj.id
+            )
 
 
 @admin.register(BestAppointmentFound)
@@ -33,6 +58,32 @@ class BestAppointmentFoundAdmin(admin.ModelAdmin):
     list_filter = ["appointment_wanted", "datetime"]
     search_fields = ["appointment_wanted"]
 
+    def save_model(
+        self,
+        request: HttpRequest,
+        obj: BestAppointmentFound,
+        form: forms.ModelForm,
+        change: bool,
+    ) -> None:
+        super().save_model(request, obj, form, change)
+        PatientVersionRepository.bump(obj.patient_id)
+        SearchFingerprintService.reset(obj.appointment_wanted_id)
+
+
+@admin.register(BestAppointmentFoundArchive)
+class BestAppointmentFoundArchiveAdmin(admin.ModelAdmin):
+    list_display = ["original_id", "patient_id", "datetime", "confirmed"]
+    list_filter = ["confirmed", "not_interested"]
+    search_fields = ["patient_id", "original_id"]
+
+    def has_change_permission(
+        self,
+        request: HttpRequest,
+        obj: Optional[BestAppointmentFoundArchive] = None,
+    ) -> bool:
+        # Archived rows are a record of what happened
+        return False
+
 
 @admin.register(PacienteAllende)
 class PacienteAllendeAdmin(admin.ModelAdmin):
@@ -40,6 +91,18 @@ class PacienteAllendeAdmin(admin.ModelAdmin):
     list_filter = ["id_paciente", "id_financiador", "id_plan"]
     search_fields = ["id_paciente", "name"]
 
+    def save_model(
+        self,
+        request: HttpRequest,
+        obj: PacienteAllende,
+        form: forms.ModelForm,
+        change: bool,
+    ) -> None:
+        super().save_model(request, obj, form, change)
+        if change:
+            # Prebuilt booking payloads embed the patient coverage
+            AppointmentBookingService.invalidate_booking_payloads(patient_id=obj.id)
+
 
 @admin.register(DeviceRegistration)
 class DeviceRegistrationAdmin(admin.ModelAdmin):
@@ -49,6 +112,30 @@ class DeviceRegistrationAdmin(admin.ModelAdmin):
     readonly_fields = ["created_at", "updated_at"]
     list_editable = ["is_active"]
 
+    def save_model(
+        self,
+        request: HttpRequest,
+        obj: DeviceRegistration,
+        form: forms.ModelForm,
+        change: bool,
+    ) -> None:
+        if change and "user" in form.changed_data:
+            DeviceRegistrationRepository.invalidate(form.initial.get("user"))
+        super().save_model(request, obj, form, change)
+        DeviceRegistrationRepository.invalidate(obj.user_id)
+
+    def delete_model(self, request: HttpRequest, obj: DeviceRegistration) -> None:
+        super().delete_model(request, obj)
+        DeviceRegistrationRepository.invalidate(obj.user_id)
+
+    def delete_queryset(
+        self, request: HttpRequest, queryset: QuerySet[DeviceRegistration]
+    ) -> None:
+        user_ids = set(queryset.values_list("user_id", flat=True))
+        super().delete_queryset(request, queryset)
+        for user_id in user_ids:
+            DeviceRegistrationRepository.invalidate(user_id)
+
     def push_token_short(self, obj: DeviceRegistration) -> str:
         return (
             obj.push_token[:30] + "..." if len(obj.push_token) > 30 else obj.push_token
@@ -8,12 +8,17 @@ from datetime import datetime, timedelta, timezone
 from typing import Any, Dict, List, Optional
 
 import requests
+from django.conf import settings
 
+from sanatorio_allende.metrics import Metrics
 from sanatorio_allende.selenium_utils import SeleniumSettings, find_request, get_browser
+from sanatorio_allende.upstream_guard import UpstreamGuard
 
 HTTP_OK = 200
 HTTP_UNAUTHORIZED = 401
 
+DEFAULT_BASE_URL = "https://miportal.sanatorioallende.com/backend"
+
 
 class UnauthorizedException(Exception):
     pass
@@ -48,11 +53,29 @@ class Allende:
         self,
         auth_header: Optional[str] = None,
         selenium_settings: Optional[SeleniumSettings] = None,
+        session: Optional[requests.Session] = None,
     ):
         self.auth_header = auth_header
         self.selenium_settings = selenium_settings
+        self.session = session
         self.user_id = None
 
+    @classmethod
+    def url(cls, path: str) -> str:
+        """Full URL of a backend endpoint, ALLENDE_BASE_URL can point to a mock server"""
+        base_url = getattr(settings, "ALLENDE_BASE_URL", None) or DEFAULT_BASE_URL
+        return base_url.rstrip("/") + path
+
+    def _http(self) -> Any:
+        """HTTP client for upstream calls, a pooled session keeps connections warm"""
+        return self.session or requests
+
+    def _request(self, endpoint: str, method: str, url: str, **kwargs: Any) -> Any:
+        """Call an upstream endpoint through its rate limiter and circuit breaker"""
+        return UpstreamGuard.call(
+            endpoint, getattr(self._http(), method), url, **kwargs
+        )
+
     def get_user_id(self) -> Optional[str]:
         return self.user_id
 
@@ -61,8 +84,10 @@ class Allende:
 
     @classmethod
     def validate_credentials(cls, dni: str, password: str) -> bool:
-        data = requests.post(
-            "https://miportal.sanatorioallende.com/backend/Token",
+        data: requests.Response = UpstreamGuard.call(
+            "auth",
+            requests.post,
+            cls.url("/Token"),
             data={
                 "UserName": "",
                 "Password": base64.b64encode(password.encode("utf-8")).decode("utf-8"),
@@ -77,7 +102,7 @@ class Allende:
         return data.status_code == HTTP_OK
 
     def login(self, user: str, password: str) -> str:
-        if self.auth_header and self.is_authorized(self.auth_header):
+        if self.auth_header and self.is_authorized(self.auth_header, self.session):
             return self.auth_header
 
         if not self.selenium_settings:
@@ -144,8 +169,12 @@ class Allende:
             ]
         }
         """
-        response = requests.post(
-            "https://miportal.sanatorioallende.com/backend/api/TurnosBuscadorGenerico/ObtenerEspecialidadServicioProfesionalPorCriterio",
+        response = self._request(
+            "doctors",
+            "post",
+            self.url(
+                "/api/TurnosBuscadorGenerico/ObtenerEspecialidadServicioProfesionalPorCriterio"
+            ),
             headers={"authorization": self.auth_header},
             json={
                 "Criterio": pattern,
@@ -158,8 +187,10 @@ class Allende:
         if not self.user_id:
             raise Exception("User id not found")
 
-        response = requests.get(
-            f"https://miportal.sanatorioallende.com/backend/api/Paciente/ObtenerPorId/{self.user_id}",
+        response = self._request(
+            "patient",
+            "get",
+            self.url(f"/api/Paciente/ObtenerPorId/{self.user_id}"),
             headers={"authorization": self.auth_header},
         )
         data = response.json()
@@ -169,10 +200,14 @@ class Allende:
         )
 
     def book_appointment(self, appointment_data: dict) -> BookAppointmentResponse:
-        url = "https://miportal.sanatorioallende.com/backend/api/turnos/Asignar"
+        url = self.url("/api/turnos/Asignar")
 
-        response = requests.post(
-            url, headers={"authorization": self.auth_header}, json=appointment_data
+        response = self._request(
+            "book",
+            "post",
+            url,
+            headers={"authorization": self.auth_header},
+            json=appointment_data,
         )
 
         if response.status_code == HTTP_UNAUTHORIZED:
@@ -196,15 +231,19 @@ class Allende:
             "IdEntidadValidada": 0
         }
         """
-        url = "https://miportal.sanatorioallende.com/backend/api/turnos/CancelarTurno"
+        url = self.url("/api/turnos/CancelarTurno")
 
         data = {
             "IdTurno": appointment_id,
             "Observaciones": "Cancela paciente desde el portal",
             "IdMotivoDeAnulacionTurno": 1,
         }
-        response = requests.post(
-            url, headers={"authorization": self.auth_header}, json=data
+        response = self._request(
+            "cancel",
+            "post",
+            url,
+            headers={"authorization": self.auth_header},
+            json=data,
         )
 
         if response.status_code == HTTP_UNAUTHORIZED:
@@ -221,30 +260,65 @@ class Allende:
         )
 
     @classmethod
-    def is_authorized(cls, auth_header: str) -> bool:
-        response = requests.get(
-            "https://miportal.sanatorioallende.com/backend/api/GestionDeEspera/Totem/ObtenerOpcionesDelTotemPortal",
-            headers={"authorization": auth_header},
-        )
+    def is_authorized(
+        cls, auth_header: str, session: Optional[requests.Session] = None
+    ) -> bool:
+        with Metrics.timed("is_authorized"):
+            response: requests.Response = UpstreamGuard.call(
+                "auth",
+                (session or requests).get,
+                cls.url("/api/GestionDeEspera/Totem/ObtenerOpcionesDelTotemPortal"),
+                headers={"authorization": auth_header},
+            )
         return response.status_code == HTTP_OK
 
-    def search_best_date_appointment(self, doctor_data: dict) -> Optional[dict]:
-        """Searches the best date for an appointment with the given doctor"""
-        response = requests.post(
-            "https://miportal.sanatorioallende.com/backend/api/DisponibilidadDeTurnos/ObtenerPrimerTurnoAsignableParaPortalWebConParticular",
-            headers={"authorization": self.auth_header},
-            json=doctor_data,
-        )
+    def _search_first_slots(self, search_data: dict) -> List[dict]:
+        """Requests the first slot of each doctor matching a search"""
+        with Metrics.timed("search"):
+            response = self._request(
+                "search",
+                "post",
+                self.url(
+                    "/api/DisponibilidadDeTurnos/ObtenerPrimerTurnoAsignableParaPortalWebConParticular"
+                ),
+                headers={"authorization": self.auth_header},
+                json=search_data,
+            )
 
         if response.status_code == HTTP_UNAUTHORIZED:
             raise UnauthorizedException()
 
-        appointments = self._get_appointment_dates(response.json())
+        with Metrics.timed("parse"):
+            return self._get_appointment_dates(response.json())
+
+    def search_best_date_appointment(self, doctor_data: dict) -> Optional[dict]:
+        """Searches the best date for an appointment with the given doctor"""
+        appointments = self._search_first_slots(doctor_data)
         if not appointments:
             return None
 
         return min(appointments, key=lambda x: x["datetime"])
 
+    def search_first_slots_by_resource(self, search_data: dict) -> Dict[int, dict]:
+        """
+        Searches the first slot of every doctor of a specialty and branch
+
+        Args:
+            search_data: Search payload, with IdRecurso 0 to include every doctor
+
+        Returns:
+            Earliest slot of each doctor with availability, keyed by IdRecurso
+        """
+        first_slots: Dict[int, dict] = {}
+        for appointment in self._search_first_slots(search_data):
+            id_recurso = appointment["id_recurso"]
+            if id_recurso is None:
+                continue
+            current = first_slots.get(id_recurso)
+            if current is None or appointment["datetime"] < current["datetime"]:
+                first_slots[id_recurso] = appointment
+        return first_slots
+
     def _get_appointment_dates(self, data: List[dict]) -> List[dict]:
         """Parses the appointments from the response data to get the appointment dates and additional data"""
         appointments = []
@@ -264,6 +338,7 @@ class Allende:
                 "duracion_individual": turno.get("DuracionIndividual"),
                 "id_plantilla_turno": turno.get("IdPlantillaTurno"),
                 "id_item_plantilla": turno.get("IdItemDePlantilla"),
+                "id_recurso": turno.get("IdRecurso"),
             }
 
             appointments.append(appointment_data)
@@ -294,8 +369,12 @@ class Allende:
             }
         ]
         """
-        response = requests.get(
-            f"https://miportal.sanatorioallende.com/backend/api/PrestacionMedica/ObtenerPorRecursoEspecialidadServicioSucursalParaPortalWeb/0/0/{id_especialidad}/{id_servicio}/{id_sucursal}",
+        response = self._request(
+            "types",
+            "get",
+            self.url(
+                f"/api/PrestacionMedica/ObtenerPorRecursoEspecialidadServicioSucursalParaPortalWeb/0/0/{id_especialidad}/{id_servicio}/{id_sucursal}"
+            ),
             headers={"authorization": self.auth_header},
         )
 
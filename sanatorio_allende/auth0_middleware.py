@@ -83,6 +83,7 @@ class Auth0Middleware(MiddlewareMixin):
             "/admin/",
             "/login",
             "/auth/callback/",
+            "/metrics/",
         ]
         return any(path.startswith(skip_path) for skip_path in skip_paths)
 
@@ -0,0 +1,159 @@
+import json
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, List, Optional
+
+import psycopg
+from django.conf import settings
+from django.db import connections
+
+from sanatorio_allende.metrics import Metrics
+from sanatorio_allende.repositories.patient_version_repository import (
+    PatientVersionRepository,
+)
+
+logger = logging.getLogger(__name__)
+
+# Channel the triggers of migration 0019 notify on
+CHANNEL = "turnos_changes"
+NOTIFICATIONS_METRIC = "turnos_change_feed_notifications_total"
+
+
+@dataclass
+class ChangeNotification:
+    """A row of FindAppointment, BestAppointmentFound or AppointmentEvent was written"""
+
+    table: str
+    operation: str
+    id: int
+    patient_id: Optional[int]
+
+    @classmethod
+    def parse(cls, payload: str) -> "ChangeNotification":
+        """
+        Parse the JSON payload sent by the turnos_notify_change() trigger
+
+        Raises:
+            ValueError: If the payload is not a change notification
+        """
+        try:
+            data = json.loads(payload)
+            return cls(
+                table=data["table"],
+                operation=data["op"],
+                id=int(data["id"]),
+                patient_id=(
+                    int(data["patient_id"])
+                    if data.get("patient_id") is not None
+                    else None
+                ),
+            )
+        except (TypeError, KeyError, json.JSONDecodeError) as e:
+            raise ValueError(f"Invalid change notification: {payload!r}") from e
+
+
+ChangeHandler = Callable[[ChangeNotification], None]
+
+
+def invalidate_patient_version(notification: ChangeNotification) -> None:
+    """Invalidate the list ETags of the patient whose row changed"""
+    if notification.patient_id is not None:
+        PatientVersionRepository.bump(notification.patient_id)
+
+
+class ChangeFeedListener:
+    """
+    Reconnecting LISTEN client for the change notifications of the database
+
+    Holds one dedicated autocommit connection (outside Django's connection
+    handling) and calls every handler for each notification. A lost
+    connection is reopened with exponential backoff. Notifications sent
+    while disconnected are lost, so handlers must only speed up work that
+    is also done by polling.
+    """
+
+    def __init__(
+        self,
+        handlers: List[ChangeHandler],
+        alias: str = "default",
+        channel: str = CHANNEL,
+        stop_event: Optional[threading.Event] = None,
+    ):
+        self.handlers = handlers
+        self.alias = alias
+        self.channel = channel
+        self.stop_event = stop_event or threading.Event()
+        self.backoff = 1.0
+
+    @classmethod
+    def is_supported(cls, alias: str = "default") -> bool:
+        """Whether the database sends change notifications (PostgreSQL only)"""
+        return connections[alias].vendor == "postgresql"
+
+    def _idle_timeout(self) -> float:
+        # Wake up periodically to check the stop event
+        return float(getattr(settings, "CHANGE_FEED_IDLE_TIMEOUT", 5.0))
+
+    def _max_backoff(self) -> float:
+        return float(getattr(settings, "CHANGE_FEED_MAX_BACKOFF", 30.0))
+
+    def _connect(self) -> Any:
+        params = connections[self.alias].get_connection_params()
+        return psycopg.connect(**params, autocommit=True)
+
+    def dispatch(self, payload: str) -> None:
+        """Parse a notification payload and call the handlers"""
+        try:
+            notification = ChangeNotification.parse(payload)
+        except ValueError as e:
+            logger.warning(str(e))
+            return
+
+        Metrics.inc(
+            NOTIFICATIONS_METRIC,
+            table=notification.table,
+            operation=notification.operation,
+        )
+        for handler in self.handlers:
+            try:
+                handler(notification)
+            except Exception as e:
+                name = getattr(handler, "__name__", repr(handler))
+                logger.error(f"Change handler {name} failed: {str(e)}")
+
+    def listen_once(self) -> None:
+        """Open a connection and dispatch notifications until it fails or a stop is requested"""
+        conn = self._connect()
+        try:
+            conn.execute(f"LISTEN {self.channel}")
+            logger.info(f"Listening for changes on {self.channel}")
+            self.backoff = 1.0
+            while not self.stop_event.is_set():
+                for notify in conn.notifies(timeout=self._idle_timeout()):
+                    self.dispatch(notify.payload)
+                    if self.stop_event.is_set():
+                        break
+        finally:
+            conn.close()
+
+    def run(self) -> None:
+        """Listen until stop_event is set, reconnecting after failures"""
+        while not self.stop_event.is_set():
+            try:
+                self.listen_once()
+            except psycopg.Error as e:
+                logger.warning(
+                    f"Change feed connection lost: {str(e)}, "
+                    f"reconnecting in {self.backoff:.0f}s"
+                )
+                self.stop_event.wait(self.backoff)
+                self.backoff = min(self.backoff * 2, self._max_backoff())
+
+    def start_thread(self) -> threading.Thread:
+        """Run the listener in a daemon thread"""
+        thread = threading.Thread(
+            target=self.run, name=f"change-feed-{self.channel}", daemon=True
+        )
+        thread.start()
+        return thread
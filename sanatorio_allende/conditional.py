@@ -0,0 +1,95 @@
+import datetime
+import hashlib
+import math
+from typing import Optional
+
+from django.http import HttpRequest, HttpResponseNotModified
+from django.http.response import HttpResponseBase
+from django.utils import timezone
+from django.utils.http import parse_etags
+
+from sanatorio_allende.repositories.patient_version_repository import (
+    PatientVersionRepository,
+)
+
+
+class PatientListETag:
+    """
+    ETag of a patient's list response, for conditional GETs from the app
+
+    The tag combines the patient's change counter (bumped on every write, see
+    PatientVersionRepository), a hash of the query string and, for lists that
+    change with time, the moment the first listed row expires. An unchanged
+    poll is answered with a 304 before the list is queried or serialized.
+    """
+
+    def __init__(
+        self, request: HttpRequest, patient_id: int, version: Optional[int] = None
+    ):
+        self.request = request
+        # Read before the list, a change made while it is built bumps the version
+        self.version = (
+            PatientVersionRepository.get(patient_id) if version is None else version
+        )
+        query = "&".join(sorted(request.GET.urlencode().split("&")))
+        self.query_hash = hashlib.sha1(query.encode("utf-8")).hexdigest()[:12]
+        self.expires_at: Optional[datetime.datetime] = None
+
+    def expires(self, moment: datetime.datetime) -> None:
+        """Record that the response content changes by itself at this moment"""
+        if self.expires_at is None or moment < self.expires_at:
+            self.expires_at = moment
+
+    @property
+    def value(self) -> str:
+        tag = f"{self.version}-{self.query_hash}"
+        if self.expires_at is not None:
+            tag += f"-{math.floor(self.expires_at.timestamp())}"
+        return f'W/"{tag}"'
+
+    def _is_current(self, tag: str) -> bool:
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        parts = tag.strip('"').split("-")
+        if len(parts) not in (2, 3):
+            return False
+        if parts[:2] != [str(self.version), self.query_hash]:
+            return False
+        if len(parts) == 3:
+            try:
+                expires_at = int(parts[2])
+            except ValueError:
+                return False
+            return timezone.now().timestamp() < expires_at
+        return True
+
+    def not_modified(self) -> Optional[HttpResponseNotModified]:
+        """
+        Answer the request with a 304 if the client already has the current list
+
+        Returns:
+            HttpResponseNotModified, or None if the list has to be sent
+        """
+        if_none_match = self.request.headers.get("If-None-Match")
+        if not if_none_match:
+            return None
+
+        for tag in parse_etags(if_none_match):
+            if self._is_current(tag):
+                response = HttpResponseNotModified()
+                response["ETag"] = tag
+                response["Cache-Control"] = "private, no-cache"
+                return response
+        return None
+
+    def apply(self, response: HttpResponseBase) -> HttpResponseBase:
+        """
+        Add the ETag to a successful list response
+
+        Streaming responses send their headers before the rows are read, so
+        they are not tagged.
+        """
+        if response.status_code == 200 and not response.streaming:
+            response["ETag"] = self.value
+            response["Cache-Control"] = "private, no-cache"
+        return response
@@ -0,0 +1,197 @@
+import functools
+import logging
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connections
+from django.http import HttpRequest
+from django.http.response import HttpResponseBase
+from django.utils.deprecation import MiddlewareMixin
+
+from sanatorio_allende.metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+# Optional DATABASES alias of a streaming replica of "default"
+REPLICA_ALIAS = "replica"
+READ_ROUTING_METRIC = "turnos_read_routing_total"
+
+# Cache backends private to each process, pins stored there are not seen by
+# the other web processes nor written by the search worker
+PROCESS_LOCAL_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+# Set while a view decorated with read_from_replica runs
+_use_replica: ContextVar[bool] = ContextVar("use_replica", default=False)
+
+
+class ReadReplicaRouter:
+    """
+    Database router sending the reads of the list endpoints to the replica
+
+    Only the views decorated with read_from_replica read from the replica,
+    everything else (writes, the search worker, the admin) keeps using the
+    primary. Without a "replica" database every read goes to the primary.
+    """
+
+    def db_for_read(self, model: Any, **hints: Any) -> Optional[str]:
+        if _use_replica.get() and REPLICA_ALIAS in settings.DATABASES:
+            return REPLICA_ALIAS
+        return None
+
+    def db_for_write(self, model: Any, **hints: Any) -> Optional[str]:
+        return None
+
+    def allow_relation(self, obj1: Any, obj2: Any, **hints: Any) -> Optional[bool]:
+        # Both databases hold the same rows
+        return True
+
+    def allow_migrate(
+        self, db: str, app_label: str, model_name: Optional[str] = None, **hints: Any
+    ) -> Optional[bool]:
+        # The replica receives the schema from the primary
+        if db == REPLICA_ALIAS:
+            return False
+        return None
+
+
+class PrimaryStickiness:
+    """
+    Reads pinned to the primary right after a write (read-your-writes)
+
+    The replica lags behind the primary, so a list read right after a change
+    could miss it. A user is pinned after each of their PATCH, POST or DELETE
+    requests and a patient after each change to their searches or
+    appointments found (see PatientVersionRepository.bump), which also
+    covers the writes of the search worker and keeps the list ETags from
+    being attached to stale rows.
+
+    Pins live in the default cache, so they only work when it is shared by
+    every process (REDIS_URL). Without it the replica is not used.
+    """
+
+    @classmethod
+    def is_shared(cls) -> bool:
+        """Whether the pins are seen by every web process and the search worker"""
+        return settings.CACHES["default"]["BACKEND"] not in PROCESS_LOCAL_CACHES
+
+    CACHE_KEY_PREFIX = "primary_pin"
+
+    @classmethod
+    def _timeout(cls) -> int:
+        return int(getattr(settings, "READ_REPLICA_STICKY_SECONDS", 10))
+
+    @classmethod
+    def pin_user(cls, user_id: int) -> None:
+        cache.set(f"{cls.CACHE_KEY_PREFIX}:user:{user_id}", 1, cls._timeout())
+
+    @classmethod
+    def pin_patient(cls, patient_id: int) -> None:
+        cache.set(f"{cls.CACHE_KEY_PREFIX}:patient:{patient_id}", 1, cls._timeout())
+
+    @classmethod
+    def is_pinned(cls, user_id: Optional[int], patient_id: Optional[str]) -> bool:
+        """
+        Whether a read for this user and patient has to go to the primary
+
+        Args:
+            user_id: ID of the requesting user, None if anonymous
+            patient_id: patient_id parameter of the request, None if missing
+        """
+        keys = []
+        if user_id is not None:
+            keys.append(f"{cls.CACHE_KEY_PREFIX}:user:{user_id}")
+        if patient_id:
+            keys.append(f"{cls.CACHE_KEY_PREFIX}:patient:{patient_id}")
+        return bool(keys) and bool(cache.get_many(keys))
+
+
+class PrimaryStickinessMiddleware(MiddlewareMixin):
+    """Pin the user's reads to the primary after a successful write request"""
+
+    def process_response(
+        self, request: HttpRequest, response: HttpResponseBase
+    ) -> HttpResponseBase:
+        user = getattr(request, "user", None)
+        if (
+            request.method in ("POST", "PATCH", "PUT", "DELETE")
+            and response.status_code < 400
+            and user is not None
+            and user.is_authenticated
+        ):
+            PrimaryStickiness.pin_user(user.pk)
+        return response
+
+
+# Monotonic time until which the replica is considered down
+_replica_down_until = 0.0
+
+
+def replica_available() -> bool:
+    """
+    Whether the replica is configured and accepts connections
+
+    A failed connection sends the reads to the primary for
+    READ_REPLICA_RETRY_SECONDS before the replica is tried again.
+    """
+    global _replica_down_until
+
+    if REPLICA_ALIAS not in settings.DATABASES:
+        return False
+    if time.monotonic() < _replica_down_until:
+        return False
+    try:
+        connections[REPLICA_ALIAS].ensure_connection()
+    except DatabaseError as e:
+        logger.warning(f"Read replica unavailable, reading from the primary: {e}")
+        _replica_down_until = time.monotonic() + float(
+            getattr(settings, "READ_REPLICA_RETRY_SECONDS", 30)
+        )
+        return False
+    return True
+
+
+def read_from_replica(
+    view: Callable[..., HttpResponseBase],
+) -> Callable[..., HttpResponseBase]:
+    """
+    Run the queries of a read-only view on the replica
+
+    Falls back to the primary when there is no replica, the cache is not
+    shared, the replica is down, or the user or the requested patient_id
+    was written to moments ago.
+    """
+
+    @functools.wraps(view)
+    def wrapper(request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponseBase:
+        user = getattr(request, "user", None)
+        user_id = user.pk if user is not None and user.is_authenticated else None
+
+        if REPLICA_ALIAS not in settings.DATABASES:
+            return view(request, *args, **kwargs)
+        # The pins of the other processes are invisible, reads could be stale
+        if not PrimaryStickiness.is_shared():
+            Metrics.inc(
+                READ_ROUTING_METRIC, database="primary", reason="no_shared_cache"
+            )
+            return view(request, *args, **kwargs)
+        if PrimaryStickiness.is_pinned(user_id, request.GET.get("patient_id")):
+            Metrics.inc(READ_ROUTING_METRIC, database="primary", reason="pinned")
+            return view(request, *args, **kwargs)
+        if not replica_available():
+            Metrics.inc(READ_ROUTING_METRIC, database="primary", reason="unavailable")
+            return view(request, *args, **kwargs)
+
+        Metrics.inc(READ_ROUTING_METRIC, database="replica", reason="read_only")
+        token = _use_replica.set(True)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _use_replica.reset(token)
+
+    return wrapper
@@ -0,0 +1,273 @@
+import asyncio
+import datetime
+import json
+import logging
+import threading
+import time
+from typing import AsyncIterator, Dict, List, Optional, Set
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from sanatorio_allende.change_feed import ChangeFeedListener
+from sanatorio_allende.metrics import Metrics
+from sanatorio_allende.models import AppointmentEvent
+from sanatorio_allende.services.appointment_events import AppointmentEventService
+
+logger = logging.getLogger(__name__)
+
+CONNECTIONS_METRIC = "turnos_event_stream_connections_total"
+
+
+def format_event(event: AppointmentEvent) -> str:
+    """Format an AppointmentEvent as a server-sent event"""
+    data = json.dumps(
+        {
+            "id": event.id,
+            "type": event.event_type,
+            "payload": event.payload,
+            "created_at": event.created_at.isoformat(),
+        }
+    )
+    return f"id: {event.id}\nevent: {event.event_type}\ndata: {data}\n\n"
+
+
+class AppointmentEventBroadcaster:
+    """
+    Per-process fan-out of AppointmentEvent rows to the connected SSE clients
+
+    A single task per process reads the new events, so the database load does
+    not grow with the number of idle connections. Each client gets a bounded
+    queue. A client that falls behind is disconnected and resumes from its
+    last event ID when it reconnects.
+    """
+
+    QUEUE_SIZE = 100
+    BATCH_SIZE = 500
+    # Events are numbered when inserted but can commit out of order (e.g. a
+    # booking transaction), recent events below the last ID are checked again
+    LOOKBACK_SECONDS = 60
+
+    _subscribers: Dict[int, Set["asyncio.Queue[Optional[AppointmentEvent]]"]] = {}
+    _loop: Optional[asyncio.AbstractEventLoop] = None
+    _task: Optional["asyncio.Task[None]"] = None
+    _wakeup: Optional[asyncio.Event] = None
+    _last_id = 0
+    # Recently dispatched event IDs and when they were dispatched
+    _dispatched: Dict[int, float] = {}
+    _change_feed: Optional[threading.Thread] = None
+
+    @classmethod
+    def _poll_seconds(cls) -> float:
+        return float(getattr(settings, "APPOINTMENT_EVENTS_POLL_SECONDS", 1.0))
+
+    @classmethod
+    def _lookback_start(cls) -> datetime.datetime:
+        return timezone.now() - datetime.timedelta(seconds=cls.LOOKBACK_SECONDS)
+
+    @classmethod
+    def _start_change_feed(cls) -> None:
+        """Read new events as soon as the database notifies them (PostgreSQL only)"""
+        if cls._change_feed is not None and cls._change_feed.is_alive():
+            return
+        if not getattr(settings, "CHANGE_FEED_ENABLED", True):
+            return
+        if not ChangeFeedListener.is_supported():
+            return
+        cls._change_feed = ChangeFeedListener(
+            [lambda notification: cls.wake_up()]
+        ).start_thread()
+
+    @classmethod
+    def _start(cls) -> None:
+        """Skip the existing events, nobody was listening when they were written"""
+        cls._start_change_feed()
+        cls._last_id = AppointmentEventService.latest_id()
+        now = time.monotonic()
+        cls._dispatched = {
+            event_id: now
+            for event_id in AppointmentEventService.ids_since(
+                cls._lookback_start(), cls._last_id
+            )
+        }
+
+    @classmethod
+    def _read(cls) -> List[AppointmentEvent]:
+        """New events plus the recent ones that committed late"""
+        # Outlives every request, so its connection is never recycled by the
+        # request signals: drop it here if it broke or outlived CONN_MAX_AGE
+        close_old_connections()
+        events = AppointmentEventService.events_after(
+            cls._last_id, limit=cls.BATCH_SIZE
+        )
+        late_ids = AppointmentEventService.ids_since(
+            cls._lookback_start(), cls._last_id
+        ) - set(cls._dispatched)
+        if late_ids:
+            events = list(AppointmentEvent.objects.filter(id__in=late_ids)) + events
+        return events
+
+    @classmethod
+    async def subscribe(
+        cls, patient_id: int
+    ) -> "asyncio.Queue[Optional[AppointmentEvent]]":
+        """
+        Start receiving the events of a patient
+
+        Args:
+            patient_id: ID of the PacienteAllende
+
+        Returns:
+            Queue of events, a None item means the client fell behind
+        """
+        loop = asyncio.get_running_loop()
+        if cls._loop is not loop:
+            # A new event loop (e.g. a new test) cannot reuse the old task
+            cls._subscribers = {}
+            cls._task = None
+            cls._loop = loop
+            cls._wakeup = asyncio.Event()
+
+        if cls._task is None or cls._task.done():
+            await sync_to_async(cls._start)()
+            cls._task = loop.create_task(cls._run())
+
+        queue: "asyncio.Queue[Optional[AppointmentEvent]]" = asyncio.Queue(
+            maxsize=cls.QUEUE_SIZE
+        )
+        cls._subscribers.setdefault(patient_id, set()).add(queue)
+        return queue
+
+    @classmethod
+    def unsubscribe(
+        cls, patient_id: int, queue: "asyncio.Queue[Optional[AppointmentEvent]]"
+    ) -> None:
+        queues = cls._subscribers.get(patient_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del cls._subscribers[patient_id]
+
+    @classmethod
+    def connection_count(cls) -> int:
+        return sum(len(queues) for queues in cls._subscribers.values())
+
+    @classmethod
+    def wake_up(cls) -> None:
+        """Read the new events now instead of at the next poll, callable from any thread"""
+        loop, wakeup = cls._loop, cls._wakeup
+        if loop is not None and wakeup is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(wakeup.set)
+
+    @classmethod
+    def dispatch(cls, events: List[AppointmentEvent]) -> None:
+        """Hand the events to the queues of their patients"""
+        now = time.monotonic()
+        for event in events:
+            if event.id in cls._dispatched:
+                continue
+            cls._dispatched[event.id] = now
+            cls._last_id = max(cls._last_id, event.id)
+            for queue in list(cls._subscribers.get(event.patient_id, ())):
+                try:
+                    queue.put_nowait(event)
+                except asyncio.QueueFull:
+                    # Drop the slow client, it resumes from its Last-Event-ID
+                    cls.unsubscribe(event.patient_id, queue)
+                    queue.get_nowait()
+                    queue.put_nowait(None)
+
+        expired = now - 2 * cls.LOOKBACK_SECONDS
+        cls._dispatched = {
+            event_id: dispatched_at
+            for event_id, dispatched_at in cls._dispatched.items()
+            if dispatched_at > expired
+        }
+
+    @classmethod
+    async def _run(cls) -> None:
+        assert cls._wakeup is not None
+        wakeup = cls._wakeup
+        while cls._subscribers:
+            try:
+                events = await sync_to_async(cls._read)()
+                cls.dispatch(events)
+                if len(events) >= cls.BATCH_SIZE:
+                    continue
+            except Exception as e:
+                logger.error(f"Reading appointment events failed: {str(e)}")
+
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=cls._poll_seconds())
+            except asyncio.TimeoutError:
+                pass
+            wakeup.clear()
+
+
+class AppointmentEventStream:
+    """Server-sent event stream of the appointment changes of one patient"""
+
+    def __init__(self, patient_id: int, last_event_id: Optional[int]):
+        self.patient_id = patient_id
+        self.last_event_id = last_event_id
+        self.replayed_ids: Set[int] = set()
+
+    @classmethod
+    def _heartbeat_seconds(cls) -> float:
+        return float(getattr(settings, "APPOINTMENT_EVENTS_HEARTBEAT_SECONDS", 15.0))
+
+    async def _replay(self) -> AsyncIterator[str]:
+        """Events missed while the client was disconnected"""
+        assert self.last_event_id is not None
+        oldest_id = await sync_to_async(AppointmentEventService.oldest_id)()
+        if oldest_id is not None and oldest_id > self.last_event_id + 1:
+            # The missed events were purged, the app has to reload its list
+            yield "event: reset\ndata: {}\n\n"
+
+        while True:
+            events = await sync_to_async(AppointmentEventService.events_after)(
+                self.last_event_id, patient_id=self.patient_id
+            )
+            for event in events:
+                self.last_event_id = event.id
+                self.replayed_ids.add(event.id)
+                yield format_event(event)
+            if len(events) < AppointmentEventBroadcaster.BATCH_SIZE:
+                return
+
+    async def events(self) -> AsyncIterator[str]:
+        """
+        Yield the SSE stream until the client disconnects
+
+        Yields:
+            Server-sent event blocks, with a comment line as heartbeat
+        """
+        # Subscribe before replaying so no event falls between the two
+        queue = await AppointmentEventBroadcaster.subscribe(self.patient_id)
+        Metrics.inc(CONNECTIONS_METRIC)
+        try:
+            yield f"retry: {int(self._heartbeat_seconds() * 1000)}\n\n"
+            if self.last_event_id is not None:
+                async for block in self._replay():
+                    yield block
+
+            while True:
+                try:
+                    event = await asyncio.wait_for(
+                        queue.get(), timeout=self._heartbeat_seconds()
+                    )
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                    continue
+
+                if event is None:
+                    # Fell behind, closing makes the client resume from the database
+                    return
+                if event.id in self.replayed_ids:
+                    continue
+                yield format_event(event)
+        finally:
+            AppointmentEventBroadcaster.unsubscribe(self.patient_id, queue)
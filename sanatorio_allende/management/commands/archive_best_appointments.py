@@ -0,0 +1,51 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from sanatorio_allende.services.best_appointment_archive import (
+    BestAppointmentArchiveService,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the appointments found whose date is past "
+        "BEST_APPOINTMENT_ARCHIVE_AFTER_HOURS to the archive table, in small batches"
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Rows moved per transaction",
+        )
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0.1,
+            help="Seconds to wait between batches",
+        )
+        parser.add_argument(
+            "--max-batches",
+            type=int,
+            default=None,
+            help="Stop after this many batches, the next run continues",
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        result = BestAppointmentArchiveService.archive(
+            batch_size=options["batch_size"],
+            pause_seconds=options["pause"],
+            max_batches=options["max_batches"],
+        )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Archived {result.archived} best appointments in {result.batches} batches"
+            )
+        )
+        if not result.complete:
+            self.stdout.write(
+                self.style.WARNING("Stopped at --max-batches, rows are left to archive")
+            )
@@ -0,0 +1,151 @@
+import argparse
+import copy
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.db.utils import load_backend
+
+from sanatorio_allende.management.commands.benchmark_search import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the per-request database connection latency with and "
+        "without the connection pool"
+    )
+
+    def add_arguments(self, parser: argparse.ArgumentParser) -> None:
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=200,
+            help="Simulated requests per mode, each one connects, queries and releases",
+        )
+        parser.add_argument(
+            "--database",
+            default="default",
+            help="Database alias to benchmark",
+        )
+        parser.add_argument(
+            "--output",
+            help="Write the results as JSON to this path",
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        alias = options["database"]
+        settings_dict = connections.settings[alias]
+
+        requests = options["requests"]
+        results = [self.run_benchmark(alias, settings_dict, requests, "direct", None)]
+        if connections[alias].vendor == "postgresql":
+            pool_options = {
+                **getattr(settings, "DB_POOL_OPTIONS", {}),
+                **settings_dict["OPTIONS"].get("pool", {}),
+            }
+            results.append(
+                self.run_benchmark(
+                    alias, settings_dict, requests, "pooled", pool_options
+                )
+            )
+        else:
+            self.stdout.write(
+                self.style.WARNING("Connection pooling requires PostgreSQL, skipped")
+            )
+
+        for result in results:
+            self.stdout.write(
+                f"mode={result['mode']:<7} requests={result['requests']} "
+                f"connect_p50={result['connect_p50_ms']:.2f}ms "
+                f"connect_p99={result['connect_p99_ms']:.2f}ms "
+                f"request_p50={result['request_p50_ms']:.2f}ms "
+                f"request_p99={result['request_p99_ms']:.2f}ms"
+            )
+        if len(results) == 2 and results[0]["connect_p50_ms"]:
+            reduction = 1 - results[1]["connect_p50_ms"] / results[0]["connect_p50_ms"]
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Pooling cuts p50 connect latency by {reduction:.0%}"
+                )
+            )
+
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump(results, output, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def create_wrapper(
+        self,
+        alias: str,
+        settings_dict: Dict[str, Any],
+        pool_options: Optional[Dict[str, Any]],
+    ) -> BaseDatabaseWrapper:
+        """Build a separate connection handler, pooled or not, for the same database"""
+        benchmark_settings = copy.copy(settings_dict)
+        benchmark_settings["OPTIONS"] = {
+            key: value
+            for key, value in settings_dict["OPTIONS"].items()
+            if key != "pool"
+        }
+        # A request of the web process closes its connection at the end
+        benchmark_settings["CONN_MAX_AGE"] = 0
+        if pool_options is not None:
+            benchmark_settings["OPTIONS"]["pool"] = pool_options
+
+        backend = load_backend(benchmark_settings["ENGINE"])
+        wrapper: BaseDatabaseWrapper = backend.DatabaseWrapper(
+            benchmark_settings, alias=f"{alias}_benchmark"
+        )
+        return wrapper
+
+    def run_benchmark(
+        self,
+        alias: str,
+        settings_dict: Dict[str, Any],
+        requests: int,
+        mode: str,
+        pool_options: Optional[Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        """Connect, run a query and release the connection once per simulated request"""
+        wrapper = self.create_wrapper(alias, settings_dict, pool_options)
+        connect_seconds: List[float] = []
+        request_seconds: List[float] = []
+        try:
+            for _ in range(requests):
+                started = time.perf_counter()
+                wrapper.ensure_connection()
+                connected = time.perf_counter()
+                with wrapper.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                    cursor.fetchone()
+                # Returns a pooled connection to the pool, closes a direct one
+                wrapper.close()
+                connect_seconds.append(connected - started)
+                request_seconds.append(time.perf_counter() - started)
+        finally:
+            wrapper.close()
+            close_pool = getattr(wrapper, "close_pool", None)
+            if close_pool is not None:
+                close_pool()
+
+        return {
+            "mode": mode,
+            "requests": len(request_seconds),
+            "pool": (
+                {
+                    key: value
+                    for key, value in pool_options.items()
+                    if isinstance(value, (int, float, str))
+                }
+                if pool_options is not None
+                else None
+            ),
+            "connect_p50_ms": percentile(connect_seconds, 50) * 1000,
+            "connect_p99_ms": percentile(connect_seconds, 99) * 1000,
+            "request_p50_ms": percentile(request_seconds, 50) * 1000,
+            "request_p99_ms": percentile(request_seconds, 99) * 1000,
+        }
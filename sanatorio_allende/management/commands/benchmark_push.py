@@ -0,0 +1,190 @@
+import argparse
+import json
+import logging
+import time
+import uuid
+from typing import Any, Dict, List
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+
+from sanatorio_allende.management.commands.benchmark_search import (
+    BenchmarkRollback,
+    percentile,
+)
+from sanatorio_allende.mock_expo import (
+    UNREGISTERED_TOKEN_MARKER,
+    MockExpoConfig,
+    MockExpoServer,
+)
+from sanatorio_allende.models import DeviceRegistration
+from sanatorio_allende.repositories.device_registration_repository import (
+    DeviceRegistrationRepository,
+)
+from sanatorio_allende.services.push_notifications import PushNotificationService
+
+PUSH_LOGGER = "sanatorio_allende.services.push_notifications"
+
+
+class Command(BaseCommand):
+    help = "Benchmark push notification sending against a local mock Expo service"
+
+    def add_arguments(self, parser: argparse.ArgumentParser) -> None:
+        parser.add_argument(
+            "--devices",
+            default="1,100,1000,5000",
+            help="Comma separated device counts to benchmark (default: 1,100,1000,5000)",
+        )
+        parser.add_argument(
+            "--batch-sizes",
+            default="1,10,50,100",
+            help="Comma separated Expo batch sizes to benchmark, at most 100",
+        )
+        parser.add_argument(
+            "--unregistered-devices",
+            type=float,
+            default=0.0,
+            help="Fraction of the devices whose token Expo reports as unregistered",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=1,
+            help="Sends measured for each device count and batch size",
+        )
+        parser.add_argument(
+            "--output",
+            default=None,
+            help="Write the results as JSON to this path",
+        )
+        MockExpoConfig.add_arguments(parser)
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        device_counts = [int(count) for count in options["devices"].split(",")]
+        batch_sizes = [int(size) for size in options["batch_sizes"].split(",")]
+        server = MockExpoServer(("127.0.0.1", 0), MockExpoConfig.from_options(options))
+        server.start_in_background()
+        self.stdout.write(f"Mock Expo service running at {server.root_url}")
+
+        # Every message and receipt is logged, which would dominate the timings
+        push_logger = logging.getLogger(PUSH_LOGGER)
+        previous_level = push_logger.level
+        push_logger.setLevel(logging.CRITICAL)
+
+        results = []
+        try:
+            for device_count in device_counts:
+                for batch_size in batch_sizes:
+                    with override_settings(
+                        EXPO_PUSH_URL=server.push_url,
+                        EXPO_RECEIPT_URL=server.receipt_url,
+                        EXPO_PUSH_BATCH_SIZE=batch_size,
+                    ):
+                        result = self.run_benchmark(
+                            device_count,
+                            batch_size,
+                            options["unregistered_devices"],
+                            options["repeat"],
+                        )
+                    results.append(result)
+                    self.stdout.write(
+                        f"devices={result['devices']:<6} "
+                        f"batch={result['batch_size']:<4} "
+                        f"send={result['send_messages_per_second']:.1f} msg/s "
+                        f"send_p50={result['send_p50_ms']:.1f}ms "
+                        f"send_p99={result['send_p99_ms']:.1f}ms "
+                        f"receipts={result['receipts_per_second']:.1f} receipts/s "
+                        f"receipts_p50={result['receipts_p50_ms']:.1f}ms "
+                        f"unregistered={result['unregistered']}"
+                    )
+        finally:
+            push_logger.setLevel(previous_level)
+            server.stop()
+
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump(results, output, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def create_fixtures(self, device_count: int, unregistered_devices: float) -> User:
+        """Create a user with the given number of active devices"""
+        user = User.objects.create_user(username=f"benchmark-{uuid.uuid4().hex}")
+        unregistered_count = int(device_count * unregistered_devices)
+        DeviceRegistration.objects.bulk_create(
+            DeviceRegistration(
+                user=user,
+                push_token=(
+                    f"ExponentPushToken[{UNREGISTERED_TOKEN_MARKER}-{uuid.uuid4().hex}]"
+                    if index < unregistered_count
+                    else f"ExponentPushToken[{uuid.uuid4().hex}]"
+                ),
+            )
+            for index in range(device_count)
+        )
+        return user
+
+    def run_benchmark(
+        self,
+        device_count: int,
+        batch_size: int,
+        unregistered_devices: float,
+        repeat: int,
+    ) -> Dict[str, Any]:
+        """Send to every device of a fresh user and check the receipts, then roll back"""
+        send_seconds: List[float] = []
+        receipt_seconds: List[float] = []
+        sent_count = 0
+        receipt_count = 0
+        unregistered = 0
+        try:
+            with transaction.atomic():
+                user = self.create_fixtures(device_count, unregistered_devices)
+                for _ in range(repeat):
+                    # Devices deactivated by the previous send are registered again
+                    DeviceRegistration.objects.filter(user=user).update(is_active=True)
+                    DeviceRegistrationRepository.invalidate(user.id)
+
+                    started = time.perf_counter()
+                    result = PushNotificationService.send_notification(
+                        title="Benchmark",
+                        body="Benchmark notification",
+                        data={"type": "benchmark"},
+                        user=user,
+                    )
+                    send_seconds.append(time.perf_counter() - started)
+                    sent_count += result["sent_count"]
+                    unregistered += len(result.get("errors", []))
+
+                    receipt_ids = result.get("receipt_ids", [])
+                    if receipt_ids:
+                        started = time.perf_counter()
+                        PushNotificationService.check_push_receipts(receipt_ids)
+                        receipt_seconds.append(time.perf_counter() - started)
+                        receipt_count += len(receipt_ids)
+                DeviceRegistrationRepository.invalidate(user.id)
+                raise BenchmarkRollback()
+        except BenchmarkRollback:
+            pass
+
+        messages = device_count * repeat
+        return {
+            "devices": device_count,
+            "batch_size": batch_size,
+            "repeat": repeat,
+            "sent": sent_count,
+            "unregistered": unregistered,
+            "send_seconds": sum(send_seconds),
+            "send_messages_per_second": (
+                messages / sum(send_seconds) if sum(send_seconds) else 0
+            ),
+            "send_p50_ms": percentile(send_seconds, 50) * 1000,
+            "send_p99_ms": percentile(send_seconds, 99) * 1000,
+            "receipt_seconds": sum(receipt_seconds),
+            "receipts_per_second": (
+                receipt_count / sum(receipt_seconds) if sum(receipt_seconds) else 0
+            ),
+            "receipts_p50_ms": percentile(receipt_seconds, 50) * 1000,
+            "receipts_p99_ms": percentile(receipt_seconds, 99) * 1000,
+        }
@@ -0,0 +1,208 @@
+import argparse
+import json
+import math
+import uuid
+from contextlib import redirect_stdout
+from io import StringIO
+from typing import Any, Dict, List
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+
+from sanatorio_allende.management.commands.find_appointments import (
+    Command as FindAppointmentsCommand,
+)
+from sanatorio_allende.mock_allende import MockAllendeConfig, MockAllendeServer
+from sanatorio_allende.mock_expo import MockExpoConfig, MockExpoServer
+from sanatorio_allende.models import FindAppointment, PacienteAllende
+from sanatorio_allende.profiling import RunProfiler
+from sanatorio_allende.upstream_guard import UpstreamGuard
+
+# The benchmark measures the pipeline, not the production rate limits
+UNLIMITED_UPSTREAM = {
+    "default": {"rate": 1e9, "burst": 1e9, "failure_threshold": 1e9, "timeout": 30}
+}
+
+# Cache writes of the fixtures are not undone by the rollback, keep them apart
+BENCHMARK_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "benchmark-search",
+    }
+}
+
+
+class BenchmarkRollback(Exception):
+    """Raised to roll back the benchmark fixtures"""
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """Nearest-rank percentile of a list of values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(percent / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class Command(BaseCommand):
+    help = "Benchmark find_appointments against a local mock Allende backend"
+
+    def add_arguments(self, parser: argparse.ArgumentParser) -> None:
+        parser.add_argument(
+            "--patients",
+            default="10,100,1000",
+            help="Comma separated patient counts to benchmark (default: 10,100,1000)",
+        )
+        parser.add_argument(
+            "--searches-per-patient",
+            type=int,
+            default=1,
+            help="Active searches created for each patient",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=50,
+            help="Patients claimed at once by the search worker",
+        )
+        parser.add_argument(
+            "--output",
+            default=None,
+            help="Write the results as JSON to this path",
+        )
+        MockAllendeConfig.add_arguments(parser)
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        patient_counts = [int(count) for count in options["patients"].split(",")]
+        server = MockAllendeServer(
+            ("127.0.0.1", 0), MockAllendeConfig.from_options(options)
+        )
+        server.start_in_background()
+        self.stdout.write(f"Mock Allende backend running at {server.base_url}")
+        # Pushes for the fake slots must never reach real devices
+        expo_server = MockExpoServer(
+            ("127.0.0.1", 0), MockExpoConfig(latency_ms=0, jitter_ms=0)
+        )
+        expo_server.start_in_background()
+
+        results = []
+        try:
+            with override_settings(
+                ALLENDE_BASE_URL=server.base_url,
+                ALLENDE_UPSTREAM_LIMITS=UNLIMITED_UPSTREAM,
+                EXPO_PUSH_URL=expo_server.push_url,
+                EXPO_RECEIPT_URL=expo_server.receipt_url,
+                CACHES=BENCHMARK_CACHES,
+            ):
+                UpstreamGuard.reset()
+                for patient_count in patient_counts:
+                    result = self.run_benchmark(
+                        patient_count,
+                        options["searches_per_patient"],
+                        options["batch_size"],
+                    )
+                    results.append(result)
+                    self.stdout.write(
+                        f"patients={result['patients']:<6} "
+                        f"searches={result['searches']:<6} "
+                        f"wall={result['wall_seconds']:.2f}s "
+                        f"throughput={result['searches_per_second']:.1f} searches/s "
+                        f"p50={result['search_p50_ms']:.1f}ms "
+                        f"p99={result['search_p99_ms']:.1f}ms "
+                        f"allende_calls={result['upstream_calls']}"
+                    )
+        finally:
+            server.stop()
+            expo_server.stop()
+            UpstreamGuard.reset()
+
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump(results, output, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def create_fixtures(
+        self, patient_count: int, searches_per_patient: int
+    ) -> List[int]:
+        """Create patients with a token accepted by the mock and their searches"""
+        user = User.objects.create_user(username=f"benchmark-{uuid.uuid4().hex}")
+        patients = PacienteAllende.objects.bulk_create(
+            PacienteAllende(
+                user=user,
+                name=f"Benchmark {index}",
+                id_paciente=str(index + 1),
+                docid=str(index + 1),
+                password="benchmark",
+                token="mock-token",
+                id_financiador=1,
+                id_plan=1,
+            )
+            for index in range(patient_count)
+        )
+        FindAppointment.objects.bulk_create(
+            FindAppointment(
+                patient=patient,
+                doctor_name=f"Benchmark doctor {index}",
+                id_servicio=1,
+                servicio="Benchmark",
+                id_sucursal=1,
+                sucursal="Benchmark",
+                id_especialidad=1,
+                especialidad="Benchmark",
+                id_recurso=index + 1,
+                id_tipo_recurso=1,
+                id_prestacion=5495,
+                id_tipo_prestacion=1,
+                nombre_tipo_prestacion="CONSULTA",
+                desired_timeframe=FindAppointment.DEFAULT_DESIRED_TIMEFRAME,
+                active=True,
+            )
+            for patient in patients
+            for index in range(searches_per_patient)
+        )
+        return [patient.id for patient in patients]
+
+    def run_benchmark(
+        self, patient_count: int, searches_per_patient: int, batch_size: int
+    ) -> Dict[str, Any]:
+        """Run one search cycle over fresh fixtures and roll everything back"""
+        profiler = RunProfiler(cprofile=False)
+        try:
+            with transaction.atomic():
+                patient_ids = self.create_fixtures(patient_count, searches_per_patient)
+
+                command_output = StringIO()
+                command = FindAppointmentsCommand(stdout=command_output)
+                # Real patients must not be searched against the mock
+                command.patient_ids = set(patient_ids)
+                command.batch_size = batch_size
+                command.profiler = profiler
+                profiler.start()
+                # The notification services print, keep the benchmark output readable
+                with redirect_stdout(command_output):
+                    command.run_cycle()
+                profiler.stop()
+                raise BenchmarkRollback()
+        except BenchmarkRollback:
+            pass
+
+        report = profiler.report()
+        latencies = [
+            search["wall_seconds"]
+            for patient in report["patients"]
+            for search in patient["searches"]
+        ]
+        wall_seconds = report["wall_seconds"]
+        return {
+            "patients": patient_count,
+            "searches": len(latencies),
+            "wall_seconds": wall_seconds,
+            "searches_per_second": len(latencies) / wall_seconds if wall_seconds else 0,
+            "search_p50_ms": percentile(latencies, 50) * 1000,
+            "search_p99_ms": percentile(latencies, 99) * 1000,
+            "upstream_calls": int(sum(report["upstream_calls"].values())),
+            "stages": report["stages"],
+        }
@@ -0,0 +1,138 @@
+import datetime
+import json
+from typing import Any, Dict, List
+
+from django.core.management.base import BaseCommand, CommandParser
+from django.utils import timezone
+
+from sanatorio_allende.models import SlotObservation
+from sanatorio_allende.services.polling_scheduler import PollingScheduler
+from sanatorio_allende.services.slot_release_predictor import (
+    PolicyResult,
+    SlotReleasePredictor,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Evaluate the slot release predictor offline: fit it on older slot history "
+        "and replay the most recent releases against fixed and predictive polling"
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--train-days",
+            type=int,
+            default=42,
+            help="Days of history the model is fitted on",
+        )
+        parser.add_argument(
+            "--test-days",
+            type=int,
+            default=14,
+            help="Most recent days the policies are replayed on",
+        )
+        parser.add_argument(
+            "--id-recurso",
+            type=int,
+            default=None,
+            help="Only evaluate this doctor",
+        )
+        parser.add_argument(
+            "--base-interval",
+            type=int,
+            default=int(
+                PollingScheduler.BASE_INTERVALS["2 weeks"].total_seconds() // 60
+            ),
+            help="Minutes between the polls of the fixed policy",
+        )
+        parser.add_argument(
+            "--burst-interval",
+            type=int,
+            default=1,
+            help="Minutes between the polls inside a predicted window",
+        )
+        parser.add_argument(
+            "--output",
+            default=None,
+            help="Write the results as JSON to this path",
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        test_until = timezone.now()
+        test_since = test_until - datetime.timedelta(days=options["test_days"])
+        train_since = test_since - datetime.timedelta(days=options["train_days"])
+
+        doctors = SlotObservation.objects.filter(observed_at__gte=train_since)
+        if options["id_recurso"] is not None:
+            doctors = doctors.filter(id_recurso=options["id_recurso"])
+        pairs = sorted(set(doctors.values_list("id_recurso", "id_servicio").distinct()))
+
+        results: List[Dict[str, Any]] = []
+        baseline_total = PolicyResult()
+        predictive_total = PolicyResult()
+        for id_recurso, id_servicio in pairs:
+            evaluation = SlotReleasePredictor.evaluate(
+                id_recurso,
+                id_servicio,
+                train_since,
+                test_since,
+                test_until,
+                base_interval=datetime.timedelta(minutes=options["base_interval"]),
+                burst_interval=datetime.timedelta(minutes=options["burst_interval"]),
+                slow_factor=PollingScheduler.OUTSIDE_RELEASE_WINDOW_FACTOR,
+            )
+            for total, result in (
+                (baseline_total, evaluation.baseline),
+                (predictive_total, evaluation.predictive),
+            ):
+                total.requests += result.requests
+                total.releases += result.releases
+                total.caught += result.caught
+
+            windows = [window.describe() for window in evaluation.model.windows]
+            self.stdout.write(
+                f"recurso={id_recurso} servicio={id_servicio} "
+                f"windows=[{', '.join(windows)}] releases={evaluation.baseline.releases} "
+                f"caught fixed={evaluation.baseline.caught}/{evaluation.baseline.requests} "
+                f"predictive={evaluation.predictive.caught}/{evaluation.predictive.requests}"
+            )
+            results.append(
+                {
+                    "id_recurso": id_recurso,
+                    "id_servicio": id_servicio,
+                    "windows": windows,
+                    "fixed": self._policy(evaluation.baseline),
+                    "predictive": self._policy(evaluation.predictive),
+                }
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Catches per 1000 requests: "
+                f"fixed={baseline_total.catches_per_1000_requests:.2f} "
+                f"predictive={predictive_total.catches_per_1000_requests:.2f} "
+                f"({len(pairs)} doctors, {baseline_total.releases} releases)"
+            )
+        )
+
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump(
+                    {
+                        "doctors": results,
+                        "fixed": self._policy(baseline_total),
+                        "predictive": self._policy(predictive_total),
+                    },
+                    output,
+                    indent=2,
+                )
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def _policy(self, result: PolicyResult) -> Dict[str, Any]:
+        return {
+            "requests": result.requests,
+            "releases": result.releases,
+            "caught": result.caught,
+            "catches_per_1000_requests": result.catches_per_1000_requests,
+        }
@@ -1,22 +1,117 @@
+import datetime
+import signal
+import threading
 import time
-from typing import Any
+from contextlib import nullcontext
+from typing import Any, ContextManager, Dict, List, Optional, Set, Tuple
 
+import requests
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.core.management.base import BaseCommand
-from django.db import connection
+from django.core.management.base import BaseCommand, CommandParser
+from django.db import close_old_connections, connection
+from django.utils import timezone
 
 from sanatorio_allende.allende_api import Allende
-from sanatorio_allende.models import FindAppointment, PacienteAllende
+from sanatorio_allende.metrics import Metrics
+from sanatorio_allende.models import FindAppointment, PacienteAllende, SlotObservation
+from sanatorio_allende.profiling import RunProfiler
+from sanatorio_allende.repositories.device_registration_repository import (
+    DeviceRegistrationRepository,
+)
+from sanatorio_allende.repositories.slot_observation_repository import (
+    SlotObservationRepository,
+)
+from sanatorio_allende.services.appointment_events import AppointmentEventService
 from sanatorio_allende.services.appointment_handler import (
     AppointmentActionType,
     AppointmentHandler,
+    AppointmentProcessingResult,
 )
+from sanatorio_allende.services.appointment_processor import AppointmentProcessor
 from sanatorio_allende.services.auth import AllendeAuthService
+from sanatorio_allende.services.polling_scheduler import PollingScheduler
+from sanatorio_allende.services.search_fingerprint import SearchFingerprintService
+from sanatorio_allende.services.search_groups import SearchGroupService
+from sanatorio_allende.services.work_lease import PatientLeaseService
+from sanatorio_allende.upstream_guard import CircuitOpenException
 
 
 class Command(BaseCommand):
     help = "Find medical appointments"
 
+    # Buffered slot observations written before the end of a long cycle
+    SLOT_OBSERVATIONS_FLUSH_SIZE = 1000
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.daemon = False
+        self.stop_event = threading.Event()
+        # Warm per-patient state kept between daemon cycles
+        self.sessions: Dict[int, requests.Session] = {}
+        self.verified_tokens: Dict[int, Tuple[str, float]] = {}
+        self.worker_id = PatientLeaseService.default_worker_id()
+        self.lease_seconds = int(getattr(settings, "WORKER_LEASE_SECONDS", 300))
+        self.batch_size = int(getattr(settings, "WORKER_BATCH_SIZE", 10))
+        # Restricts the cycle to these patients (e.g. benchmark fixtures)
+        self.patient_ids: Optional[Set[int]] = None
+        self.metrics_file: Optional[str] = None
+        self.profile_path: Optional[str] = None
+        self.profile_top = 20
+        self.profiler: Optional[RunProfiler] = None
+        # Slot changes seen in the cycle, bulk inserted at its end
+        self.slot_observations: List[SlotObservation] = []
+        # Next polls are scheduled from the start of the cycle, not from the
+        # end of a slow login, so they stay aligned with the cron ticks
+        self.cycle_started_at: Optional[datetime.datetime] = None
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--daemon",
+            action="store_true",
+            help="Stay resident and run a search cycle every --interval seconds",
+        )
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=None,
+            help="Seconds between the start of two daemon cycles",
+        )
+        parser.add_argument(
+            "--worker-id",
+            default=None,
+            help="Unique ID of this worker replica (defaults to hostname:pid)",
+        )
+        parser.add_argument(
+            "--lease-seconds",
+            type=int,
+            default=None,
+            help="How long a claimed patient stays reserved for this worker",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Number of patients claimed at once",
+        )
+        parser.add_argument(
+            "--metrics-file",
+            default=None,
+            help="Write Prometheus metrics to this file after every cycle",
+        )
+        parser.add_argument(
+            "--profile",
+            default=None,
+            metavar="REPORT_PATH",
+            help="Profile every cycle and write a JSON report to this path",
+        )
+        parser.add_argument(
+            "--profile-top",
+            type=int,
+            default=20,
+            help="Number of functions, stages and patients in the profile summary",
+        )
+
     def check_database_connectivity(
         self, max_retries: int = 10, retry_delay: int = 2
     ) -> bool:
@@ -62,76 +157,387 @@ class Command(BaseCommand):
         return False
 
     def handle(self, *args: Any, **options: Any) -> None:
-        if not self.check_database_connectivity():
+        self.metrics_file = options["metrics_file"] or getattr(
+            settings, "FIND_APPOINTMENTS_METRICS_FILE", None
+        )
+        self.profile_path = options["profile"]
+        self.profile_top = options["profile_top"]
+
+        with Metrics.timed("db_connectivity"):
+            connected = self.check_database_connectivity()
+        if not connected:
             self.stdout.write(
                 self.style.ERROR("Cannot proceed without database connectivity")
             )
             return
 
-        self.stdout.write("Starting appointment search...")
+        self.worker_id = options["worker_id"] or self.worker_id
+        self.lease_seconds = options["lease_seconds"] or self.lease_seconds
+        self.batch_size = options["batch_size"] or self.batch_size
 
-        for patient in PacienteAllende.objects.all():
-            assert isinstance(patient.id_paciente, str)
-            assert isinstance(patient.user, User)
+        if not options["daemon"]:
+            self.run_cycle()
+            return
 
-            auth_service = AllendeAuthService(patient)
-            auth_service.login()
+        interval = options["interval"] or int(
+            getattr(settings, "FIND_APPOINTMENTS_TICK_SECONDS", 60)
+        )
+        self.run_daemon(interval)
 
-            allende = Allende(patient.token)
-            appointments_to_find = FindAppointment.objects.filter(
-                active=True, patient=patient
-            )
+    def request_stop(self, signum: int, frame: Any) -> None:
+        """Signal handler, lets the current patient finish and then exits"""
+        self.stdout.write(f"Received signal {signum}, stopping after current patient")
+        self.stop_event.set()
 
-            self.stdout.write(
-                f"Found {appointments_to_find.count()} active appointments to check"
+    def run_daemon(self, interval: int) -> None:
+        """
+        Run search cycles until SIGTERM/SIGINT is received
+
+        Args:
+            interval: Seconds between the start of two cycles
+        """
+        self.daemon = True
+        previous_handlers = {
+            signum: signal.signal(signum, self.request_stop)
+            for signum in (signal.SIGTERM, signal.SIGINT)
+        }
+        self.stdout.write(f"Starting search daemon, one cycle every {interval}s")
+
+        try:
+            while not self.stop_event.is_set():
+                cycle_started = time.monotonic()
+                # Drop connections that broke or outlived CONN_MAX_AGE, keep the rest
+                # (pooled connections go back to the pool between cycles)
+                close_old_connections()
+                try:
+                    self.run_cycle()
+                except Exception as e:
+                    self.stdout.write(self.style.ERROR(f"Search cycle failed: {e}"))
+
+                remaining = interval - (time.monotonic() - cycle_started)
+                if remaining > 0:
+                    self.stop_event.wait(remaining)
+        finally:
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+            for session in self.sessions.values():
+                session.close()
+            self.sessions.clear()
+            connection.close()
+            self.stdout.write(self.style.SUCCESS("Search daemon stopped"))
+
+    def get_allende(self, patient: PacienteAllende) -> Allende:
+        """
+        Get an Allende client authenticated as the patient
+
+        In daemon mode the HTTP session is reused across cycles and a token
+        verified recently is trusted without logging in again.
+
+        Args:
+            patient: The PacienteAllende to authenticate
+
+        Returns:
+            Allende client with the patient token
+        """
+        if not self.daemon:
+            with Metrics.timed("login"):
+                AllendeAuthService(patient).login()
+            return Allende(patient.token)
+
+        session = self.sessions.get(patient.id)
+        if session is None:
+            session = self.sessions[patient.id] = requests.Session()
+
+        recheck_seconds = int(getattr(settings, "ALLENDE_TOKEN_RECHECK_SECONDS", 600))
+        verified: Optional[Tuple[str, float]] = self.verified_tokens.get(patient.id)
+        if (
+            verified is None
+            or verified[0] != patient.token
+            or time.monotonic() - verified[1] > recheck_seconds
+        ):
+            with Metrics.timed("login"):
+                token = AllendeAuthService(patient, session=session).login()
+            self.verified_tokens[patient.id] = (token, time.monotonic())
+
+        return Allende(patient.token, session=session)
+
+    def run_cycle(self) -> None:
+        """Search the due appointments of every patient leased by this worker"""
+        self.stdout.write(f"Starting appointment search (worker {self.worker_id})...")
+        self.cycle_started_at = timezone.now()
+        stages_before = Metrics.stage_totals()
+        if self.profile_path:
+            self.profiler = RunProfiler(top_n=self.profile_top)
+            self.profiler.start()
+
+        processed: Set[int] = set()
+        leased: List[int] = []
+        upstream_down = False
+        try:
+            while not self.stop_event.is_set() and not upstream_down:
+                patients = PatientLeaseService.claim_patients(
+                    self.worker_id,
+                    self.batch_size,
+                    self.lease_seconds,
+                    exclude_ids=processed,
+                    only_ids=self.patient_ids,
+                )
+                if not patients:
+                    break
+                leased = [patient.id for patient in patients]
+
+                # Load the batch users' push tokens in a single query
+                DeviceRegistrationRepository.prime_active_tokens(
+                    {patient.user_id for patient in patients if patient.user_id}
+                )
+
+                for patient in patients:
+                    if self.stop_event.is_set() or upstream_down:
+                        break
+
+                    # Logins can be slow, keep the rest of the batch reserved
+                    PatientLeaseService.renew(
+                        self.worker_id, leased, self.lease_seconds
+                    )
+                    try:
+                        with self.profile_patient(patient):
+                            self.process_patient(patient)
+                    except CircuitOpenException as e:
+                        # Allende is down, the searches stay due for the next cycle
+                        self.stdout.write(
+                            self.style.WARNING(f"{e}, ending search cycle early")
+                        )
+                        upstream_down = True
+                    except Exception as e:
+                        if not self.daemon:
+                            raise
+                        # Force a fresh login next cycle in case the token was the problem
+                        self.verified_tokens.pop(patient.id, None)
+                        self.stdout.write(
+                            self.style.ERROR(
+                                f"Error processing patient {patient.id}: {e}"
+                            )
+                        )
+                    finally:
+                        processed.add(patient.id)
+                        leased.remove(patient.id)
+                        PatientLeaseService.release(self.worker_id, [patient.id])
+        finally:
+            # Hand back the patients not processed because of a stop or a failure
+            PatientLeaseService.release(self.worker_id, leased)
+            self.cycle_started_at = None
+            self.flush_slot_observations()
+            self.report_metrics(stages_before)
+            self.report_profile()
+
+        # Events older than the resume window of the event stream
+        AppointmentEventService.purge()
+        self.stdout.write(
+            self.style.SUCCESS("Appointment search completed successfully")
+        )
+
+    def observe_slot(
+        self,
+        appointment_to_find: FindAppointment,
+        now: datetime.datetime,
+        new_best_appointment_data: Optional[dict],
+    ) -> None:
+        """Add the first slot of a search to the cycle's slot observations"""
+        self.slot_observations.append(
+            SlotObservation(
+                observed_at=now,
+                find_appointment_id=appointment_to_find.id,
+                id_servicio=appointment_to_find.id_servicio,
+                id_recurso=appointment_to_find.id_recurso,
+                slot_datetime=(
+                    new_best_appointment_data.get("datetime")
+                    if new_best_appointment_data
+                    else None
+                ),
             )
+        )
+        if len(self.slot_observations) >= self.SLOT_OBSERVATIONS_FLUSH_SIZE:
+            self.flush_slot_observations()
 
-            for appointment_to_find in appointments_to_find:
-                self.stdout.write(
-                    f"Checking appointments for {appointment_to_find.doctor_name} - {appointment_to_find.especialidad}"
+    def flush_slot_observations(self) -> None:
+        """Write the buffered slot observations with a bulk insert"""
+        observations, self.slot_observations = self.slot_observations, []
+        if not observations:
+            return
+        try:
+            with Metrics.timed("db_write"):
+                SlotObservationRepository.record(observations)
+        except Exception as e:
+            # The history is best effort, never fail the searches for it
+            self.stdout.write(self.style.ERROR(f"Error writing slot observations: {e}"))
+
+    def report_metrics(self, stages_before: Dict[str, Tuple[int, float]]) -> None:
+        """Log where the cycle's time went and export the metrics file"""
+        timings = []
+        for stage, (count, seconds) in sorted(Metrics.stage_totals().items()):
+            count_before, seconds_before = stages_before.get(stage, (0, 0.0))
+            if count > count_before:
+                timings.append(
+                    f"{stage}={seconds - seconds_before:.2f}s/{count - count_before}"
                 )
+        if timings:
+            self.stdout.write(f"Stage timings: {' '.join(timings)}")
+
+        if self.metrics_file:
+            Metrics.write_file(self.metrics_file)
+
+    def profile_patient(self, patient: PacienteAllende) -> ContextManager[Any]:
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.patient(patient.id)
+
+    def profile_search(self, find_appointment: FindAppointment) -> ContextManager[Any]:
+        if self.profiler is None:
+            return nullcontext({})
+        return self.profiler.search(find_appointment.id)
 
-                doctor_data = {
-                    "IdPaciente": int(patient.id_paciente),
-                    "IdServicio": appointment_to_find.id_servicio,
-                    "IdSucursal": appointment_to_find.id_sucursal,
-                    "IdRecurso": appointment_to_find.id_recurso,
-                    "IdEspecialidad": appointment_to_find.id_especialidad,
-                    "IdTipoRecurso": appointment_to_find.id_tipo_recurso,
-                    "ControlarEdad": False,
-                    "IdFinanciador": patient.id_financiador,
-                    "IdPlan": patient.id_plan,
-                    "Prestaciones": [
-                        {
-                            "IdPrestacion": appointment_to_find.id_prestacion,
-                            "IdItemSolicitudEstudios": 0,
-                        }
-                    ],
-                }
-                # Search for new appointment
-                new_best_appointment_data = allende.search_best_date_appointment(
-                    doctor_data
+    def report_profile(self) -> None:
+        """Write the JSON report of a profiled cycle and log its summary"""
+        if self.profiler is None or not self.profile_path:
+            return
+
+        self.profiler.stop()
+        report = self.profiler.write(self.profile_path)
+        self.profiler = None
+        for line in RunProfiler.summary_lines(report, self.profile_top):
+            self.stdout.write(line)
+        self.stdout.write(f"Profile report written to {self.profile_path}")
+
+    def process_patient(self, patient: PacienteAllende) -> None:
+        """Search the due appointments of a single patient"""
+        assert isinstance(patient.user, User)
+
+        # One now per cycle for every patient's timeframes, fingerprints and polls
+        now = self.cycle_started_at or timezone.now()
+        with Metrics.timed("db_read"):
+            appointments_to_find = list(
+                PollingScheduler.due_searches(
+                    FindAppointment.objects.filter(active=True, patient=patient), now
                 )
-                result = AppointmentHandler.process_appointment(
-                    appointment_to_find=appointment_to_find,
-                    patient=patient,
-                    user=patient.user,
-                    new_appointment_data=new_best_appointment_data,
+            )
+
+        self.stdout.write(
+            f"Found {len(appointments_to_find)} active appointments due for checking"
+        )
+        if not appointments_to_find:
+            return
+
+        allende = self.get_allende(patient)
+
+        # Slots of the searches answered by a request shared with their group
+        grouped_slots: Dict[int, Optional[dict]] = {}
+        if SearchGroupService.is_enabled():
+            for group in SearchGroupService.group(appointments_to_find):
+                grouped_slots.update(
+                    SearchGroupService.fetch_group(allende, patient, group)
                 )
 
-                # Log result
-                if (
-                    result.action == AppointmentActionType.CREATED
-                    or result.action == AppointmentActionType.UPDATED
-                ):
-                    self.stdout.write(self.style.SUCCESS(result.message))
-                elif result.action == AppointmentActionType.REMOVED:
-                    self.stdout.write(self.style.WARNING(result.message))
-                elif result.action == AppointmentActionType.SKIPPED:
-                    self.stdout.write(self.style.WARNING(result.message))
+        for appointment_to_find in appointments_to_find:
+            with self.profile_search(appointment_to_find) as profile_entry:
+                if appointment_to_find.id in grouped_slots:
+                    result = self.process_search_result(
+                        patient,
+                        appointment_to_find,
+                        allende,
+                        now,
+                        grouped_slots[appointment_to_find.id],
+                    )
                 else:
-                    self.stdout.write(result.message)
+                    result = self.process_search(
+                        patient, appointment_to_find, allende, now
+                    )
+                profile_entry["action"] = result.action.value
+
+            # Log result
+            if (
+                result.action == AppointmentActionType.CREATED
+                or result.action == AppointmentActionType.UPDATED
+            ):
+                self.stdout.write(self.style.SUCCESS(result.message))
+            elif result.action == AppointmentActionType.REMOVED:
+                self.stdout.write(self.style.WARNING(result.message))
+            elif result.action == AppointmentActionType.SKIPPED:
+                self.stdout.write(self.style.WARNING(result.message))
+            else:
+                self.stdout.write(result.message)
+
+    def process_search(
+        self,
+        patient: PacienteAllende,
+        appointment_to_find: FindAppointment,
+        allende: Allende,
+        now: datetime.datetime,
+    ) -> AppointmentProcessingResult:
+        """Search Allende for a single FindAppointment and process the result"""
+        assert isinstance(patient.id_paciente, str)
+        assert isinstance(patient.user, User)
 
         self.stdout.write(
-            self.style.SUCCESS("Appointment search completed successfully")
+            f"Checking appointments for {appointment_to_find.doctor_name} - {appointment_to_find.especialidad}"
+        )
+
+        doctor_data = SearchGroupService.search_data(patient, appointment_to_find)
+        # Search for new appointment
+        new_best_appointment_data = allende.search_best_date_appointment(doctor_data)
+        return self.process_search_result(
+            patient, appointment_to_find, allende, now, new_best_appointment_data
+        )
+
+    def process_search_result(
+        self,
+        patient: PacienteAllende,
+        appointment_to_find: FindAppointment,
+        allende: Allende,
+        now: datetime.datetime,
+        new_best_appointment_data: Optional[dict],
+    ) -> AppointmentProcessingResult:
+        """Process the first slot found for a FindAppointment and schedule its next poll"""
+        assert isinstance(patient.user, User)
+        detected_at = time.monotonic()
+        fingerprint = SearchFingerprintService.compute(
+            appointment_to_find, new_best_appointment_data, now
         )
+        if SearchFingerprintService.is_unchanged(appointment_to_find, fingerprint):
+            result = AppointmentProcessingResult(
+                action=AppointmentActionType.UNCHANGED,
+                message="Availability unchanged since the last poll",
+            )
+        else:
+            result = AppointmentHandler.process_appointment(
+                appointment_to_find=appointment_to_find,
+                patient=patient,
+                user=patient.user,
+                new_appointment_data=new_best_appointment_data,
+                allende=allende,
+                detected_at=detected_at,
+                now=now,
+            )
+            # Saved with the next poll time, only once processing succeeded
+            appointment_to_find.last_response_fingerprint = fingerprint
+            # A new fingerprint is a change of the first slot, log it
+            self.observe_slot(appointment_to_find, now, new_best_appointment_data)
+
+        with Metrics.timed("db_write"):
+            PollingScheduler.schedule_next_poll(
+                appointment_to_find,
+                now,
+                changed=result.action
+                in (
+                    AppointmentActionType.CREATED,
+                    AppointmentActionType.UPDATED,
+                    AppointmentActionType.REMOVED,
+                ),
+                in_window=AppointmentProcessor.has_slot_in_window(
+                    new_best_appointment_data,
+                    appointment_to_find.desired_timeframe,
+                    now,
+                ),
+            )
+        Metrics.inc("turnos_searches_total", action=result.action.value)
+
+        return result
@@ -0,0 +1,60 @@
+import signal
+import threading
+from typing import Any, List
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+
+from sanatorio_allende.change_feed import (
+    CHANNEL,
+    ChangeFeedListener,
+    ChangeHandler,
+    ChangeNotification,
+    invalidate_patient_version,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Listen to the PostgreSQL change notifications of the searches and "
+        "appointments found and invalidate the cached lists of their patients"
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--verbose-changes",
+            action="store_true",
+            help="Print every notification received",
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        if not ChangeFeedListener.is_supported():
+            raise CommandError("Change notifications require a PostgreSQL database")
+
+        handlers: List[ChangeHandler] = [invalidate_patient_version]
+        if options["verbose_changes"]:
+            handlers.append(self.print_change)
+
+        stop_event = threading.Event()
+        listener = ChangeFeedListener(handlers, stop_event=stop_event)
+
+        def request_stop(signum: int, frame: Any) -> None:
+            self.stdout.write(f"Received signal {signum}, stopping")
+            stop_event.set()
+
+        previous_handlers = {
+            signum: signal.signal(signum, request_stop)
+            for signum in (signal.SIGTERM, signal.SIGINT)
+        }
+        self.stdout.write(f"Listening for changes on {CHANNEL}")
+        try:
+            listener.run()
+        finally:
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+        self.stdout.write(self.style.SUCCESS("Change listener stopped"))
+
+    def print_change(self, notification: ChangeNotification) -> None:
+        self.stdout.write(
+            f"{notification.operation} {notification.table} id={notification.id} "
+            f"patient={notification.patient_id}"
+        )
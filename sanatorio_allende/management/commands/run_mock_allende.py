@@ -0,0 +1,31 @@
+import argparse
+from typing import Any
+
+from django.core.management.base import BaseCommand
+
+from sanatorio_allende.mock_allende import MockAllendeConfig, MockAllendeServer
+
+
+class Command(BaseCommand):
+    help = "Serve a local mock of the Allende backend for benchmarks"
+
+    def add_arguments(self, parser: argparse.ArgumentParser) -> None:
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        MockAllendeConfig.add_arguments(parser)
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        server = MockAllendeServer(
+            (options["host"], options["port"]), MockAllendeConfig.from_options(options)
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Mock Allende backend listening, set ALLENDE_BASE_URL={server.base_url}"
+            )
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
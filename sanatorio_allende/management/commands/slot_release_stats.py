@@ -0,0 +1,61 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from sanatorio_allende.services.slot_analytics import SlotAnalyticsService
+
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Show when a doctor releases new earliest slots and how long they last, "
+        "from the slot observation log"
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--id-recurso",
+            type=int,
+            required=True,
+            help="Doctor to analyse",
+        )
+        parser.add_argument(
+            "--id-servicio",
+            type=int,
+            default=None,
+            help="Only searches of this service",
+        )
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=90,
+            help="Days of history to analyse",
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        histogram = SlotAnalyticsService.release_histogram(
+            options["id_recurso"], options["id_servicio"], days=options["days"]
+        )
+
+        self.stdout.write(
+            f"Doctor {histogram.id_recurso}: {histogram.releases} releases "
+            f"in the last {histogram.days} days"
+        )
+        if not histogram.releases:
+            return
+
+        peak = max(histogram.by_hour)
+        for hour, count in enumerate(histogram.by_hour):
+            if count:
+                bar = "#" * max(1, round(40 * count / peak))
+                self.stdout.write(f"{hour:02d}:00 {count:5d} {bar}")
+        self.stdout.write(
+            " ".join(
+                f"{day}={count}" for day, count in zip(WEEKDAYS, histogram.by_weekday)
+            )
+        )
+        if histogram.median_lifetime_minutes is not None:
+            self.stdout.write(
+                f"Median time until taken: {histogram.median_lifetime_minutes:.0f} minutes"
+            )
@@ -0,0 +1,217 @@
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+STAGE_DURATION = "turnos_stage_duration_seconds"
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+LabelSet = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Cumulative histogram with fixed buckets, as exported by Prometheus"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+
+class Metrics:
+    """
+    Per-process counters and histograms of the search pipeline
+
+    Metrics are exported in the Prometheus text format, either from the
+    /metrics/ endpoint or written to a file for the node_exporter textfile
+    collector (see find_appointments --metrics-file).
+    """
+
+    _counters: Dict[str, Dict[LabelSet, float]] = {}
+    _histograms: Dict[str, Dict[LabelSet, Histogram]] = {}
+    _help: Dict[str, str] = {
+        STAGE_DURATION: "Wall-clock time spent in each stage of the search pipeline",
+        "turnos_stage_errors_total": "Stages that ended with an exception",
+        "turnos_allende_requests_total": "Calls to Allende endpoints by outcome",
+        "turnos_searches_total": "Processed searches by resulting action",
+        "turnos_grouped_searches_total": "Searches answered by a grouped request",
+        "turnos_push_notifications_total": "Push notification sends by outcome",
+        "turnos_event_stream_connections_total": "Event stream connections opened",
+        "turnos_change_feed_notifications_total": "Database change notifications received",
+        "turnos_read_routing_total": "List endpoint reads by database and reason",
+        "turnos_best_appointments_archived_total": "Past appointments found moved to the archive",
+        "turnos_slot_observations_total": "First slot changes written to the slot history",
+    }
+    _lock = threading.Lock()
+
+    @classmethod
+    def _labels(cls, labels: Dict[str, str]) -> LabelSet:
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    @classmethod
+    def inc(cls, name: str, amount: float = 1, **labels: str) -> None:
+        """
+        Increment a counter
+
+        Args:
+            name: Metric name, ending in _total
+            amount: Amount to add
+            **labels: Label values of the series
+        """
+        with cls._lock:
+            series = cls._counters.setdefault(name, {})
+            key = cls._labels(labels)
+            series[key] = series.get(key, 0) + amount
+
+    @classmethod
+    def observe(cls, name: str, value: float, **labels: str) -> None:
+        """
+        Record a value in a histogram
+
+        Args:
+            name: Metric name
+            value: Observed value (seconds for durations)
+            **labels: Label values of the series
+        """
+        with cls._lock:
+            series = cls._histograms.setdefault(name, {})
+            key = cls._labels(labels)
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    @classmethod
+    @contextmanager
+    def timed(cls, stage: str) -> Iterator[None]:
+        """
+        Time a stage of the search pipeline
+
+        Args:
+            stage: Stage name (e.g. "login", "search", "db_write")
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            cls.inc("turnos_stage_errors_total", stage=stage)
+            raise
+        finally:
+            cls.observe(STAGE_DURATION, time.perf_counter() - started, stage=stage)
+
+    @classmethod
+    def stage_totals(cls) -> Dict[str, Tuple[int, float]]:
+        """
+        Get the number of calls and total seconds spent in each stage
+
+        Returns:
+            Dictionary of stage name to (count, seconds)
+        """
+        with cls._lock:
+            return {
+                dict(labels)["stage"]: (histogram.count, histogram.sum)
+                for labels, histogram in cls._histograms.get(STAGE_DURATION, {}).items()
+            }
+
+    @classmethod
+    def counter_value(cls, name: str, **labels: str) -> float:
+        with cls._lock:
+            return cls._counters.get(name, {}).get(cls._labels(labels), 0)
+
+    @classmethod
+    def counter_series(cls, name: str) -> Dict[LabelSet, float]:
+        """Copy of every labelled series of a counter"""
+        with cls._lock:
+            return dict(cls._counters.get(name, {}))
+
+    @classmethod
+    def reset(cls) -> None:
+        with cls._lock:
+            cls._counters.clear()
+            cls._histograms.clear()
+
+    @classmethod
+    def _format_labels(cls, labels: LabelSet, extra: LabelSet = ()) -> str:
+        pairs = labels + extra
+        if not pairs:
+            return ""
+        escaped = (
+            (key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+            for key, value in pairs
+        )
+        return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+    @classmethod
+    def render(cls) -> str:
+        """
+        Render every metric in the Prometheus text exposition format
+
+        Returns:
+            The metrics page content
+        """
+        lines: List[str] = []
+        with cls._lock:
+            for name, counters in sorted(cls._counters.items()):
+                lines.append(f"# HELP {name} {cls._help.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in sorted(counters.items()):
+                    lines.append(f"{name}{cls._format_labels(labels)} {value}")
+
+            for name, histograms in sorted(cls._histograms.items()):
+                lines.append(f"# HELP {name} {cls._help.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in sorted(histograms.items()):
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        bucket_labels = cls._format_labels(
+                            labels, (("le", str(bound)),)
+                        )
+                        lines.append(f"{name}_bucket{bucket_labels} {count}")
+                    inf_labels = cls._format_labels(labels, (("le", "+Inf"),))
+                    lines.append(f"{name}_bucket{inf_labels} {histogram.count}")
+                    lines.append(
+                        f"{name}_sum{cls._format_labels(labels)} {histogram.sum}"
+                    )
+                    lines.append(
+                        f"{name}_count{cls._format_labels(labels)} {histogram.count}"
+                    )
+
+        return "\n".join(lines) + "\n"
+
+    @classmethod
+    def write_file(cls, path: str) -> None:
+        """
+        Atomically write the metrics to a file
+
+        Args:
+            path: Destination file, usually read by the node_exporter textfile collector
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        with tempfile.NamedTemporaryFile(
+            "w", dir=directory, delete=False, suffix=".tmp"
+        ) as tmp:
+            tmp.write(cls.render())
+        os.replace(tmp.name, path)
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.10 on 2026-10-19 06:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sanatorio_allende", "0013_alter_doctor_unique_together_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="findappointment",
+            name="auto_book",
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.10 on 2026-10-19 06:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sanatorio_allende", "0014_findappointment_auto_book"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="bestappointmentfound",
+            name="booking_payload",
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
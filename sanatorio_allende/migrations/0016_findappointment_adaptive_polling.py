@@ -0,0 +1,23 @@
+# Generated by Django 5.1.10 on 2026-10-19 06:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sanatorio_allende", "0015_bestappointmentfound_booking_payload"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="findappointment",
+            name="last_change_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="findappointment",
+            name="next_poll_at",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.10 on 2026-10-19 06:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sanatorio_allende", "0016_findappointment_adaptive_polling"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="pacienteallende",
+            name="lease_expires_at",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="pacienteallende",
+            name="lease_owner",
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
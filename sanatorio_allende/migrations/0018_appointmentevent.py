@@ -0,0 +1,55 @@
+# Generated by Django 5.1.10 on 2026-10-19 07:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sanatorio_allende", "0017_pacienteallende_lease"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AppointmentEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "event_type",
+                    models.CharField(
+                        choices=[
+                            ("created", "Created"),
+                            ("updated", "Updated"),
+                            ("removed", "Removed"),
+                            ("booked", "Booked"),
+                            ("cancelled", "Cancelled"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("payload", models.JSONField(default=dict)),
+                ("created_at", models.DateTimeField(auto_now_add=True, db_index=True)),
+                (
+                    "patient",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="sanatorio_allende.pacienteallende",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Appointment Event",
+                "verbose_name_plural": "Appointment Events",
+                "ordering": ["id"],
+            },
+        ),
+    ]
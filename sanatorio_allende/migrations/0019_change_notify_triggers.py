@@ -0,0 +1,67 @@
+from typing import Any
+
+from django.db import migrations
+
+CHANNEL = "turnos_changes"
+TABLES = [
+    "sanatorio_allende_findappointment",
+    "sanatorio_allende_bestappointmentfound",
+    # Wakes up the event stream as soon as an event commits
+    "sanatorio_allende_appointmentevent",
+]
+
+CREATE_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION turnos_notify_change() RETURNS trigger AS $$
+DECLARE
+    row_data record;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        row_data := OLD;
+    ELSE
+        row_data := NEW;
+    END IF;
+    PERFORM pg_notify(
+        '{CHANNEL}',
+        json_build_object(
+            'table', TG_TABLE_NAME,
+            'op', TG_OP,
+            'id', row_data.id,
+            'patient_id', row_data.patient_id
+        )::text
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def create_triggers(apps: Any, schema_editor: Any) -> None:
+    # LISTEN/NOTIFY only exists on PostgreSQL, local SQLite databases poll
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(CREATE_FUNCTION)
+    for table in TABLES:
+        schema_editor.execute(
+            f"CREATE TRIGGER {table}_notify "
+            f"AFTER INSERT OR UPDATE OR DELETE ON {table} "
+            f"FOR EACH ROW EXECUTE FUNCTION turnos_notify_change()"
+        )
+
+
+def drop_triggers(apps: Any, schema_editor: Any) -> None:
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for table in TABLES:
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {table}_notify ON {table}")
+    schema_editor.execute("DROP FUNCTION IF EXISTS turnos_notify_change()")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sanatorio_allende", "0018_appointmentevent"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_triggers, drop_triggers),
+    ]
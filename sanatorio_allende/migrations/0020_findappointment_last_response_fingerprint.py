@@ -0,0 +1,20 @@
+# Generated by Django 5.1.10 on 2026-10-19 07:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sanatorio_allende", "0019_change_notify_triggers"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="findappointment",
+            name="last_response_fingerprint",
+            field=models.CharField(
+                blank=True, default="", editable=False, max_length=64
+            ),
+        ),
+    ]
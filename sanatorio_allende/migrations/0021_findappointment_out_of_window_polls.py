@@ -0,0 +1,18 @@
+# Generated by Django 5.1.10 on 2026-10-19 07:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sanatorio_allende", "0020_findappointment_last_response_fingerprint"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="findappointment",
+            name="out_of_window_polls",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
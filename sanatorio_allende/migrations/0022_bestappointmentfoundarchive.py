@@ -0,0 +1,41 @@
+# Generated by Django 5.1.10 on 2026-10-19 07:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sanatorio_allende", "0021_findappointment_out_of_window_polls"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BestAppointmentFoundArchive",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("original_id", models.BigIntegerField(unique=True)),
+                ("patient_id", models.BigIntegerField(db_index=True)),
+                ("appointment_wanted_id", models.BigIntegerField()),
+                ("datetime", models.DateTimeField()),
+                ("not_interested", models.BooleanField(default=False)),
+                ("confirmed", models.BooleanField(default=False)),
+                ("confirmed_id_turno", models.IntegerField(blank=True, null=True)),
+                ("confirmed_at", models.DateTimeField(blank=True, null=True)),
+                ("archived_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "verbose_name": "Archived Best Appointment",
+                "verbose_name_plural": "Archived Best Appointments",
+                "ordering": ["-datetime"],
+            },
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 5.1.10 on 2026-10-19 07:48
+
+from typing import Any
+
+from django.db import migrations, models
+
+TABLE = "sanatorio_allende_slotobservation"
+
+# Range partitioned by month of observed_at. The partition key has to be part
+# of the primary key, and identity columns are not supported on partitioned
+# tables before PostgreSQL 17, so the ID comes from a sequence. The monthly
+# partitions are created ahead of the inserts by SlotObservationRepository,
+# the default partition only receives rows if that failed.
+PARTITIONED_TABLE = f"""
+CREATE TABLE {TABLE} (
+    id bigserial NOT NULL,
+    observed_at timestamp with time zone NOT NULL,
+    find_appointment_id bigint NOT NULL,
+    id_servicio integer NOT NULL,
+    id_recurso integer NOT NULL,
+    slot_datetime timestamp with time zone NULL,
+    PRIMARY KEY (id, observed_at)
+) PARTITION BY RANGE (observed_at);
+CREATE INDEX slotobs_recurso_idx ON {TABLE} (id_recurso, observed_at);
+CREATE INDEX slotobs_search_idx ON {TABLE} (find_appointment_id, observed_at);
+CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT;
+"""
+
+
+def partition_table(apps: Any, schema_editor: Any) -> None:
+    # Other databases keep the plain table created by CreateModel
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(f"DROP TABLE {TABLE}")
+    schema_editor.execute(PARTITIONED_TABLE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sanatorio_allende", "0022_bestappointmentfoundarchive"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SlotObservation",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                ("observed_at", models.DateTimeField()),
+                ("find_appointment_id", models.BigIntegerField()),
+                ("id_servicio", models.IntegerField()),
+                ("id_recurso", models.IntegerField()),
+                ("slot_datetime", models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                "verbose_name": "Slot Observation",
+                "verbose_name_plural": "Slot Observations",
+                "indexes": [
+                    models.Index(
+                        fields=["id_recurso", "observed_at"], name="slotobs_recurso_idx"
+                    ),
+                    models.Index(
+                        fields=["find_appointment_id", "observed_at"],
+                        name="slotobs_search_idx",
+                    ),
+                ],
+            },
+        ),
+        # Reversed by the DROP TABLE of CreateModel, which drops the partitions
+        migrations.RunPython(partition_table, migrations.RunPython.noop),
+    ]
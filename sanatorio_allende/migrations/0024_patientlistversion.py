@@ -0,0 +1,33 @@
+# Generated by Django 5.1.10 on 2026-10-19 08:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sanatorio_allende", "0023_slotobservation"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PatientListVersion",
+            fields=[
+                (
+                    "patient",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        serialize=False,
+                        to="sanatorio_allende.pacienteallende",
+                    ),
+                ),
+                ("version", models.BigIntegerField(default=0)),
+            ],
+            options={
+                "verbose_name": "Patient List Version",
+                "verbose_name_plural": "Patient List Versions",
+            },
+        ),
+    ]
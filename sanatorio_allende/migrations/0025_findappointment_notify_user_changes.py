@@ -0,0 +1,72 @@
+from typing import Any
+
+from django.db import migrations
+
+TABLE = "sanatorio_allende_findappointment"
+TRIGGER = f"{TABLE}_notify"
+UPDATE_TRIGGER = f"{TABLE}_notify_update"
+
+# Columns shown by the app. The search worker rewrites next_poll_at,
+# last_change_at, out_of_window_polls and last_response_fingerprint on every
+# poll, those updates must not invalidate the patient's lists.
+USER_VISIBLE_COLUMNS = [
+    "patient_id",
+    "doctor_name",
+    "id_servicio",
+    "servicio",
+    "id_sucursal",
+    "sucursal",
+    "id_especialidad",
+    "especialidad",
+    "id_recurso",
+    "id_tipo_recurso",
+    "id_prestacion",
+    "id_tipo_prestacion",
+    "nombre_tipo_prestacion",
+    "desired_timeframe",
+    "active",
+    "auto_book",
+]
+
+
+def create_triggers(apps: Any, schema_editor: Any) -> None:
+    # LISTEN/NOTIFY only exists on PostgreSQL, local SQLite databases poll
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    old_row = ", ".join(f"OLD.{column}" for column in USER_VISIBLE_COLUMNS)
+    new_row = ", ".join(f"NEW.{column}" for column in USER_VISIBLE_COLUMNS)
+    schema_editor.execute(f"DROP TRIGGER IF EXISTS {TRIGGER} ON {TABLE}")
+    schema_editor.execute(
+        f"CREATE TRIGGER {TRIGGER} "
+        f"AFTER INSERT OR DELETE ON {TABLE} "
+        f"FOR EACH ROW EXECUTE FUNCTION turnos_notify_change()"
+    )
+    schema_editor.execute(
+        f"CREATE TRIGGER {UPDATE_TRIGGER} "
+        f"AFTER UPDATE ON {TABLE} "
+        f"FOR EACH ROW WHEN (({old_row}) IS DISTINCT FROM ({new_row})) "
+        f"EXECUTE FUNCTION turnos_notify_change()"
+    )
+
+
+def drop_triggers(apps: Any, schema_editor: Any) -> None:
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(f"DROP TRIGGER IF EXISTS {UPDATE_TRIGGER} ON {TABLE}")
+    schema_editor.execute(f"DROP TRIGGER IF EXISTS {TRIGGER} ON {TABLE}")
+    schema_editor.execute(
+        f"CREATE TRIGGER {TRIGGER} "
+        f"AFTER INSERT OR UPDATE OR DELETE ON {TABLE} "
+        f"FOR EACH ROW EXECUTE FUNCTION turnos_notify_change()"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sanatorio_allende", "0024_patientlistversion"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_triggers, drop_triggers),
+    ]
@@ -0,0 +1,241 @@
+import argparse
+import datetime
+import itertools
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple, Type
+
+HTTP_OK = 200
+HTTP_UNAUTHORIZED = 401
+HTTP_NOT_FOUND = 404
+HTTP_SERVICE_UNAVAILABLE = 503
+
+
+@dataclass
+class MockAllendeConfig:
+    """Behaviour of the mock Allende backend"""
+
+    # Base latency of every response and random extra latency on top of it
+    latency_ms: float = 50.0
+    jitter_ms: float = 20.0
+    # Fraction of requests answered with a 503
+    error_rate: float = 0.0
+    # Number of slots (one per resource) in each availability response
+    slots_per_response: int = 5
+    # Latest day, counted from today, of the generated slots
+    max_days_ahead: int = 60
+    seed: Optional[int] = None
+
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser) -> None:
+        """Add the mock server options to a management command"""
+        parser.add_argument("--latency-ms", type=float, default=cls.latency_ms)
+        parser.add_argument("--jitter-ms", type=float, default=cls.jitter_ms)
+        parser.add_argument(
+            "--error-rate",
+            type=float,
+            default=cls.error_rate,
+            help="Fraction of requests answered with a 503",
+        )
+        parser.add_argument(
+            "--slots",
+            type=int,
+            default=cls.slots_per_response,
+            help="Slots per availability response (payload size)",
+        )
+        parser.add_argument("--seed", type=int, default=None)
+
+    @classmethod
+    def from_options(cls, options: Dict[str, Any]) -> "MockAllendeConfig":
+        return cls(
+            latency_ms=options["latency_ms"],
+            jitter_ms=options["jitter_ms"],
+            error_rate=options["error_rate"],
+            slots_per_response=options["slots"],
+            seed=options["seed"],
+        )
+
+
+class MockJsonHandler(BaseHTTPRequestHandler):
+    """JSON request handler with simulated latency and failures"""
+
+    server: "MockServer"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # Keep benchmark output readable
+        pass
+
+    def _send_json(self, status: int, body: Any) -> None:
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _simulate_upstream(self) -> bool:
+        """Apply latency and random failures, returns False if the request failed"""
+        config = self.server.config
+        latency = config.latency_ms + self.server.random.uniform(0, config.jitter_ms)
+        time.sleep(latency / 1000)
+
+        if self.server.random.random() < config.error_rate:
+            self._send_json(HTTP_SERVICE_UNAVAILABLE, {"Message": "Mock failure"})
+            return False
+        return True
+
+
+class MockAllendeHandler(MockJsonHandler):
+    """Implements the backend endpoints used by sanatorio_allende.allende_api.Allende"""
+
+    server: "MockAllendeServer"
+
+    def _authorized(self) -> bool:
+        if not self.headers.get("authorization"):
+            self._send_json(HTTP_UNAUTHORIZED, {"Message": "Authorization required"})
+            return False
+        return True
+
+    def do_GET(self) -> None:
+        if not self._simulate_upstream():
+            return
+
+        path = self.path.split("?")[0]
+        if path.endswith("/api/GestionDeEspera/Totem/ObtenerOpcionesDelTotemPortal"):
+            if self._authorized():
+                self._send_json(HTTP_OK, [])
+        elif "/api/PrestacionMedica/" in path:
+            if self._authorized():
+                self._send_json(HTTP_OK, self.server.appointment_types())
+        elif "/api/Paciente/ObtenerPorId/" in path:
+            if self._authorized():
+                self._send_json(
+                    HTTP_OK, {"CoberturaPorDefecto": {"IdMutual": 1, "IdPlanMutual": 1}}
+                )
+        else:
+            self._send_json(HTTP_NOT_FOUND, {"Message": f"Unknown endpoint {path}"})
+
+    def do_POST(self) -> None:
+        self._read_body()
+        if not self._simulate_upstream():
+            return
+
+        path = self.path.split("?")[0]
+        if path.endswith("/Token"):
+            self._send_json(HTTP_OK, {"access_token": "mock-token"})
+        elif path.endswith(
+            "/api/DisponibilidadDeTurnos/ObtenerPrimerTurnoAsignableParaPortalWebConParticular"
+        ):
+            if self._authorized():
+                self._send_json(HTTP_OK, self.server.first_slots())
+        elif path.endswith("/api/turnos/Asignar"):
+            if self._authorized():
+                self._send_json(
+                    HTTP_OK, {"Entidad": {"Id": next(self.server.turno_ids)}}
+                )
+        elif path.endswith("/api/turnos/CancelarTurno"):
+            if self._authorized():
+                self._send_json(
+                    HTTP_OK,
+                    {
+                        "IsOk": True,
+                        "Message": "",
+                        "HasWarnings": False,
+                        "WarningMessage": "",
+                        "IdEntidadValidada": 0,
+                    },
+                )
+        elif path.endswith(
+            "/api/TurnosBuscadorGenerico/ObtenerEspecialidadServicioProfesionalPorCriterio"
+        ):
+            if self._authorized():
+                self._send_json(HTTP_OK, {"Especialidades": [], "Profesionales": []})
+        else:
+            self._send_json(HTTP_NOT_FOUND, {"Message": f"Unknown endpoint {path}"})
+
+
+class MockServer(ThreadingHTTPServer):
+    """Threaded local HTTP server for benchmarks, optionally run in the background"""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        handler: Type[MockJsonHandler],
+        config: Any,
+    ):
+        super().__init__(address, handler)
+        self.config = config
+        self.random = random.Random(config.seed)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def root_url(self) -> str:
+        host, port = self.server_address[:2]
+        assert isinstance(host, str)
+        return f"http://{host}:{port}"
+
+    def start_in_background(self) -> "MockServer":
+        """Serve from a daemon thread, for benchmarks running in the same process"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+class MockAllendeServer(MockServer):
+    """Threaded stand-in for miportal.sanatorioallende.com/backend"""
+
+    def __init__(self, address: Tuple[str, int], config: MockAllendeConfig):
+        super().__init__(address, MockAllendeHandler, config)
+        self.turno_ids = itertools.count(1)
+
+    @property
+    def base_url(self) -> str:
+        """Value for settings.ALLENDE_BASE_URL pointing to this server"""
+        return f"{self.root_url}/backend"
+
+    def first_slots(self) -> dict:
+        today = datetime.date.today()
+        slots = []
+        for index in range(self.config.slots_per_response):
+            day = today + datetime.timedelta(
+                days=self.random.randint(1, self.config.max_days_ahead)
+            )
+            slots.append(
+                {
+                    "Fecha": f"{day.isoformat()}T00:00:00",
+                    "Hora": f"{self.random.randint(8, 19):02d}:{self.random.choice(['00', '20', '40'])}",
+                    "DuracionIndividual": 20,
+                    "IdPlantillaTurno": 1000 + index,
+                    "IdItemDePlantilla": 2000 + index,
+                    "IdRecurso": index + 1,
+                }
+            )
+        return {"PrimerosTurnosDeCadaRecurso": slots}
+
+    def appointment_types(self) -> list:
+        return [
+            {
+                "IdTipoPrestacion": 1,
+                "Activo": True,
+                "HabilitadaTelemedicina": False,
+                "Prefacturables": "420101-CONSULTA MEDICA\n",
+                "Id": 5495,
+                "Nombre": "CONSULTA",
+            }
+        ]
@@ -0,0 +1,154 @@
+import argparse
+import json
+import threading
+import uuid
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from sanatorio_allende.mock_allende import MockJsonHandler, MockServer
+
+HTTP_OK = 200
+HTTP_NOT_FOUND = 404
+
+PUSH_PATH = "/--/api/v2/push/send"
+RECEIPT_PATH = "/--/api/v2/push/getReceipts"
+
+# Tokens containing this marker are always reported as unregistered
+UNREGISTERED_TOKEN_MARKER = "Unregistered"
+
+
+@dataclass
+class MockExpoConfig:
+    """Behaviour of the mock Expo push service"""
+
+    latency_ms: float = 100.0
+    jitter_ms: float = 50.0
+    # Fraction of requests answered with a 503
+    error_rate: float = 0.0
+    # Fraction of tickets rejected with DeviceNotRegistered
+    unregistered_rate: float = 0.0
+    # Fraction of receipts reporting DeviceNotRegistered after a successful ticket
+    receipt_error_rate: float = 0.0
+    seed: Optional[int] = None
+
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser) -> None:
+        """Add the mock server options to a management command"""
+        parser.add_argument("--latency-ms", type=float, default=cls.latency_ms)
+        parser.add_argument("--jitter-ms", type=float, default=cls.jitter_ms)
+        parser.add_argument(
+            "--error-rate",
+            type=float,
+            default=cls.error_rate,
+            help="Fraction of requests answered with a 503",
+        )
+        parser.add_argument(
+            "--unregistered-rate",
+            type=float,
+            default=cls.unregistered_rate,
+            help="Fraction of tickets rejected with DeviceNotRegistered",
+        )
+        parser.add_argument(
+            "--receipt-error-rate",
+            type=float,
+            default=cls.receipt_error_rate,
+            help="Fraction of receipts reporting DeviceNotRegistered",
+        )
+        parser.add_argument("--seed", type=int, default=None)
+
+    @classmethod
+    def from_options(cls, options: Dict[str, Any]) -> "MockExpoConfig":
+        return cls(
+            latency_ms=options["latency_ms"],
+            jitter_ms=options["jitter_ms"],
+            error_rate=options["error_rate"],
+            unregistered_rate=options["unregistered_rate"],
+            receipt_error_rate=options["receipt_error_rate"],
+            seed=options["seed"],
+        )
+
+
+class MockExpoHandler(MockJsonHandler):
+    """Implements the Expo push and receipt endpoints with realistic response shapes"""
+
+    server: "MockExpoServer"
+
+    def do_POST(self) -> None:
+        body = json.loads(self._read_body() or b"null")
+        if not self._simulate_upstream():
+            return
+
+        path = self.path.split("?")[0]
+        if path == PUSH_PATH:
+            messages = body if isinstance(body, list) else [body]
+            self._send_json(
+                HTTP_OK, {"data": [self.server.ticket(message) for message in messages]}
+            )
+        elif path == RECEIPT_PATH:
+            receipt_ids = (body or {}).get("ids", [])
+            self._send_json(
+                HTTP_OK,
+                {
+                    "data": {
+                        receipt_id: self.server.receipt(receipt_id)
+                        for receipt_id in receipt_ids
+                    }
+                },
+            )
+        else:
+            self._send_json(HTTP_NOT_FOUND, {"errors": [{"code": "NOT_FOUND"}]})
+
+
+class MockExpoServer(MockServer):
+    """Threaded stand-in for exp.host push notifications"""
+
+    def __init__(self, address: Tuple[str, int], config: MockExpoConfig):
+        super().__init__(address, MockExpoHandler, config)
+        self.receipts: Dict[str, Dict[str, Any]] = {}
+        self.receipts_lock = threading.Lock()
+
+    @property
+    def push_url(self) -> str:
+        """Value for settings.EXPO_PUSH_URL pointing to this server"""
+        return f"{self.root_url}{PUSH_PATH}"
+
+    @property
+    def receipt_url(self) -> str:
+        """Value for settings.EXPO_RECEIPT_URL pointing to this server"""
+        return f"{self.root_url}{RECEIPT_PATH}"
+
+    @classmethod
+    def _unregistered(cls, push_token: str) -> Dict[str, Any]:
+        return {
+            "status": "error",
+            "message": f'"{push_token}" is not a registered push notification recipient',
+            "details": {
+                "error": "DeviceNotRegistered",
+                "expoPushToken": push_token,
+            },
+        }
+
+    def ticket(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        push_token = str(message.get("to", ""))
+        if (
+            UNREGISTERED_TOKEN_MARKER in push_token
+            or self.random.random() < self.config.unregistered_rate
+        ):
+            return self._unregistered(push_token)
+
+        receipt_id = str(uuid.uuid4())
+        receipt: Dict[str, Any] = {"status": "ok"}
+        if self.random.random() < self.config.receipt_error_rate:
+            receipt = {
+                "status": "error",
+                "message": "The device cannot receive push notifications anymore",
+                "details": {"error": "DeviceNotRegistered"},
+            }
+        with self.receipts_lock:
+            self.receipts[receipt_id] = receipt
+        return {"status": "ok", "id": receipt_id}
+
+    def receipt(self, receipt_id: str) -> Dict[str, Any]:
+        with self.receipts_lock:
+            # Expo omits receipts it does not know about, ok is the common case
+            return self.receipts.get(receipt_id, {"status": "ok"})
@@ -12,6 +12,9 @@ class PacienteAllende(models.Model):
     id_financiador = models.IntegerField(null=True, blank=True)
     id_plan = models.IntegerField(null=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Search worker currently processing this patient (see services/work_lease.py)
+    lease_owner = models.CharField(max_length=255, null=True, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
 
     def __str__(self) -> str:
         return f"{self.name} - {self.id_paciente}"
@@ -53,6 +56,18 @@ class FindAppointment(models.Model):
         ],
     )
     active = models.BooleanField(default=False)
+    # Book matching slots as soon as they are found instead of waiting for the user
+    auto_book = models.BooleanField(default=False)
+
+    # Adaptive polling: when the search is due again and when its best slot last changed
+    next_poll_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    last_change_at = models.DateTimeField(null=True, blank=True)
+    # Consecutive polls without a slot inside the desired timeframe
+    out_of_window_polls = models.PositiveIntegerField(default=0, editable=False)
+    # Hash of the last processed availability, an identical poll skips processing
+    last_response_fingerprint = models.CharField(
+        max_length=64, blank=True, default="", editable=False
+    )
 
     def __str__(self) -> str:
         return f"{self.doctor_name} - {self.especialidad}"
@@ -74,6 +89,9 @@ class BestAppointmentFound(models.Model):
     id_plantilla_turno = models.IntegerField(null=True, blank=True)
     id_item_plantilla = models.IntegerField(null=True, blank=True)
 
+    # Allende Asignar payload, prebuilt so confirmation is a single upstream POST
+    booking_payload = models.JSONField(null=True, blank=True)
+
     # Fields for confirmed appointment
     confirmed_id_turno = models.IntegerField(null=True, blank=True)
     confirmed = models.BooleanField(default=False)
@@ -87,6 +105,34 @@ class BestAppointmentFound(models.Model):
         unique_together = [["appointment_wanted", "patient", "datetime"]]
 
 
+class BestAppointmentFoundArchive(models.Model):
+    """
+    Compact copy of a BestAppointmentFound whose appointment is in the past
+
+    Moved out of the hot table by the archive_best_appointments command. Only
+    the outcome is kept: no booking payload, and plain IDs instead of foreign
+    keys so the archive outlives the patient and the search.
+    """
+
+    original_id = models.BigIntegerField(unique=True)
+    patient_id = models.BigIntegerField(db_index=True)
+    appointment_wanted_id = models.BigIntegerField()
+    datetime = models.DateTimeField()
+    not_interested = models.BooleanField(default=False)
+    confirmed = models.BooleanField(default=False)
+    confirmed_id_turno = models.IntegerField(null=True, blank=True)
+    confirmed_at = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f"{self.original_id} - {self.datetime}"
+
+    class Meta:
+        verbose_name = "Archived Best Appointment"
+        verbose_name_plural = "Archived Best Appointments"
+        ordering = ["-datetime"]
+
+
 class DeviceRegistration(models.Model):
     """
     Model to store device registration for push notifications
@@ -106,3 +152,97 @@ class DeviceRegistration(models.Model):
         verbose_name = "Device Registration"
         verbose_name_plural = "Device Registrations"
         ordering = ["-created_at"]
+
+
+class AppointmentEvent(models.Model):
+    """
+    Change to the appointments found for a patient, pushed to the app over SSE
+
+    The ID is the resume token of the event stream: a reconnecting client sends
+    the last ID it saw and receives the events written after it.
+    """
+
+    CREATED = "created"
+    UPDATED = "updated"
+    REMOVED = "removed"
+    BOOKED = "booked"
+    CANCELLED = "cancelled"
+
+    patient = models.ForeignKey(PacienteAllende, on_delete=models.CASCADE)
+    event_type = models.CharField(
+        max_length=20,
+        choices=[
+            (CREATED, "Created"),
+            (UPDATED, "Updated"),
+            (REMOVED, "Removed"),
+            (BOOKED, "Booked"),
+            (CANCELLED, "Cancelled"),
+        ],
+    )
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self) -> str:
+        return f"{self.event_type} - {self.patient_id} - {self.created_at}"
+
+    class Meta:
+        verbose_name = "Appointment Event"
+        verbose_name_plural = "Appointment Events"
+        ordering = ["id"]
+
+
+class SlotObservation(models.Model):
+    """
+    First slot of a search seen by the search worker, logged when it changes
+
+    Append-only history of the availability of each doctor, the source of
+    the release-time analytics (see services/slot_analytics.py). A row
+    without slot_datetime records that the search had no slot. On
+    PostgreSQL the table is partitioned by month of observed_at (see
+    migration 0023), expired months are dropped whole.
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    observed_at = models.DateTimeField()
+    find_appointment_id = models.BigIntegerField()
+    id_servicio = models.IntegerField()
+    id_recurso = models.IntegerField()
+    slot_datetime = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self) -> str:
+        return f"{self.id_recurso} - {self.observed_at} - {self.slot_datetime}"
+
+    class Meta:
+        verbose_name = "Slot Observation"
+        verbose_name_plural = "Slot Observations"
+        indexes = [
+            models.Index(
+                fields=["id_recurso", "observed_at"], name="slotobs_recurso_idx"
+            ),
+            models.Index(
+                fields=["find_appointment_id", "observed_at"], name="slotobs_search_idx"
+            ),
+        ]
+
+
+class PatientListVersion(models.Model):
+    """
+    Change counter of a patient's searches and appointments found
+
+    Bumped on every write to them, by the web processes and the search
+    worker alike, and part of the ETag of the list endpoints (see
+    conditional.py). It lives in the database so every process sees the
+    same value.
+    """
+
+    patient = models.OneToOneField(
+        PacienteAllende, on_delete=models.CASCADE, primary_key=True
+    )
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self) -> str:
+        return f"{self.patient_id} - {self.version}"
+
+    class Meta:
+        verbose_name = "Patient List Version"
+        verbose_name_plural = "Patient List Versions"
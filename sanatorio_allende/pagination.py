@@ -0,0 +1,218 @@
+import base64
+import binascii
+import json
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+)
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Field, Model, Q, QuerySet
+from django.http import HttpRequest, JsonResponse, StreamingHttpResponse
+from django.http.response import HttpResponseBase
+
+Serializer = Callable[[Any], Dict[str, Any]]
+
+TRUE_VALUES = ("1", "true", "yes")
+
+
+class InvalidPageRequest(ValueError):
+    """Raised when the pagination parameters of a request are not valid"""
+
+
+class KeysetPagination:
+    """
+    Keyset pagination and streaming for the JSON list endpoints
+
+    Without pagination parameters the endpoints return every row, as they always
+    did. With ?limit=N (and ?after=<next_cursor> for the following pages) rows are
+    returned in keyset order, which stays fast on deep pages and is not affected
+    by rows inserted between requests. ?stream=1 writes the response while
+    iterating the queryset, so memory does not grow with the number of rows.
+    """
+
+    DEFAULT_LIMIT = 50
+    MAX_LIMIT = 500
+    STREAM_CHUNK_SIZE = 500
+
+    @classmethod
+    def parse(cls, request: HttpRequest) -> Tuple[Optional[int], Optional[str]]:
+        """
+        Read the page size and cursor of a request
+
+        Args:
+            request: The list request
+
+        Returns:
+            Tuple of (limit, cursor), limit is None when the request is not paginated
+
+        Raises:
+            InvalidPageRequest: If limit is not a positive integer
+        """
+        raw_limit = request.GET.get("limit")
+        cursor = request.GET.get("after") or None
+        if raw_limit is None:
+            return (cls.DEFAULT_LIMIT if cursor else None), cursor
+
+        try:
+            limit = int(raw_limit)
+        except ValueError:
+            raise InvalidPageRequest("limit must be a positive integer")
+        if limit < 1:
+            raise InvalidPageRequest("limit must be a positive integer")
+        return min(limit, cls.MAX_LIMIT), cursor
+
+    @classmethod
+    def encode_cursor(cls, obj: Model, ordering: Sequence[str]) -> str:
+        """Opaque cursor pointing right after the given row"""
+        values = [getattr(obj, field) for field in ordering]
+        # Full isoformat, DjangoJSONEncoder truncates datetimes to milliseconds
+        payload = json.dumps(values, default=lambda value: value.isoformat()).encode(
+            "utf-8"
+        )
+        return base64.urlsafe_b64encode(payload).decode("ascii")
+
+    @classmethod
+    def decode_cursor(
+        cls, model: Type[Model], ordering: Sequence[str], cursor: str
+    ) -> List[Any]:
+        """
+        Decode a cursor into the ordering values of the row it points after
+
+        Raises:
+            InvalidPageRequest: If the cursor was not produced for this ordering
+        """
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        except (binascii.Error, UnicodeError, ValueError):
+            raise InvalidPageRequest("Invalid cursor")
+        if not isinstance(values, list) or len(values) != len(ordering):
+            raise InvalidPageRequest("Invalid cursor")
+
+        try:
+            decoded = []
+            for field_name, value in zip(ordering, values):
+                field = model._meta.get_field(field_name)
+                assert isinstance(field, Field)
+                decoded.append(field.to_python(value))
+            return decoded
+        except ValidationError:
+            raise InvalidPageRequest("Invalid cursor")
+
+    @classmethod
+    def after(
+        cls, queryset: QuerySet, ordering: Sequence[str], values: Sequence[Any]
+    ) -> QuerySet:
+        """
+        Filter the rows that come after the given ordering values
+
+        Args:
+            queryset: Rows to paginate
+            ordering: Ascending ordering fields, ending in a unique field
+            values: Ordering values of the last row of the previous page
+
+        Returns:
+            The queryset filtered to the following rows
+        """
+        condition = Q()
+        for index, field in enumerate(ordering):
+            equal = {ordering[previous]: values[previous] for previous in range(index)}
+            condition |= Q(**equal, **{f"{field}__gt": values[index]})
+        return queryset.filter(condition)
+
+    @classmethod
+    def response(
+        cls,
+        request: HttpRequest,
+        queryset: QuerySet,
+        key: str,
+        serialize: Serializer,
+        ordering: Sequence[str] = ("id",),
+    ) -> HttpResponseBase:
+        """
+        Build the list response of an endpoint
+
+        Args:
+            request: The list request, with the optional limit, after and stream parameters
+            queryset: Rows to return, in the order used when not paginating
+            key: Name of the list in the response body
+            serialize: Converts a row to its JSON dictionary
+            ordering: Keyset ordering used when paginating, ending in a unique field
+
+        Returns:
+            JsonResponse, or StreamingHttpResponse when stream is requested
+        """
+        try:
+            limit, cursor = cls.parse(request)
+            if cursor:
+                queryset = cls.after(
+                    queryset,
+                    ordering,
+                    cls.decode_cursor(queryset.model, ordering, cursor),
+                )
+        except InvalidPageRequest as e:
+            return JsonResponse({"success": False, "error": str(e)}, status=400)
+
+        if limit is not None:
+            # One extra row tells whether there is a next page
+            queryset = queryset.order_by(*ordering)[: limit + 1]
+
+        if request.GET.get("stream", "").lower() in TRUE_VALUES:
+            return StreamingHttpResponse(
+                cls._stream(queryset, key, serialize, ordering, limit),
+                content_type="application/json",
+            )
+
+        rows = list(queryset)
+        body: Dict[str, Any] = {
+            "success": True,
+            key: [serialize(row) for row in rows[:limit]],
+        }
+        if limit is not None:
+            body["next_cursor"] = (
+                cls.encode_cursor(rows[limit - 1], ordering)
+                if len(rows) > limit
+                else None
+            )
+        return JsonResponse(body)
+
+    @classmethod
+    def _stream(
+        cls,
+        queryset: QuerySet,
+        key: str,
+        serialize: Serializer,
+        ordering: Sequence[str],
+        limit: Optional[int],
+    ) -> Iterator[str]:
+        """Write the same body as the JsonResponse one row at a time"""
+        encoder = DjangoJSONEncoder()
+        yield f'{{"success": true, {encoder.encode(key)}: ['
+        last_row = None
+        has_next = False
+        for index, row in enumerate(
+            queryset.iterator(chunk_size=cls.STREAM_CHUNK_SIZE)
+        ):
+            if limit is not None and index == limit:
+                has_next = True
+                break
+            yield ("" if index == 0 else ", ") + encoder.encode(serialize(row))
+            last_row = row
+        yield "]"
+
+        if limit is not None:
+            next_cursor = (
+                cls.encode_cursor(last_row, ordering)
+                if has_next and last_row is not None
+                else None
+            )
+            yield f', "next_cursor": {encoder.encode(next_cursor)}'
+        yield "}"
@@ -0,0 +1,194 @@
+import cProfile
+import datetime
+import json
+import pstats
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from sanatorio_allende.metrics import Metrics
+from sanatorio_allende.upstream_guard import REQUESTS_METRIC
+
+
+class RunProfiler:
+    """
+    Profile of a find_appointments run
+
+    Combines a cProfile of the whole run with the wall time and number of
+    Allende calls of each patient and search, so a regression can be traced
+    to a stage, a patient or a function.
+    """
+
+    def __init__(self, top_n: int = 20, cprofile: bool = True):
+        self.top_n = top_n
+        # cProfile slows the run down, benchmarks only need the wall times
+        self.profile: Optional[cProfile.Profile] = (
+            cProfile.Profile() if cprofile else None
+        )
+        self.patients: List[Dict[str, Any]] = []
+        self.started_at: Optional[datetime.datetime] = None
+        self.wall_seconds = 0.0
+        self._started = 0.0
+        self._stages_before: Dict[str, Any] = {}
+        self._upstream_before: Dict[str, float] = {}
+        self._current_patient: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def _upstream_calls(cls) -> Dict[str, float]:
+        """Allende calls made so far by this process, by endpoint"""
+        calls: Dict[str, float] = {}
+        for labels, value in Metrics.counter_series(REQUESTS_METRIC).items():
+            endpoint = dict(labels)["endpoint"]
+            calls[endpoint] = calls.get(endpoint, 0) + value
+        return calls
+
+    @classmethod
+    def _delta(
+        cls, after: Dict[str, float], before: Dict[str, float]
+    ) -> Dict[str, float]:
+        return {
+            key: value - before.get(key, 0)
+            for key, value in after.items()
+            if value != before.get(key, 0)
+        }
+
+    def start(self) -> None:
+        self.started_at = datetime.datetime.now(datetime.timezone.utc)
+        self._stages_before = Metrics.stage_totals()
+        self._upstream_before = self._upstream_calls()
+        self._started = time.perf_counter()
+        if self.profile is not None:
+            self.profile.enable()
+
+    def stop(self) -> None:
+        if self.profile is not None:
+            self.profile.disable()
+        self.wall_seconds = time.perf_counter() - self._started
+
+    @contextmanager
+    def _timed_entry(self, entry: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        upstream_before = sum(self._upstream_calls().values())
+        started = time.perf_counter()
+        try:
+            yield entry
+        except Exception as e:
+            entry["error"] = str(e)
+            raise
+        finally:
+            entry["wall_seconds"] = round(time.perf_counter() - started, 6)
+            entry["upstream_calls"] = int(
+                sum(self._upstream_calls().values()) - upstream_before
+            )
+
+    @contextmanager
+    def patient(self, patient_id: int) -> Iterator[Dict[str, Any]]:
+        """Time the processing of a patient, its searches are nested in it"""
+        entry: Dict[str, Any] = {"patient_id": patient_id, "searches": []}
+        self.patients.append(entry)
+        self._current_patient = entry
+        try:
+            with self._timed_entry(entry):
+                yield entry
+        finally:
+            self._current_patient = None
+
+    @contextmanager
+    def search(self, find_appointment_id: int) -> Iterator[Dict[str, Any]]:
+        """Time a single search, the caller can add its result to the entry"""
+        entry: Dict[str, Any] = {"find_appointment_id": find_appointment_id}
+        if self._current_patient is not None:
+            self._current_patient["searches"].append(entry)
+        with self._timed_entry(entry):
+            yield entry
+
+    def top_functions(self) -> List[Dict[str, Any]]:
+        """Functions with the highest cumulative time in the run"""
+        if self.profile is None:
+            return []
+        stats = pstats.Stats(self.profile)
+        rows = []
+        function_stats = stats.stats.items()  # type: ignore[attr-defined]
+        for (filename, line, name), function_stat in function_stats:
+            _, calls, tottime, cumtime, _ = function_stat
+            rows.append(
+                {
+                    "function": f"{filename}:{line}({name})",
+                    "calls": calls,
+                    "tottime": round(tottime, 6),
+                    "cumtime": round(cumtime, 6),
+                }
+            )
+        rows.sort(key=lambda row: row["cumtime"], reverse=True)
+        return rows[: self.top_n]
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Build the machine-readable report of the run
+
+        Returns:
+            Dictionary with the run, stage, patient and function timings
+        """
+        stages_before = self._stages_before
+        stages = {}
+        for stage, (count, seconds) in Metrics.stage_totals().items():
+            count_before, seconds_before = stages_before.get(stage, (0, 0.0))
+            if count > count_before:
+                stages[stage] = {
+                    "count": count - count_before,
+                    "seconds": round(seconds - seconds_before, 6),
+                }
+
+        return {
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "wall_seconds": round(self.wall_seconds, 6),
+            "patient_count": len(self.patients),
+            "search_count": sum(len(p["searches"]) for p in self.patients),
+            "upstream_calls": self._delta(
+                self._upstream_calls(), self._upstream_before
+            ),
+            "stages": stages,
+            "patients": self.patients,
+            "top_functions": self.top_functions(),
+        }
+
+    def write(self, path: str) -> Dict[str, Any]:
+        """Write the JSON report and return it"""
+        report = self.report()
+        with open(path, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+        return report
+
+    @classmethod
+    def summary_lines(cls, report: Dict[str, Any], top_n: int = 10) -> List[str]:
+        """Human readable top-N summary of a report"""
+        lines = [
+            f"Run took {report['wall_seconds']:.2f}s for {report['patient_count']} "
+            f"patients and {report['search_count']} searches, "
+            f"{int(sum(report['upstream_calls'].values()))} Allende calls"
+        ]
+
+        lines.append("Slowest stages:")
+        for stage, timing in sorted(
+            report["stages"].items(), key=lambda item: -item[1]["seconds"]
+        )[:top_n]:
+            lines.append(
+                f"  {stage:<16} {timing['seconds']:>9.3f}s  {timing['count']} calls"
+            )
+
+        lines.append("Slowest patients:")
+        for patient in sorted(report["patients"], key=lambda p: -p["wall_seconds"])[
+            :top_n
+        ]:
+            lines.append(
+                f"  patient {patient['patient_id']:<8} {patient['wall_seconds']:>9.3f}s  "
+                f"{len(patient['searches'])} searches  "
+                f"{patient['upstream_calls']} Allende calls"
+            )
+
+        lines.append("Top functions by cumulative time:")
+        for function in report["top_functions"][:top_n]:
+            lines.append(
+                f"  {function['cumtime']:>9.3f}s  {function['calls']:>7} calls  "
+                f"{function['function']}"
+            )
+        return lines
@@ -8,6 +8,10 @@ from sanatorio_allende.models import (
     FindAppointment,
     PacienteAllende,
 )
+from sanatorio_allende.repositories.patient_version_repository import (
+    PatientVersionRepository,
+)
+from sanatorio_allende.services.appointment_booking import AppointmentBookingService
 
 
 class BestAppointmentRepository:
@@ -104,7 +108,7 @@ class BestAppointmentRepository:
         Returns:
             Created BestAppointmentFound object
         """
-        return BestAppointmentFound.objects.create(
+        best_appointment = BestAppointmentFound(
             appointment_wanted=appointment_wanted,
             datetime=appointment_datetime,
             patient=patient,
@@ -113,6 +117,12 @@ class BestAppointmentRepository:
             id_plantilla_turno=id_plantilla_turno,
             id_item_plantilla=id_item_plantilla,
         )
+        best_appointment.booking_payload = (
+            AppointmentBookingService.try_build_booking_payload(best_appointment)
+        )
+        best_appointment.save()
+        PatientVersionRepository.bump(patient.id)
+        return best_appointment
 
     @classmethod
     def update_best_appointment(
@@ -143,31 +153,44 @@ class BestAppointmentRepository:
             best_appointment.id_plantilla_turno = id_plantilla_turno
         if id_item_plantilla is not None:
             best_appointment.id_item_plantilla = id_item_plantilla
+        best_appointment.booking_payload = (
+            AppointmentBookingService.try_build_booking_payload(best_appointment)
+        )
         best_appointment.save(
             update_fields=[
                 "datetime",
                 "duracion_individual",
                 "id_plantilla_turno",
                 "id_item_plantilla",
+                "booking_payload",
             ]
         )
+        PatientVersionRepository.bump(best_appointment.patient_id)
         return best_appointment
 
     @classmethod
     def delete_previous_appointments(
         cls, best_appointment: BestAppointmentFound
-    ) -> None:
+    ) -> List[int]:
         """
         Delete a BestAppointmentFound record
 
         Args:
             best_appointment: The BestAppointmentFound object to delete
+
+        Returns:
+            IDs of the deleted appointments
         """
-        BestAppointmentFound.objects.filter(
-            appointment_wanted=best_appointment.appointment_wanted,
-            patient=best_appointment.patient,
-            datetime__lte=best_appointment.datetime,
-        ).delete()
+        deleted_ids = list(
+            BestAppointmentFound.objects.filter(
+                appointment_wanted=best_appointment.appointment_wanted,
+                patient=best_appointment.patient,
+                datetime__lte=best_appointment.datetime,
+            ).values_list("id", flat=True)
+        )
+        BestAppointmentFound.objects.filter(id__in=deleted_ids).delete()
+        PatientVersionRepository.bump(best_appointment.patient_id)
+        return deleted_ids
 
     @classmethod
     def get_or_create_best_appointment(
@@ -187,8 +210,11 @@ class BestAppointmentRepository:
         Returns:
             Tuple of (BestAppointmentFound object, created boolean)
         """
-        return BestAppointmentFound.objects.get_or_create(
+        best_appointment, created = BestAppointmentFound.objects.get_or_create(
             appointment_wanted=appointment_wanted,
             patient=patient,
             defaults={"datetime": appointment_datetime},
         )
+        if created:
+            PatientVersionRepository.bump(patient.id)
+        return best_appointment, created
@@ -0,0 +1,107 @@
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+
+from sanatorio_allende.models import DeviceRegistration
+
+
+class DeviceRegistrationRepository:
+    """Service for handling DeviceRegistration database operations with a per-user token cache"""
+
+    CACHE_KEY_PREFIX = "device_tokens"
+
+    @classmethod
+    def _cache_key(cls, user_id: Optional[int]) -> str:
+        return f"{cls.CACHE_KEY_PREFIX}:{user_id if user_id is not None else 'none'}"
+
+    @classmethod
+    def _cache_timeout(cls) -> int:
+        return int(getattr(settings, "DEVICE_TOKEN_CACHE_TIMEOUT", 3600))
+
+    @classmethod
+    def get_active_tokens(cls, user: Optional[User]) -> List[str]:
+        """
+        Get the push tokens of the active devices registered for a user
+
+        Args:
+            user: The user owning the devices (None for devices without a user)
+
+        Returns:
+            List of push tokens, served from the cache when available
+        """
+        user_id = user.id if user is not None else None
+        key = cls._cache_key(user_id)
+        tokens = cache.get(key)
+        if tokens is None:
+            tokens = list(
+                DeviceRegistration.objects.filter(
+                    is_active=True, user=user
+                ).values_list("push_token", flat=True)
+            )
+            cache.set(key, tokens, cls._cache_timeout())
+        return tokens  # type: ignore
+
+    @classmethod
+    def prime_active_tokens(cls, user_ids: Iterable[int]) -> Dict[int, List[str]]:
+        """
+        Load the active push tokens of many users with a single query and store them in the cache
+
+        Args:
+            user_ids: IDs of the users to load
+
+        Returns:
+            Dictionary mapping each user ID to its list of push tokens
+        """
+        tokens_by_user: Dict[int, List[str]] = {user_id: [] for user_id in user_ids}
+        if not tokens_by_user:
+            return tokens_by_user
+
+        for user_id, push_token in DeviceRegistration.objects.filter(
+            is_active=True, user_id__in=tokens_by_user.keys()
+        ).values_list("user_id", "push_token"):
+            tokens_by_user[user_id].append(push_token)
+
+        cache.set_many(
+            {
+                cls._cache_key(user_id): tokens
+                for user_id, tokens in tokens_by_user.items()
+            },
+            cls._cache_timeout(),
+        )
+        return tokens_by_user
+
+    @classmethod
+    def invalidate(cls, user_id: Optional[int]) -> None:
+        """
+        Drop the cached tokens of a user
+
+        Args:
+            user_id: ID of the user whose cached tokens must be reloaded
+        """
+        cache.delete(cls._cache_key(user_id))
+
+    @classmethod
+    def deactivate_tokens(cls, push_tokens: Iterable[str]) -> int:
+        """
+        Mark devices as inactive (e.g. after Expo reports DeviceNotRegistered)
+
+        Args:
+            push_tokens: Push tokens to deactivate
+
+        Returns:
+            Number of devices deactivated
+        """
+        push_tokens = list(push_tokens)
+        if not push_tokens:
+            return 0
+
+        devices = DeviceRegistration.objects.filter(
+            push_token__in=push_tokens, is_active=True
+        )
+        user_ids = set(devices.values_list("user_id", flat=True))
+        updated = devices.update(is_active=False)
+        for user_id in user_ids:
+            cls.invalidate(user_id)
+        return updated
@@ -0,0 +1,72 @@
+from django.db import connections, router
+from django.db.models import OuterRef, QuerySet, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from sanatorio_allende.db_router import PrimaryStickiness
+from sanatorio_allende.models import PacienteAllende, PatientListVersion
+
+
+class PatientVersionRepository:
+    """Per-patient change counter of the searches and appointments found"""
+
+    @classmethod
+    def get(cls, patient_id: int) -> int:
+        """
+        Get the current version of a patient's data
+
+        Args:
+            patient_id: ID of the PacienteAllende
+
+        Returns:
+            The version, 0 until the patient's data first changes
+        """
+        version = (
+            PatientListVersion.objects.filter(patient_id=patient_id)
+            .values_list("version", flat=True)
+            .first()
+        )
+        return version or 0
+
+    @classmethod
+    def with_version(
+        cls, queryset: QuerySet[PacienteAllende]
+    ) -> QuerySet[PacienteAllende]:
+        """
+        Annotate each patient with its version as list_version
+
+        Args:
+            queryset: PacienteAllende queryset, e.g. of the ownership check
+
+        Returns:
+            The queryset with list_version, saves the query of get()
+        """
+        return queryset.annotate(
+            list_version=Coalesce(
+                Subquery(
+                    PatientListVersion.objects.filter(patient_id=OuterRef("pk")).values(
+                        "version"
+                    )[:1]
+                ),
+                Value(0),
+            )
+        )
+
+    @classmethod
+    def bump(cls, patient_id: int) -> None:
+        """
+        Record a change to the searches or appointments found of a patient
+
+        Args:
+            patient_id: ID of the PacienteAllende
+        """
+        # Optimized: One upsert, concurrent bumps are never lost
+        connection = connections[router.db_for_write(PatientListVersion)]
+        table = connection.ops.quote_name(PatientListVersion._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} (patient_id, version) VALUES (%s, 1) "
+                f"ON CONFLICT (patient_id) DO UPDATE SET version = {table}.version + 1",
+                [patient_id],
+            )
+        # The replica may not have the change yet, read the lists from the primary
+        PrimaryStickiness.pin_patient(patient_id)
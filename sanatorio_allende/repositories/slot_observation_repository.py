@@ -0,0 +1,201 @@
+import datetime
+import logging
+import re
+from typing import List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+
+from sanatorio_allende.metrics import Metrics
+from sanatorio_allende.models import SlotObservation
+
+logger = logging.getLogger(__name__)
+
+OBSERVATIONS_METRIC = "turnos_slot_observations_total"
+
+
+class SlotObservationRepository:
+    """
+    Service for writing the slot observation log and its monthly partitions
+
+    On PostgreSQL the table is partitioned by month (UTC) of observed_at. The
+    partitions of the current and the next month are created before the first
+    insert of a month, and expired months are dropped whole instead of deleted
+    row by row.
+    """
+
+    TABLE = SlotObservation._meta.db_table
+    DEFAULT_PARTITION = f"{TABLE}_default"
+    PARTITION_NAME = re.compile(rf"^{TABLE}_y(\d{{4}})m(\d{{2}})$")
+
+    # Months whose partitions were created by this process
+    _prepared_months: Set[Tuple[int, int]] = set()
+    # Months in which this process already dropped the expired observations
+    _purged_months: Set[Tuple[int, int]] = set()
+
+    @classmethod
+    def _month_start(cls, moment: datetime.datetime) -> datetime.datetime:
+        moment = moment.astimezone(datetime.timezone.utc)
+        return datetime.datetime(
+            moment.year, moment.month, 1, tzinfo=datetime.timezone.utc
+        )
+
+    @classmethod
+    def _add_months(cls, month: datetime.datetime, months: int) -> datetime.datetime:
+        index = month.year * 12 + month.month - 1 + months
+        return month.replace(year=index // 12, month=index % 12 + 1)
+
+    @classmethod
+    def _partition_name(cls, month: datetime.datetime) -> str:
+        return f"{cls.TABLE}_y{month.year}m{month.month:02d}"
+
+    @classmethod
+    def retention_cutoff(cls, now: datetime.datetime) -> datetime.datetime:
+        """Observations before this moment are dropped"""
+        months = int(getattr(settings, "SLOT_OBSERVATION_RETENTION_MONTHS", 12))
+        return cls._add_months(cls._month_start(now), -months)
+
+    @classmethod
+    def create_partition(cls, month: datetime.datetime) -> None:
+        """
+        Create the partition of a month if it does not exist yet
+
+        Rows of the month already in the default partition (written while the
+        partition could not be created) make CREATE ... PARTITION OF fail, so
+        they are moved into the new table before it is attached.
+
+        Args:
+            month: First moment of the month, in UTC
+        """
+        name = cls._partition_name(month)
+        next_month = cls._add_months(month, 1)
+        # Bounds are generated dates, DDL takes no query parameters
+        bounds = f"FROM ('{month.isoformat()}') TO ('{next_month.isoformat()}')"
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [name])
+            if cursor.fetchone()[0]:
+                return
+
+            # Attaching scans the default partition, lock it for the whole move
+            cursor.execute(
+                f"LOCK TABLE {cls.DEFAULT_PARTITION} IN ACCESS EXCLUSIVE MODE"
+            )
+            cursor.execute(
+                f"SELECT EXISTS (SELECT 1 FROM {cls.DEFAULT_PARTITION} "
+                f"WHERE observed_at >= %s AND observed_at < %s)",
+                [month, next_month],
+            )
+            if not cursor.fetchone()[0]:
+                cursor.execute(
+                    f"CREATE TABLE {name} PARTITION OF {cls.TABLE} FOR VALUES {bounds}"
+                )
+                return
+
+            cursor.execute(f"CREATE TABLE {name} (LIKE {cls.TABLE})")
+            cursor.execute(
+                f"WITH moved AS (DELETE FROM {cls.DEFAULT_PARTITION} "
+                f"WHERE observed_at >= %s AND observed_at < %s RETURNING *) "
+                f"INSERT INTO {name} SELECT * FROM moved",
+                [month, next_month],
+            )
+            moved = cursor.rowcount
+            cursor.execute(
+                f"ALTER TABLE {cls.TABLE} ATTACH PARTITION {name} FOR VALUES {bounds}"
+            )
+        logger.info(f"Moved {moved} slot observations from the default partition")
+
+    @classmethod
+    def partitions(cls) -> List[Tuple[str, datetime.datetime]]:
+        """Monthly partitions of the table, as (name, first moment of the month)"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT child.relname FROM pg_inherits "
+                "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+                "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                "WHERE parent.relname = %s",
+                [cls.TABLE],
+            )
+            names = [row[0] for row in cursor.fetchall()]
+
+        partitions = []
+        for name in names:
+            match = cls.PARTITION_NAME.match(name)
+            if match:
+                month = datetime.datetime(
+                    int(match.group(1)),
+                    int(match.group(2)),
+                    1,
+                    tzinfo=datetime.timezone.utc,
+                )
+                partitions.append((name, month))
+        return sorted(partitions, key=lambda partition: partition[1])
+
+    @classmethod
+    def purge(cls, now: Optional[datetime.datetime] = None) -> None:
+        """
+        Drop the observations older than SLOT_OBSERVATION_RETENTION_MONTHS
+
+        Args:
+            now: Current time (defaults to timezone.now())
+        """
+        cutoff = cls.retention_cutoff(now or timezone.now())
+        if connection.vendor == "postgresql":
+            for name, month in cls.partitions():
+                if month < cutoff:
+                    with connection.cursor() as cursor:
+                        cursor.execute(f"DROP TABLE IF EXISTS {name}")
+                    logger.info(f"Dropped slot observation partition {name}")
+        # Rows left in the default partition, or the whole table elsewhere
+        SlotObservation.objects.filter(observed_at__lt=cutoff).delete()
+
+    @classmethod
+    def prepare(cls, now: datetime.datetime) -> None:
+        """
+        Create the partitions for the month's inserts and drop the expired ones
+
+        Runs once per month and process. A failed partition creation only
+        leaves the rows in the default partition, the observations are still
+        written and the creation is retried on the next write. The expired
+        observations are dropped either way.
+
+        Args:
+            now: Time of the observations about to be written
+        """
+        month = cls._month_start(now)
+        key = (month.year, month.month)
+
+        if key not in cls._prepared_months:
+            try:
+                if connection.vendor == "postgresql":
+                    cls.create_partition(month)
+                    cls.create_partition(cls._add_months(month, 1))
+                cls._prepared_months.add(key)
+            except DatabaseError as e:
+                logger.warning(f"Could not create the slot observation partitions: {e}")
+
+        if key not in cls._purged_months:
+            try:
+                cls.purge(now)
+                cls._purged_months.add(key)
+            except DatabaseError as e:
+                logger.warning(f"Could not purge the slot observations: {e}")
+
+    @classmethod
+    def record(cls, observations: List[SlotObservation]) -> int:
+        """
+        Write the observations of a run with bulk inserts
+
+        Args:
+            observations: Unsaved SlotObservation objects
+
+        Returns:
+            Number of observations written
+        """
+        if not observations:
+            return 0
+
+        cls.prepare(max(observation.observed_at for observation in observations))
+        SlotObservation.objects.bulk_create(observations, batch_size=1000)
+        Metrics.inc(OBSERVATIONS_METRIC, len(observations))
+        return len(observations)
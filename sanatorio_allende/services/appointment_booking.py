@@ -0,0 +1,250 @@
+import logging
+from contextlib import nullcontext
+from dataclasses import dataclass
+from typing import Any, ContextManager, Dict, Optional
+
+from django.db import transaction
+from django.utils import timezone
+
+from sanatorio_allende.allende_api import Allende
+from sanatorio_allende.models import AppointmentEvent, BestAppointmentFound
+from sanatorio_allende.repositories.patient_version_repository import (
+    PatientVersionRepository,
+)
+from sanatorio_allende.services.appointment_events import AppointmentEventService
+
+logger = logging.getLogger(__name__)
+
+REQUISITO_ADMINISTRATIVO = (
+    "DNI\nCredencial Financiador\n AUTORIZACION: Con autorización online"
+)
+
+
+@dataclass
+class BookingResult:
+    """Result of booking an appointment in Allende"""
+
+    success: bool
+    id_turno: Optional[int] = None
+    error: Optional[str] = None
+    data: Optional[dict] = None
+
+
+class AppointmentBookingService:
+    """Service for booking BestAppointmentFound slots in Allende"""
+
+    @classmethod
+    def build_booking_payload(
+        cls, best_appointment: BestAppointmentFound
+    ) -> Dict[str, Any]:
+        """
+        Build the payload expected by the Allende Asignar endpoint
+
+        Args:
+            best_appointment: The BestAppointmentFound object to book, with its
+                patient and appointment_wanted loaded
+
+        Returns:
+            Dictionary with the CriterioBusquedaDto/TurnoElegidoDto payload
+        """
+        patient = best_appointment.patient
+        appointment_wanted = best_appointment.appointment_wanted
+        assert isinstance(patient.id_paciente, str)
+        assert isinstance(patient.id_financiador, int)
+        assert isinstance(patient.id_plan, int)
+
+        local_datetime = timezone.localtime(best_appointment.datetime)
+        return {
+            "CriterioBusquedaDto": {
+                "IdPaciente": int(patient.id_paciente),
+                "IdServicio": appointment_wanted.id_servicio,
+                "IdSucursal": appointment_wanted.id_sucursal,
+                "IdRecurso": appointment_wanted.id_recurso,
+                "IdEspecialidad": appointment_wanted.id_especialidad,
+                "ControlarEdad": False,
+                "IdTipoDeTurno": appointment_wanted.id_tipo_prestacion,
+                "IdFinanciador": int(patient.id_financiador),
+                "IdTipoRecurso": appointment_wanted.id_tipo_recurso,
+                "IdPlan": int(patient.id_plan),
+                "Prestaciones": [
+                    {
+                        "IdPrestacion": appointment_wanted.id_prestacion,
+                        "IdItemSolicitudEstudios": 0,
+                    }
+                ],
+            },
+            "TurnoElegidoDto": {
+                "Fecha": local_datetime.strftime("%Y-%m-%dT00:00:00"),
+                "Hora": local_datetime.strftime("%H:%M"),
+                "IdItemDePlantilla": best_appointment.id_item_plantilla,
+                "IdPlantillaTurno": best_appointment.id_plantilla_turno,
+                "IdSucursal": appointment_wanted.id_sucursal,
+                "DuracionIndividual": best_appointment.duracion_individual,
+                "RequisitoAdministrativoAlOtorgar": REQUISITO_ADMINISTRATIVO,
+            },
+            "Observaciones": None,
+        }
+
+    @classmethod
+    def try_build_booking_payload(
+        cls, best_appointment: BestAppointmentFound
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Build the booking payload if the patient data needed for it is known
+
+        Args:
+            best_appointment: The BestAppointmentFound object, with its patient
+                and appointment_wanted loaded
+
+        Returns:
+            The booking payload, or None if the patient has not been synced yet
+        """
+        patient = best_appointment.patient
+        if (
+            patient.id_paciente is None
+            or patient.id_financiador is None
+            or patient.id_plan is None
+        ):
+            return None
+        return cls.build_booking_payload(best_appointment)
+
+    @classmethod
+    def get_booking_payload(
+        cls, best_appointment: BestAppointmentFound
+    ) -> Dict[str, Any]:
+        """
+        Get the prebuilt booking payload, building and storing it when missing
+
+        Args:
+            best_appointment: The BestAppointmentFound object
+
+        Returns:
+            Dictionary with the booking payload
+        """
+        if best_appointment.booking_payload:
+            return best_appointment.booking_payload  # type: ignore
+
+        full_appointment = BestAppointmentFound.objects.select_related(
+            "patient", "appointment_wanted"
+        ).get(id=best_appointment.id)
+        payload = cls.build_booking_payload(full_appointment)
+        BestAppointmentFound.objects.filter(id=best_appointment.id).update(
+            booking_payload=payload
+        )
+        best_appointment.booking_payload = payload
+        return payload
+
+    @classmethod
+    def invalidate_booking_payloads(
+        cls,
+        patient_id: Optional[int] = None,
+        appointment_wanted_id: Optional[int] = None,
+    ) -> int:
+        """
+        Drop the prebuilt payloads affected by a patient or search change
+
+        Args:
+            patient_id: Invalidate the payloads of this patient
+            appointment_wanted_id: Invalidate the payloads of this search
+
+        Returns:
+            Number of appointments invalidated
+        """
+        appointments = BestAppointmentFound.objects.filter(
+            confirmed=False, booking_payload__isnull=False
+        )
+        if patient_id is not None:
+            appointments = appointments.filter(patient_id=patient_id)
+        if appointment_wanted_id is not None:
+            appointments = appointments.filter(
+                appointment_wanted_id=appointment_wanted_id
+            )
+        return appointments.update(booking_payload=None)
+
+    @classmethod
+    def has_confirmed_appointment(cls, best_appointment: BestAppointmentFound) -> bool:
+        """
+        Check if the search of this appointment already has a booked slot
+
+        Args:
+            best_appointment: The BestAppointmentFound object
+
+        Returns:
+            True if any slot of the same search and patient is confirmed
+        """
+        return BestAppointmentFound.objects.filter(
+            appointment_wanted_id=best_appointment.appointment_wanted_id,
+            patient_id=best_appointment.patient_id,
+            confirmed=True,
+        ).exists()
+
+    @classmethod
+    def book(
+        cls,
+        best_appointment: BestAppointmentFound,
+        allende: Allende,
+        payload: Optional[Dict[str, Any]] = None,
+        locked: bool = False,
+    ) -> BookingResult:
+        """
+        Book the appointment in Allende and store the confirmation
+
+        The appointment row is locked for the whole booking, so the search
+        worker auto-booking a slot and the patient confirming it from the
+        app never book it twice upstream.
+
+        Args:
+            best_appointment: The BestAppointmentFound object to book
+            allende: An Allende client authenticated as the patient
+            payload: Prebuilt booking payload (built from the appointment if not given)
+            locked: The caller already holds the row lock and loaded the
+                appointment under it
+
+        Returns:
+            BookingResult with the booked turno ID or the error
+
+        Raises:
+            UnauthorizedException: If the patient token is no longer valid
+            requests.RequestException: If the upstream call fails
+        """
+        lock: ContextManager[Any] = nullcontext()
+        if not locked:
+            lock = transaction.atomic()
+        with lock:
+            # A concurrent booking may have confirmed it since it was loaded
+            if not locked and not best_appointment.confirmed:
+                best_appointment.confirmed = bool(
+                    BestAppointmentFound.objects.select_for_update()
+                    .filter(id=best_appointment.id)
+                    .values_list("confirmed", flat=True)
+                    .first()
+                )
+            if best_appointment.confirmed:
+                return BookingResult(
+                    success=False, error="Appointment is already confirmed"
+                )
+
+            result = allende.book_appointment(
+                payload or cls.get_booking_payload(best_appointment)
+            )
+            if result.id_turno is None:
+                logger.warning(f"Booking without turno ID: {result.data}")
+                return BookingResult(
+                    success=False,
+                    error="No se pudo obtener el ID del turno",
+                    data=result.data,
+                )
+
+            # Optimized: Update only specific fields
+            best_appointment.confirmed_id_turno = result.id_turno
+            best_appointment.confirmed = True
+            best_appointment.confirmed_at = timezone.now()
+            best_appointment.save(
+                update_fields=["confirmed_id_turno", "confirmed", "confirmed_at"]
+            )
+        PatientVersionRepository.bump(best_appointment.patient_id)
+        AppointmentEventService.record_confirmation(
+            AppointmentEvent.BOOKED, best_appointment
+        )
+
+        return BookingResult(success=True, id_turno=result.id_turno, data=result.data)
@@ -0,0 +1,168 @@
+import datetime
+import logging
+from typing import Any, Dict, List, Optional, Set
+
+from django.conf import settings
+from django.utils import timezone
+
+from sanatorio_allende.models import AppointmentEvent, BestAppointmentFound
+
+logger = logging.getLogger(__name__)
+
+
+class AppointmentEventService:
+    """Service to record and read the AppointmentEvent log streamed to the app"""
+
+    @classmethod
+    def serialize(cls, best_appointment: BestAppointmentFound) -> Dict[str, Any]:
+        """
+        Serialize an appointment found as listed by api/best-appointments/
+
+        Args:
+            best_appointment: The BestAppointmentFound, with appointment_wanted loaded
+
+        Returns:
+            Dictionary with the appointment fields shown by the app
+        """
+        appointment = best_appointment.appointment_wanted
+        return {
+            "id": best_appointment.id,
+            "doctor_name": appointment.doctor_name,
+            "especialidad": appointment.especialidad,
+            "location": appointment.sucursal,
+            "tipo_de_turno": appointment.nombre_tipo_prestacion,
+            "best_datetime": best_appointment.datetime.isoformat(),
+            "duracion_individual": best_appointment.duracion_individual,
+            "id_plantilla_turno": best_appointment.id_plantilla_turno,
+            "id_item_plantilla": best_appointment.id_item_plantilla,
+            "confirmed": best_appointment.confirmed,
+            "confirmed_at": (
+                best_appointment.confirmed_at.isoformat()
+                if best_appointment.confirmed_at
+                else None
+            ),
+        }
+
+    @classmethod
+    def record(
+        cls, patient_id: int, event_type: str, payload: Dict[str, Any]
+    ) -> AppointmentEvent:
+        """
+        Record a change to the appointments found for a patient
+
+        Args:
+            patient_id: ID of the PacienteAllende
+            event_type: One of the AppointmentEvent types
+            payload: Event data sent to the app
+
+        Returns:
+            The created AppointmentEvent
+        """
+        return AppointmentEvent.objects.create(
+            patient_id=patient_id, event_type=event_type, payload=payload
+        )
+
+    @classmethod
+    def record_appointment(
+        cls, event_type: str, best_appointment: BestAppointmentFound
+    ) -> AppointmentEvent:
+        """Record a created or updated appointment with its list row as payload"""
+        return cls.record(
+            best_appointment.patient_id, event_type, cls.serialize(best_appointment)
+        )
+
+    @classmethod
+    def record_confirmation(
+        cls, event_type: str, best_appointment: BestAppointmentFound
+    ) -> AppointmentEvent:
+        """Record a booked or cancelled appointment"""
+        return cls.record(
+            best_appointment.patient_id,
+            event_type,
+            {
+                "id": best_appointment.id,
+                "confirmed": best_appointment.confirmed,
+                "confirmed_at": (
+                    best_appointment.confirmed_at.isoformat()
+                    if best_appointment.confirmed_at
+                    else None
+                ),
+            },
+        )
+
+    @classmethod
+    def events_after(
+        cls,
+        last_event_id: int,
+        patient_id: Optional[int] = None,
+        limit: int = 500,
+    ) -> List[AppointmentEvent]:
+        """
+        Get the events written after a resume token
+
+        Args:
+            last_event_id: ID of the last event already delivered
+            patient_id: Only the events of this patient (all patients if None)
+            limit: Maximum number of events returned
+
+        Returns:
+            Events in ID order
+        """
+        events = AppointmentEvent.objects.filter(id__gt=last_event_id)
+        if patient_id is not None:
+            events = events.filter(patient_id=patient_id)
+        return list(events.order_by("id")[:limit])
+
+    @classmethod
+    def ids_since(cls, since: datetime.datetime, up_to_id: int) -> Set[int]:
+        """
+        IDs of the recent events up to a resume token
+
+        Used to find events that committed after an event with a higher ID.
+
+        Args:
+            since: Oldest creation time included
+            up_to_id: Highest event ID included
+
+        Returns:
+            Set of event IDs
+        """
+        return set(
+            AppointmentEvent.objects.filter(
+                created_at__gte=since, id__lte=up_to_id
+            ).values_list("id", flat=True)
+        )
+
+    @classmethod
+    def latest_id(cls) -> int:
+        """ID of the newest event, 0 if there are none"""
+        latest = AppointmentEvent.objects.order_by("-id").values_list("id", flat=True)
+        return latest.first() or 0
+
+    @classmethod
+    def oldest_id(cls) -> Optional[int]:
+        """ID of the oldest event still kept"""
+        return (
+            AppointmentEvent.objects.order_by("id").values_list("id", flat=True).first()
+        )
+
+    @classmethod
+    def purge(cls, now: Optional[datetime.datetime] = None) -> int:
+        """
+        Delete the events older than the resume window
+
+        Args:
+            now: Current time (defaults to timezone.now())
+
+        Returns:
+            Number of events deleted
+        """
+        retention = datetime.timedelta(
+            hours=getattr(settings, "APPOINTMENT_EVENT_RETENTION_HOURS", 24)
+        )
+        deleted, _ = AppointmentEvent.objects.filter(
+            created_at__lt=(now or timezone.now()) - retention
+        ).delete()
+        if deleted:
+            logger.info(f"Purged {deleted} appointment events")
+        return deleted
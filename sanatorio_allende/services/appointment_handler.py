@@ -1,12 +1,18 @@
+import logging
+import time
 from dataclasses import dataclass
 from datetime import datetime
 from enum import Enum
 from typing import Optional
 
+import requests
 from django.contrib.auth.models import User
 from django.utils import timezone
 
+from sanatorio_allende.allende_api import Allende, UnauthorizedException
+from sanatorio_allende.metrics import Metrics
 from sanatorio_allende.models import (
+    AppointmentEvent,
     BestAppointmentFound,
     FindAppointment,
     PacienteAllende,
@@ -14,6 +20,11 @@ from sanatorio_allende.models import (
 from sanatorio_allende.repositories.best_appointment_repository import (
     BestAppointmentRepository,
 )
+from sanatorio_allende.repositories.patient_version_repository import (
+    PatientVersionRepository,
+)
+from sanatorio_allende.services.appointment_booking import AppointmentBookingService
+from sanatorio_allende.services.appointment_events import AppointmentEventService
 from sanatorio_allende.services.appointment_notification_service import (
     AppointmentNotificationService,
 )
@@ -22,8 +33,11 @@ from sanatorio_allende.services.appointment_processor import (
     AppointmentComparisonResult,
     AppointmentData,
     AppointmentProcessor,
+    NotificationType,
 )
 
+logger = logging.getLogger(__name__)
+
 
 class AppointmentActionType(Enum):
     """Types of actions that can be performed on appointments"""
@@ -32,6 +46,8 @@ class AppointmentActionType(Enum):
     UPDATED = "updated"
     REMOVED = "removed"
     SKIPPED = "skipped"
+    # Same availability as the last poll, not processed again
+    UNCHANGED = "unchanged"
     NONE = "none"
 
 
@@ -42,6 +58,9 @@ class AppointmentProcessingResult:
     action: AppointmentActionType
     message: str
     notification_sent: bool = False
+    auto_booked: bool = False
+    # Seconds elapsed between detecting the slot and booking it
+    time_to_book: Optional[float] = None
 
 
 class AppointmentHandler:
@@ -54,6 +73,9 @@ class AppointmentHandler:
         patient: PacienteAllende,
         user: User,
         new_appointment_data: Optional[dict] = None,
+        allende: Optional[Allende] = None,
+        detected_at: Optional[float] = None,
+        now: Optional[datetime] = None,
     ) -> AppointmentProcessingResult:
         """
         Process a new appointment and handle all logic in one place
@@ -63,34 +85,40 @@ class AppointmentHandler:
             patient: The PacienteAllende object
             appointment_data: Dictionary containing appointment data including datetime and additional fields
             user: The user to send notifications to
+            allende: Authenticated Allende client, required to auto-book slots
+            detected_at: time.monotonic() value when the slot was received from upstream
+            now: Current time of the run, shared by all its timeframe checks
 
         Returns:
             Dictionary with processing result
         """
+        if detected_at is None:
+            detected_at = time.monotonic()
         new_appointment_data = new_appointment_data or {"datetime": None}
         new_appointment_datetime = new_appointment_data["datetime"]
 
-        # Get current best appointment
-        best_appointment_so_far = (
-            BestAppointmentRepository.get_current_best_appointment(
-                appointment_to_find, patient
+        with Metrics.timed("db_read"):
+            # Get current best appointment
+            best_appointment_so_far = (
+                BestAppointmentRepository.get_current_best_appointment(
+                    appointment_to_find, patient
+                )
             )
-        )
 
-        # Prepare comparison data
-        current_best_datetime = (
-            best_appointment_so_far.datetime if best_appointment_so_far else None
-        )
+            # Prepare comparison data
+            current_best_datetime = (
+                best_appointment_so_far.datetime if best_appointment_so_far else None
+            )
 
-        # Get all not_interested appointments
-        not_interested_appointments = (
-            BestAppointmentRepository.get_not_interested_appointments(
-                appointment_to_find, patient
+            # Get all not_interested appointments
+            not_interested_appointments = (
+                BestAppointmentRepository.get_not_interested_appointments(
+                    appointment_to_find, patient
+                )
             )
-        )
-        not_interested_datetimes = [
-            appt.datetime for appt in not_interested_appointments
-        ]
+            not_interested_datetimes = [
+                appt.datetime for appt in not_interested_appointments
+            ]
 
         # Check timeframe only for new appointments (not for better appointments)
         if current_best_datetime is None:
@@ -101,19 +129,24 @@ class AppointmentHandler:
                     notification_sent=False,
                 )
 
-        if (
-            new_appointment_datetime is not None
-            and appointment_to_find.desired_timeframe is not None
-            and not AppointmentProcessor.is_within_desired_timeframe(
-                new_appointment_datetime, appointment_to_find.desired_timeframe
+        with Metrics.timed("compare"):
+            if (
+                new_appointment_datetime is not None
+                and appointment_to_find.desired_timeframe is not None
+                and not AppointmentProcessor.is_within_desired_timeframe(
+                    new_appointment_datetime,
+                    appointment_to_find.desired_timeframe,
+                    now,
+                )
+            ):
+                new_appointment_datetime = None
+
+            # Compare appointments
+            comparison_result = AppointmentProcessor.compare_appointments(
+                new_appointment_datetime,
+                current_best_datetime,
+                not_interested_datetimes,
             )
-        ):
-            new_appointment_datetime = None
-
-        # Compare appointments
-        comparison_result = AppointmentProcessor.compare_appointments(
-            new_appointment_datetime, current_best_datetime, not_interested_datetimes
-        )
 
         # Create appointment data for notifications and processing
         complete_appointment_data = AppointmentData(
@@ -134,6 +167,8 @@ class AppointmentHandler:
             patient,
             complete_appointment_data,
             user,
+            allende,
+            detected_at,
         )
 
         return result
@@ -146,20 +181,28 @@ class AppointmentHandler:
         patient: PacienteAllende,
         appointment_data: AppointmentData,
         user: User,
+        allende: Optional[Allende] = None,
+        detected_at: Optional[float] = None,
     ) -> AppointmentProcessingResult:
         """Handle the specific action from comparison result"""
+        best_appointment: Optional[BestAppointmentFound] = None
+        notification_type = comparison_result.notification_type
 
         if comparison_result.action == AppointmentAction.CREATE_NEW:
             assert isinstance(comparison_result.new_datetime, datetime)
 
-            BestAppointmentRepository.create_best_appointment(
-                appointment_to_find,
-                patient,
-                comparison_result.new_datetime,
-                duracion_individual=appointment_data.duracion_individual,
-                id_plantilla_turno=appointment_data.id_plantilla_turno,
-                id_item_plantilla=appointment_data.id_item_plantilla,
-            )
+            with Metrics.timed("db_write"):
+                best_appointment = BestAppointmentRepository.create_best_appointment(
+                    appointment_to_find,
+                    patient,
+                    comparison_result.new_datetime,
+                    duracion_individual=appointment_data.duracion_individual,
+                    id_plantilla_turno=appointment_data.id_plantilla_turno,
+                    id_item_plantilla=appointment_data.id_item_plantilla,
+                )
+                AppointmentEventService.record_appointment(
+                    AppointmentEvent.CREATED, best_appointment
+                )
 
             result = AppointmentProcessingResult(
                 action=AppointmentActionType.CREATED,
@@ -168,20 +211,27 @@ class AppointmentHandler:
 
         elif comparison_result.action == AppointmentAction.UPDATE_EXISTING:
             assert isinstance(comparison_result.new_datetime, datetime)
-            best_appointment_so_far = (
-                BestAppointmentRepository.get_current_best_appointment(
-                    appointment_to_find, patient
+            with Metrics.timed("db_read"):
+                best_appointment_so_far = (
+                    BestAppointmentRepository.get_current_best_appointment(
+                        appointment_to_find, patient
+                    )
                 )
-            )
             assert isinstance(best_appointment_so_far, BestAppointmentFound)
 
-            BestAppointmentRepository.update_best_appointment(
-                best_appointment_so_far,
-                comparison_result.new_datetime,
-                duracion_individual=appointment_data.duracion_individual,
-                id_plantilla_turno=appointment_data.id_plantilla_turno,
-                id_item_plantilla=appointment_data.id_item_plantilla,
-            )
+            with Metrics.timed("db_write"):
+                best_appointment = BestAppointmentRepository.update_best_appointment(
+                    best_appointment_so_far,
+                    comparison_result.new_datetime,
+                    duracion_individual=appointment_data.duracion_individual,
+                    id_plantilla_turno=appointment_data.id_plantilla_turno,
+                    id_item_plantilla=appointment_data.id_item_plantilla,
+                )
+                # Same search, avoids loading it again for the event payload
+                best_appointment.appointment_wanted = appointment_to_find
+                AppointmentEventService.record_appointment(
+                    AppointmentEvent.UPDATED, best_appointment
+                )
 
             result = AppointmentProcessingResult(
                 action=AppointmentActionType.UPDATED,
@@ -189,16 +239,21 @@ class AppointmentHandler:
             )
 
         elif comparison_result.action == AppointmentAction.REMOVE_EXISTING:
-            best_appointment_so_far = (
-                BestAppointmentRepository.get_current_best_appointment(
-                    appointment_to_find, patient
+            with Metrics.timed("db_read"):
+                best_appointment_so_far = (
+                    BestAppointmentRepository.get_current_best_appointment(
+                        appointment_to_find, patient
+                    )
                 )
-            )
 
             assert best_appointment_so_far is not None
-            BestAppointmentRepository.delete_previous_appointments(
-                best_appointment_so_far
-            )
+            with Metrics.timed("db_write"):
+                deleted_ids = BestAppointmentRepository.delete_previous_appointments(
+                    best_appointment_so_far
+                )
+                AppointmentEventService.record(
+                    patient.id, AppointmentEvent.REMOVED, {"ids": deleted_ids}
+                )
             result = AppointmentProcessingResult(
                 action=AppointmentActionType.REMOVED,
                 message=f"Removed worse appointments for {appointment_to_find.doctor_name} - {appointment_to_find.nombre_tipo_prestacion}: {comparison_result.previous_datetime}",
@@ -210,6 +265,17 @@ class AppointmentHandler:
                 message="No action needed",
             )
 
+        if (
+            best_appointment is not None
+            and allende is not None
+            and appointment_to_find.auto_book
+        ):
+            cls._auto_book(
+                best_appointment, appointment_to_find, allende, result, detected_at
+            )
+            if result.auto_booked:
+                notification_type = NotificationType.BOOKED
+
         # Send notification if needed
         if comparison_result.should_notify:
             notification_datetime = (
@@ -219,17 +285,61 @@ class AppointmentHandler:
             )
 
             notification_datetime = timezone.localtime(notification_datetime)
-            push_result = AppointmentNotificationService.send_appointment_notification(
-                appointment_data,
-                notification_datetime,
-                comparison_result.notification_type,
-                user,
-            )
+            with Metrics.timed("push"):
+                push_result = (
+                    AppointmentNotificationService.send_appointment_notification(
+                        appointment_data,
+                        notification_datetime,
+                        notification_type,
+                        user,
+                    )
+                )
             AppointmentNotificationService.log_notification_result(
-                push_result, appointment_data, comparison_result.notification_type
+                push_result, appointment_data, notification_type
             )
             result.notification_sent = True
         else:
             result.notification_sent = False
 
         return result
+
+    @classmethod
+    def _auto_book(
+        cls,
+        best_appointment: BestAppointmentFound,
+        appointment_to_find: FindAppointment,
+        allende: Allende,
+        result: AppointmentProcessingResult,
+        detected_at: Optional[float] = None,
+    ) -> None:
+        """Book the slot right away for searches with auto_book enabled"""
+        if AppointmentBookingService.has_confirmed_appointment(best_appointment):
+            logger.info(
+                f"Skipping auto-book for {appointment_to_find.doctor_name}: "
+                "a slot is already booked for this search"
+            )
+            return
+
+        try:
+            booking = AppointmentBookingService.book(best_appointment, allende)
+        except (UnauthorizedException, requests.RequestException) as e:
+            logger.error(
+                f"Auto-book failed for {appointment_to_find.doctor_name}: {str(e)}"
+            )
+            return
+
+        if not booking.success:
+            logger.error(
+                f"Auto-book failed for {appointment_to_find.doctor_name}: {booking.error}"
+            )
+            return
+
+        # The search is fulfilled, stop polling it so the slot is never booked twice
+        appointment_to_find.active = False
+        appointment_to_find.save(update_fields=["active"])
+        PatientVersionRepository.bump(appointment_to_find.patient_id)
+
+        result.auto_booked = True
+        if detected_at is not None:
+            result.time_to_book = time.monotonic() - detected_at
+        result.message += f" (auto-booked in {result.time_to_book or 0:.2f}s)"
@@ -3,6 +3,7 @@ from typing import Any, Dict
 
 from django.contrib.auth.models import User
 
+from sanatorio_allende.metrics import Metrics
 from sanatorio_allende.services.appointment_processor import (
     AppointmentData,
     AppointmentProcessor,
@@ -45,6 +46,11 @@ class AppointmentNotificationService:
                 f"¡Nuevo turno! - {appointment_data.patient_dni} - "
                 f"{appointment_data.doctor_name} - {datetime_str}"
             )
+        elif notification_type == NotificationType.BOOKED:
+            push_title = (
+                f"¡Turno reservado! - {appointment_data.patient_dni} - "
+                f"{appointment_data.doctor_name} - {datetime_str}"
+            )
         elif notification_type == NotificationType.UPDATED:
             push_title = (
                 f"Turno actualizado - {appointment_data.patient_dni} - "
@@ -89,6 +95,19 @@ class AppointmentNotificationService:
             appointment_data: Appointment information
             notification_type: Type of notification sent
         """
+        Metrics.inc(
+            "turnos_push_notifications_total",
+            push_result.get("sent_count", 0),
+            outcome="sent",
+        )
+        Metrics.inc(
+            "turnos_push_notifications_total",
+            len(push_result.get("errors") or []),
+            outcome="error",
+        )
+        if not push_result["success"]:
+            Metrics.inc("turnos_push_notifications_total", outcome="failed")
+
         if push_result["success"]:
             print(
                 f"Push notification sent to {push_result['sent_count']}/"
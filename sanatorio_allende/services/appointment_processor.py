@@ -21,6 +21,7 @@ class NotificationType(Enum):
     NEW = "new"
     LOST = "lost"
     UPDATED = "updated"
+    BOOKED = "booked"
     NONE = "none"
 
 
@@ -64,6 +65,7 @@ class AppointmentProcessor:
         cls,
         appointment_datetime: datetime.datetime,
         desired_timeframe: str,
+        now: Optional[datetime.datetime] = None,
     ) -> bool:
         """
         Check if appointment datetime is within the desired timeframe
@@ -71,11 +73,12 @@ class AppointmentProcessor:
         Args:
             appointment_datetime: The appointment datetime to check
             desired_timeframe: The desired timeframe string
+            now: Current time of the run (defaults to timezone.now())
 
         Returns:
             True if appointment is within desired timeframe, False otherwise
         """
-        current_time = timezone.make_aware(datetime.datetime.now())
+        current_time = now or timezone.now()
 
         boundary = cls.TIMEFRAME_BOUNDARIES.get(desired_timeframe)
         if boundary is None:
@@ -83,6 +86,32 @@ class AppointmentProcessor:
 
         return appointment_datetime <= current_time + boundary
 
+    @classmethod
+    def has_slot_in_window(
+        cls,
+        appointment_data: Optional[Dict[str, Any]],
+        desired_timeframe: Optional[str],
+        now: Optional[datetime.datetime] = None,
+    ) -> bool:
+        """
+        Check if a search response has a slot the patient would accept
+
+        Args:
+            appointment_data: First slot returned by the search, None if there is none
+            desired_timeframe: The desired timeframe string (None means anytime)
+            now: Current time of the run (defaults to timezone.now())
+
+        Returns:
+            True if there is a slot within the desired timeframe
+        """
+        if not appointment_data or appointment_data.get("datetime") is None:
+            return False
+        return cls.is_within_desired_timeframe(
+            appointment_data["datetime"],
+            desired_timeframe or "anytime",
+            now,
+        )
+
     @classmethod
     def compare_appointments(
         cls,
@@ -1,16 +1,22 @@
 import time
+from typing import Optional
 
+import requests
 from django.conf import settings
 from django.utils import timezone
 
 from sanatorio_allende.allende_api import Allende
 from sanatorio_allende.models import PacienteAllende
 from sanatorio_allende.selenium_utils import SeleniumSettings
+from sanatorio_allende.services.appointment_booking import AppointmentBookingService
 
 
 class AllendeAuthService:
-    def __init__(self, patient: PacienteAllende):
+    def __init__(
+        self, patient: PacienteAllende, session: Optional[requests.Session] = None
+    ):
         self.patient = patient
+        self.session = session
 
     def login(self) -> str:
         allende = Allende(
@@ -20,10 +26,11 @@ class AllendeAuthService:
                 port=int(settings.SELENIUM_PORT),
                 implicit_wait=int(settings.SELENIUM_IMPLICIT_WAIT),
             ),
+            session=self.session,
         )
 
         if self.patient.token:
-            if not Allende.is_authorized(self.patient.token):
+            if not Allende.is_authorized(self.patient.token, self.session):
                 token_issue_time = self.patient.updated_at
                 token_issue_delta_minutes = (
                     timezone.now() - token_issue_time
@@ -49,6 +56,11 @@ class AllendeAuthService:
 
         self.patient.token = allende.get_auth_header()
 
+        previous_coverage = (
+            self.patient.id_paciente,
+            self.patient.id_financiador,
+            self.patient.id_plan,
+        )
         user_id = allende.get_user_id()
         if user_id:
             self.patient.id_paciente = user_id
@@ -56,6 +68,16 @@ class AllendeAuthService:
             self.patient.id_financiador = user_data.id_financiador
             self.patient.id_plan = user_data.id_plan
 
+        if previous_coverage != (
+            self.patient.id_paciente,
+            self.patient.id_financiador,
+            self.patient.id_plan,
+        ):
+            # Prebuilt booking payloads embed the patient coverage
+            AppointmentBookingService.invalidate_booking_payloads(
+                patient_id=self.patient.id
+            )
+
         self.patient.save(
             update_fields=[
                 "token",
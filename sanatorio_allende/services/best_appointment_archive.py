@@ -0,0 +1,155 @@
+import datetime
+import logging
+import time
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from sanatorio_allende.metrics import Metrics
+from sanatorio_allende.models import BestAppointmentFound, BestAppointmentFoundArchive
+
+logger = logging.getLogger(__name__)
+
+ARCHIVED_METRIC = "turnos_best_appointments_archived_total"
+
+
+@dataclass
+class ArchiveResult:
+    """Outcome of an archive run"""
+
+    archived: int = 0
+    batches: int = 0
+    # False when the run stopped at max_batches with rows left to archive
+    complete: bool = True
+
+
+class BestAppointmentArchiveService:
+    """
+    Service to move past BestAppointmentFound rows to the archive table
+
+    The list endpoints only show future appointments, but every slot found
+    (and every one marked as not interested) stays in the table and its
+    indexes. Rows are moved in small batches, each in its own short
+    transaction, with a pause between batches so the search worker and the
+    API never wait on a long lock.
+
+    not_interested rows of future appointments stay: they keep the search
+    from offering the same slot again.
+    """
+
+    @classmethod
+    def cutoff(cls, now: Optional[datetime.datetime] = None) -> datetime.datetime:
+        """Appointments before this moment are archived"""
+        hours = int(getattr(settings, "BEST_APPOINTMENT_ARCHIVE_AFTER_HOURS", 24))
+        return (now or timezone.now()) - datetime.timedelta(hours=hours)
+
+    @classmethod
+    def archive_batch(
+        cls, cutoff: datetime.datetime, batch_size: int, after_id: int = 0
+    ) -> Tuple[int, int]:
+        """
+        Move one batch of past appointments to the archive
+
+        Rows locked by another transaction (e.g. a booking in progress) are
+        skipped and picked up by a later run.
+
+        Args:
+            cutoff: Appointments before this moment are archived
+            batch_size: Maximum number of rows moved
+            after_id: Only rows with a larger ID are considered
+
+        Returns:
+            Tuple of (rows moved, ID of the last row moved), (0, 0) when none are left
+        """
+        with transaction.atomic():
+            rows = list(
+                BestAppointmentFound.objects.select_for_update(skip_locked=True)
+                .filter(id__gt=after_id, datetime__lt=cutoff)
+                .order_by("id")
+                .only(
+                    "id",
+                    "patient_id",
+                    "appointment_wanted_id",
+                    "datetime",
+                    "not_interested",
+                    "confirmed",
+                    "confirmed_id_turno",
+                    "confirmed_at",
+                )[:batch_size]
+            )
+            if not rows:
+                return 0, 0
+
+            BestAppointmentFoundArchive.objects.bulk_create(
+                [
+                    BestAppointmentFoundArchive(
+                        original_id=row.id,
+                        patient_id=row.patient_id,
+                        appointment_wanted_id=row.appointment_wanted_id,
+                        datetime=row.datetime,
+                        not_interested=row.not_interested,
+                        confirmed=row.confirmed,
+                        confirmed_id_turno=row.confirmed_id_turno,
+                        confirmed_at=row.confirmed_at,
+                    )
+                    for row in rows
+                ],
+                # A row archived by an interrupted run is only deleted now
+                ignore_conflicts=True,
+            )
+            BestAppointmentFound.objects.filter(
+                id__in=[row.id for row in rows]
+            ).delete()
+
+        Metrics.inc(ARCHIVED_METRIC, len(rows))
+        return len(rows), rows[-1].id
+
+    @classmethod
+    def archive(
+        cls,
+        now: Optional[datetime.datetime] = None,
+        batch_size: int = 500,
+        pause_seconds: float = 0.1,
+        max_batches: Optional[int] = None,
+    ) -> ArchiveResult:
+        """
+        Move every past appointment to the archive, batch by batch
+
+        Args:
+            now: Current time (defaults to timezone.now())
+            batch_size: Rows moved per transaction
+            pause_seconds: Pause between batches
+            max_batches: Stop after this many batches, None for no limit
+
+        Returns:
+            ArchiveResult with the number of rows and batches
+        """
+        cutoff = cls.cutoff(now)
+        result = ArchiveResult()
+        after_id = 0
+
+        while max_batches is None or result.batches < max_batches:
+            moved, last_id = cls.archive_batch(cutoff, batch_size, after_id)
+            if not moved:
+                break
+            result.batches += 1
+            result.archived += moved
+            after_id = last_id
+            if moved < batch_size:
+                # Only locked rows, if any, are left
+                break
+            if pause_seconds:
+                time.sleep(pause_seconds)
+        else:
+            result.complete = not BestAppointmentFound.objects.filter(
+                id__gt=after_id, datetime__lt=cutoff
+            ).exists()
+
+        if result.archived:
+            logger.info(
+                f"Archived {result.archived} best appointments in {result.batches} batches"
+            )
+        return result
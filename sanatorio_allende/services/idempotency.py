@@ -0,0 +1,98 @@
+import json
+from typing import Any, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpRequest, JsonResponse
+
+
+class IdempotencyService:
+    """Service to replay the stored response of requests sent with an idempotency key"""
+
+    HEADER = "Idempotency-Key"
+    BODY_FIELD = "idempotency_key"
+    CACHE_KEY_PREFIX = "idempotency"
+
+    @classmethod
+    def get_key(cls, request: HttpRequest, data: dict) -> Optional[str]:
+        """
+        Get the idempotency key sent by the client
+
+        Args:
+            request: The HTTP request (key sent in the Idempotency-Key header)
+            data: The decoded JSON body (key sent in the idempotency_key field)
+
+        Returns:
+            The idempotency key, or None if the client did not send one
+        """
+        key = request.headers.get(cls.HEADER) or data.get(cls.BODY_FIELD)
+        return str(key) if key else None
+
+    @classmethod
+    def _cache_key(cls, user_id: int, scope: str, key: str) -> str:
+        return f"{cls.CACHE_KEY_PREFIX}:{scope}:{user_id}:{key}"
+
+    @classmethod
+    def get_response(
+        cls, user_id: int, scope: str, key: Optional[str], target: Any
+    ) -> Optional[JsonResponse]:
+        """
+        Get the response stored for a previous request with the same key
+
+        Args:
+            user_id: ID of the user sending the request
+            scope: Operation the key belongs to (e.g. "confirm", "cancel")
+            key: The idempotency key
+            target: What the request acts on (e.g. the appointment ID)
+
+        Returns:
+            The stored response, a 422 response if the key was used for
+            another target, or None if there is none
+        """
+        if not key:
+            return None
+
+        stored = cache.get(cls._cache_key(user_id, scope, key))
+        if stored is None:
+            return None
+
+        stored_target, status, body = stored
+        if stored_target != str(target):
+            return JsonResponse(
+                {
+                    "success": False,
+                    "error": "Idempotency key already used for another request",
+                },
+                status=422,
+            )
+        return JsonResponse(body, status=status)
+
+    @classmethod
+    def store_response(
+        cls,
+        user_id: int,
+        scope: str,
+        key: Optional[str],
+        target: Any,
+        response: JsonResponse,
+    ) -> None:
+        """
+        Store the response of a request so retries with the same key replay it
+
+        Server errors are not stored so the client can retry them.
+
+        Args:
+            user_id: ID of the user sending the request
+            scope: Operation the key belongs to (e.g. "confirm", "cancel")
+            key: The idempotency key
+            target: What the request acts on (e.g. the appointment ID)
+            response: The response to store
+        """
+        if not key or response.status_code >= 500:
+            return
+
+        cache.set(
+            cls._cache_key(user_id, scope, key),
+            (str(target), response.status_code, json.loads(response.content)),
+            int(getattr(settings, "IDEMPOTENCY_KEY_TIMEOUT", 86400)),
+        )
@@ -0,0 +1,171 @@
+import datetime
+from typing import Optional
+
+from django.conf import settings
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+
+from sanatorio_allende.models import FindAppointment
+from sanatorio_allende.services.slot_release_predictor import SlotReleasePredictor
+
+
+class PollingScheduler:
+    """Service that decides when each FindAppointment has to be polled again"""
+
+    # Tighter timeframes are polled more often, the slot window is shorter
+    BASE_INTERVALS = {
+        "1 week": datetime.timedelta(minutes=5),
+        "2 weeks": datetime.timedelta(minutes=10),
+        "3 weeks": datetime.timedelta(minutes=15),
+        "anytime": datetime.timedelta(minutes=30),
+    }
+
+    # Searches whose best slot changed recently are likely to change again
+    RECENT_CHANGE_WINDOW = datetime.timedelta(hours=24)
+    STALE_CHANGE_WINDOW = datetime.timedelta(days=7)
+    RECENT_CHANGE_FACTOR = 0.5
+    STALE_CHANGE_FACTOR = 2.0
+
+    # Searches whose polls keep finding no slot inside the desired timeframe
+    # are polled half as often every OUT_OF_WINDOW_STEP consecutive misses
+    OUT_OF_WINDOW_STEP = 6
+    OUT_OF_WINDOW_MAX_FACTOR = 8.0
+
+    # Local hours in which the hospital rarely releases slots
+    QUIET_HOURS = range(0, 6)
+    QUIET_HOURS_FACTOR = 4.0
+
+    # With predicted release windows (SLOT_PREDICTION_ENABLED) searches are
+    # polled at the minimum interval around the windows and this much slower
+    # the rest of the time
+    OUTSIDE_RELEASE_WINDOW_FACTOR = 3.0
+
+    @classmethod
+    def _min_interval(cls) -> datetime.timedelta:
+        return datetime.timedelta(
+            seconds=int(getattr(settings, "POLL_MIN_INTERVAL_SECONDS", 60))
+        )
+
+    @classmethod
+    def _max_interval(cls) -> datetime.timedelta:
+        return datetime.timedelta(
+            seconds=int(getattr(settings, "POLL_MAX_INTERVAL_SECONDS", 4 * 3600))
+        )
+
+    @classmethod
+    def _tolerance(cls) -> datetime.timedelta:
+        return datetime.timedelta(
+            seconds=int(getattr(settings, "POLL_SCHEDULE_TOLERANCE_SECONDS", 30))
+        )
+
+    @classmethod
+    def compute_interval(
+        cls, find_appointment: FindAppointment, now: datetime.datetime
+    ) -> datetime.timedelta:
+        """
+        Compute how long to wait before polling a search again
+
+        Args:
+            find_appointment: The FindAppointment object
+            now: Current time of the run
+
+        Returns:
+            Time until the next poll, clamped to the configured bounds
+        """
+        interval = cls.BASE_INTERVALS.get(
+            find_appointment.desired_timeframe
+            or FindAppointment.DEFAULT_DESIRED_TIMEFRAME,
+            cls.BASE_INTERVALS[FindAppointment.DEFAULT_DESIRED_TIMEFRAME],
+        )
+
+        last_change_at = find_appointment.last_change_at
+        if last_change_at is not None and now - last_change_at <= (
+            cls.RECENT_CHANGE_WINDOW
+        ):
+            interval *= cls.RECENT_CHANGE_FACTOR
+        elif last_change_at is None or now - last_change_at > cls.STALE_CHANGE_WINDOW:
+            interval *= cls.STALE_CHANGE_FACTOR
+
+        misses = find_appointment.out_of_window_polls
+        if misses >= cls.OUT_OF_WINDOW_STEP:
+            interval *= min(
+                cls.OUT_OF_WINDOW_MAX_FACTOR, 2.0 ** (misses // cls.OUT_OF_WINDOW_STEP)
+            )
+
+        if timezone.localtime(now).hour in cls.QUIET_HOURS:
+            interval *= cls.QUIET_HOURS_FACTOR
+
+        interval = max(cls._min_interval(), min(interval, cls._max_interval()))
+        if SlotReleasePredictor.is_enabled():
+            model = SlotReleasePredictor.predict(
+                find_appointment.id_recurso, find_appointment.id_servicio, now
+            )
+            interval = min(
+                model.poll_interval(
+                    now,
+                    interval,
+                    cls._min_interval(),
+                    cls.OUTSIDE_RELEASE_WINDOW_FACTOR,
+                ),
+                cls._max_interval(),
+            )
+        return interval
+
+    @classmethod
+    def due_searches(
+        cls, queryset: QuerySet[FindAppointment], now: datetime.datetime
+    ) -> QuerySet[FindAppointment]:
+        """
+        Filter the searches that have to be polled in this run
+
+        Args:
+            queryset: Candidate FindAppointment objects
+            now: Current time of the run
+
+        Returns:
+            Searches never polled or whose next poll time has been reached
+        """
+        return queryset.filter(
+            Q(next_poll_at__isnull=True) | Q(next_poll_at__lte=now + cls._tolerance())
+        )
+
+    @classmethod
+    def schedule_next_poll(
+        cls,
+        find_appointment: FindAppointment,
+        now: datetime.datetime,
+        changed: bool = False,
+        in_window: Optional[bool] = None,
+    ) -> datetime.datetime:
+        """
+        Store when the search has to be polled again
+
+        Args:
+            find_appointment: The FindAppointment object just polled
+            now: Current time of the run
+            changed: Whether the poll changed the best appointment
+            in_window: Whether the poll found a slot inside the desired timeframe
+                (None leaves the out-of-window history untouched)
+
+        Returns:
+            The next poll time
+        """
+        if changed:
+            find_appointment.last_change_at = now
+        if in_window is not None:
+            find_appointment.out_of_window_polls = (
+                0 if in_window else find_appointment.out_of_window_polls + 1
+            )
+        find_appointment.next_poll_at = now + cls.compute_interval(
+            find_appointment, now
+        )
+        # The response fingerprint of this poll is stored in the same query
+        find_appointment.save(
+            update_fields=[
+                "next_poll_at",
+                "last_change_at",
+                "out_of_window_polls",
+                "last_response_fingerprint",
+            ]
+        )
+        return find_appointment.next_poll_at
@@ -4,9 +4,12 @@ from datetime import datetime
 from typing import Any, Dict, List, Optional
 
 import requests
+from django.conf import settings
 from django.contrib.auth.models import User
 
-from sanatorio_allende.models import DeviceRegistration
+from sanatorio_allende.repositories.device_registration_repository import (
+    DeviceRegistrationRepository,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +21,22 @@ class PushNotificationService:
 
     EXPO_PUSH_URL = "https://exp.host/--/api/v2/push/send"
     EXPO_RECEIPT_URL = "https://exp.host/--/api/v2/push/getReceipts"
+    DEVICE_NOT_REGISTERED_ERROR = "DeviceNotRegistered"
+    # Expo accepts at most 100 messages per push request
+    MAX_BATCH_SIZE = 100
+
+    @classmethod
+    def _push_url(cls) -> str:
+        return getattr(settings, "EXPO_PUSH_URL", None) or cls.EXPO_PUSH_URL
+
+    @classmethod
+    def _receipt_url(cls) -> str:
+        return getattr(settings, "EXPO_RECEIPT_URL", None) or cls.EXPO_RECEIPT_URL
+
+    @classmethod
+    def _batch_size(cls) -> int:
+        batch_size = int(getattr(settings, "EXPO_PUSH_BATCH_SIZE", cls.MAX_BATCH_SIZE))
+        return max(1, min(batch_size, cls.MAX_BATCH_SIZE))
 
     @classmethod
     def send_notification(
@@ -45,10 +64,10 @@ class PushNotificationService:
             Dict with success status and results
         """
         try:
-            # Get all active device registrations
-            devices = DeviceRegistration.objects.filter(is_active=True, user=user)
+            # Get all active device tokens (cached per user)
+            push_tokens = DeviceRegistrationRepository.get_active_tokens(user)
 
-            if not devices.exists():
+            if not push_tokens:
                 logger.warning("No active devices registered for push notifications")
                 return {
                     "success": False,
@@ -58,7 +77,7 @@ class PushNotificationService:
                 }
 
             logger.info(
-                f"Sending push notification to {devices.count()} active devices"
+                f"Sending push notification to {len(push_tokens)} active devices"
             )
             logger.info(f"Notification: '{title}' - '{body}'")
 
@@ -78,12 +97,12 @@ class PushNotificationService:
 
             # Prepare messages for each device
             messages = []
-            for device in devices:
-                message = {"to": device.push_token, **notification_payload}
+            for push_token in push_tokens:
+                message = {"to": push_token, **notification_payload}
                 messages.append(message)
 
-            # Send notifications in batches (Expo recommends max 100 per request)
-            batch_size = 100
+            # Send notifications in batches (Expo accepts max 100 per request)
+            batch_size = cls._batch_size()
             total_sent = 0
             errors = []
             receipt_ids = []
@@ -99,7 +118,7 @@ class PushNotificationService:
 
                 try:
                     response = requests.post(
-                        cls.EXPO_PUSH_URL,
+                        cls._push_url(),
                         headers={
                             "Content-Type": "application/json",
                             "Accept": "application/json",
@@ -192,10 +211,12 @@ class PushNotificationService:
                 f"Push notification sending completed. Sent: {total_sent}, Errors: {len(errors)}, Receipt IDs: {len(receipt_ids)}"
             )
 
+            cls._deactivate_unregistered_devices(errors)
+
             return {
                 "success": True,
                 "sent_count": total_sent,
-                "total_devices": devices.count(),
+                "total_devices": len(push_tokens),
                 "errors": errors,
                 "receipt_ids": receipt_ids,
             }
@@ -209,6 +230,29 @@ class PushNotificationService:
                 "total_devices": 0,
             }
 
+    @classmethod
+    def _deactivate_unregistered_devices(cls, errors: List[Dict[str, Any]]) -> None:
+        """
+        Deactivate the devices Expo reported as no longer registered
+
+        Args:
+            errors: Errors collected while sending notifications
+        """
+        unregistered_tokens = []
+        for error in errors:
+            details = error.get("details") or {}
+            if details.get("error") != cls.DEVICE_NOT_REGISTERED_ERROR:
+                continue
+            push_token = error.get("token") or details.get("expoPushToken")
+            if push_token:
+                unregistered_tokens.append(push_token)
+
+        if unregistered_tokens:
+            deactivated = DeviceRegistrationRepository.deactivate_tokens(
+                unregistered_tokens
+            )
+            logger.warning(f"Deactivated {deactivated} unregistered devices")
+
     @classmethod
     def send_appointment_notification(
         cls, appointment_data: Dict[str, Any]
@@ -280,7 +324,7 @@ class PushNotificationService:
             payload = {"ids": receipt_ids}
 
             response = requests.post(
-                cls.EXPO_RECEIPT_URL,
+                cls._receipt_url(),
                 headers={
                     "Content-Type": "application/json",
                     "Accept": "application/json",
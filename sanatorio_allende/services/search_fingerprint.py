@@ -0,0 +1,85 @@
+import datetime
+import hashlib
+import json
+from typing import Optional
+
+from sanatorio_allende.models import FindAppointment
+from sanatorio_allende.services.appointment_processor import AppointmentProcessor
+
+
+class SearchFingerprintService:
+    """
+    Service to skip searches whose upstream availability did not change
+
+    Most polls return the same first slot as the previous one. The
+    fingerprint hashes that parsed slot together with everything else the
+    processing depends on, so an identical fingerprint means processing it
+    again would change nothing.
+    """
+
+    @classmethod
+    def compute(
+        cls,
+        find_appointment: FindAppointment,
+        new_appointment_data: Optional[dict],
+        now: Optional[datetime.datetime] = None,
+    ) -> str:
+        """
+        Fingerprint a parsed availability response of a search
+
+        Args:
+            find_appointment: The FindAppointment polled
+            new_appointment_data: First slot returned by Allende, None if there is none
+            now: Current time of the run (defaults to timezone.now())
+
+        Returns:
+            Hex digest of the slot, its in-window status and the search settings
+        """
+        timeframe = (
+            find_appointment.desired_timeframe
+            or FindAppointment.DEFAULT_DESIRED_TIMEFRAME
+        )
+        slot = None
+        if new_appointment_data and new_appointment_data.get("datetime") is not None:
+            slot_datetime = new_appointment_data["datetime"]
+            slot = {
+                "datetime": slot_datetime.isoformat(),
+                "duracion_individual": new_appointment_data.get("duracion_individual"),
+                "id_plantilla_turno": new_appointment_data.get("id_plantilla_turno"),
+                "id_item_plantilla": new_appointment_data.get("id_item_plantilla"),
+                # A slot entering the window has to be processed even if unchanged
+                "in_window": AppointmentProcessor.is_within_desired_timeframe(
+                    slot_datetime, timeframe, now
+                ),
+            }
+
+        data = {
+            "slot": slot,
+            "desired_timeframe": timeframe,
+            "auto_book": find_appointment.auto_book,
+        }
+        return hashlib.sha256(
+            json.dumps(data, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    @classmethod
+    def is_unchanged(cls, find_appointment: FindAppointment, fingerprint: str) -> bool:
+        """Whether the search already processed a response with this fingerprint"""
+        return bool(fingerprint) and (
+            find_appointment.last_response_fingerprint == fingerprint
+        )
+
+    @classmethod
+    def reset(cls, find_appointment_id: int) -> None:
+        """
+        Process the next poll of a search even if the response is unchanged
+
+        Needed after user changes the processing depends on, like an
+        appointment marked as not interested or a cancelled booking.
+
+        Args:
+            find_appointment_id: ID of the FindAppointment
+        """
+        FindAppointment.objects.filter(id=find_appointment_id).update(
+            last_response_fingerprint=""
+        )
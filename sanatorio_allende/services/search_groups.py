@@ -0,0 +1,149 @@
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from django.conf import settings
+
+from sanatorio_allende.allende_api import Allende
+from sanatorio_allende.metrics import Metrics
+from sanatorio_allende.models import FindAppointment, PacienteAllende
+from sanatorio_allende.upstream_guard import CircuitOpenException
+
+logger = logging.getLogger(__name__)
+
+GROUPED_SEARCHES_METRIC = "turnos_grouped_searches_total"
+
+# IdRecurso that makes the search return the first slot of every doctor
+ANY_RESOURCE = 0
+
+GroupKey = Tuple[int, int, int, int, int]
+
+
+@dataclass
+class SearchGroup:
+    """Searches of a patient answered by the same upstream request"""
+
+    key: GroupKey
+    members: List[FindAppointment] = field(default_factory=list)
+
+
+class SearchGroupService:
+    """
+    Service to poll the searches of the same specialty and branch together
+
+    "Any cardiologist at CERRO" is stored as one FindAppointment per doctor.
+    The first-slot endpoint answers with the first slot of each doctor
+    (PrimerosTurnosDeCadaRecurso), so a single request without a doctor
+    answers every search of the group.
+    """
+
+    @classmethod
+    def is_enabled(cls) -> bool:
+        return bool(getattr(settings, "SEARCH_GROUPS_ENABLED", False))
+
+    @classmethod
+    def search_data(
+        cls,
+        patient: PacienteAllende,
+        find_appointment: FindAppointment,
+        id_recurso: Optional[int] = None,
+    ) -> dict:
+        """
+        Build the first-slot search payload of a search
+
+        Args:
+            patient: The PacienteAllende searching
+            find_appointment: The FindAppointment searched
+            id_recurso: Doctor to search, the search's own doctor if None
+
+        Returns:
+            JSON payload of ObtenerPrimerTurnoAsignableParaPortalWebConParticular
+        """
+        assert isinstance(patient.id_paciente, str)
+        return {
+            "IdPaciente": int(patient.id_paciente),
+            "IdServicio": find_appointment.id_servicio,
+            "IdSucursal": find_appointment.id_sucursal,
+            "IdRecurso": (
+                find_appointment.id_recurso if id_recurso is None else id_recurso
+            ),
+            "IdEspecialidad": find_appointment.id_especialidad,
+            "IdTipoRecurso": find_appointment.id_tipo_recurso,
+            "ControlarEdad": False,
+            "IdFinanciador": patient.id_financiador,
+            "IdPlan": patient.id_plan,
+            "Prestaciones": [
+                {
+                    "IdPrestacion": find_appointment.id_prestacion,
+                    "IdItemSolicitudEstudios": 0,
+                }
+            ],
+        }
+
+    @classmethod
+    def group(cls, searches: List[FindAppointment]) -> List[SearchGroup]:
+        """
+        Group the searches of a patient that share a search request
+
+        Args:
+            searches: FindAppointment objects of a single patient
+
+        Returns:
+            Groups in the order of their first search
+        """
+        groups: Dict[GroupKey, SearchGroup] = {}
+        for search in searches:
+            key = (
+                search.id_servicio,
+                search.id_sucursal,
+                search.id_especialidad,
+                search.id_prestacion,
+                search.id_tipo_recurso,
+            )
+            groups.setdefault(key, SearchGroup(key)).members.append(search)
+        return list(groups.values())
+
+    @classmethod
+    def fetch_group(
+        cls, allende: Allende, patient: PacienteAllende, group: SearchGroup
+    ) -> Dict[int, Optional[dict]]:
+        """
+        Get the first slot of the group's searches with a single request
+
+        A doctor missing from a successful answer has no slot, like an empty
+        answer to its own request. Only a failed request leaves the searches
+        out, so they are searched on their own.
+
+        Args:
+            allende: Authenticated Allende client
+            patient: The PacienteAllende searching
+            group: Searches sharing the request
+
+        Returns:
+            First slot of each answered search (None if it has no slot), keyed
+            by FindAppointment ID
+        """
+        if len(group.members) < 2:
+            return {}
+
+        try:
+            first_slots = allende.search_first_slots_by_resource(
+                cls.search_data(patient, group.members[0], id_recurso=ANY_RESOURCE)
+            )
+        except CircuitOpenException:
+            raise
+        except requests.RequestException as e:
+            logger.warning(f"Grouped search failed, searching one by one: {str(e)}")
+            Metrics.inc(GROUPED_SEARCHES_METRIC, len(group.members), outcome="failed")
+            return {}
+
+        answered = {
+            member.id: first_slots.get(member.id_recurso) for member in group.members
+        }
+        with_slot = sum(1 for slot in answered.values() if slot is not None)
+        Metrics.inc(GROUPED_SEARCHES_METRIC, with_slot, outcome="answered")
+        Metrics.inc(
+            GROUPED_SEARCHES_METRIC, len(answered) - with_slot, outcome="no_slot"
+        )
+        return answered
@@ -0,0 +1,162 @@
+import datetime
+import statistics
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from sanatorio_allende.models import SlotObservation
+
+
+@dataclass
+class SlotRelease:
+    """An earlier first slot than the previous one appeared for a search"""
+
+    find_appointment_id: int
+    released_at: datetime.datetime
+    slot_datetime: datetime.datetime
+    # Minutes until it stopped being the first slot before its date (taken by
+    # someone else), None while it still is or if it was never taken
+    lifetime_minutes: Optional[float] = None
+
+
+@dataclass
+class ReleaseHistogram:
+    """When a doctor releases slots, in local time, and how long they last"""
+
+    id_recurso: int
+    id_servicio: Optional[int]
+    days: int
+    releases: int = 0
+    # Releases per hour of the day (0-23) and per weekday (Monday is 0)
+    by_hour: List[int] = field(default_factory=lambda: [0] * 24)
+    by_weekday: List[int] = field(default_factory=lambda: [0] * 7)
+    median_lifetime_minutes: Optional[float] = None
+
+
+class SlotAnalyticsService:
+    """
+    Service to derive slot releases from the slot observation log
+
+    The log holds a row each time the first slot of a search changed. A
+    release is a change to an earlier slot (or to a slot after none), a
+    slot vanishes when a later change moves away from it before its date.
+    """
+
+    CACHE_KEY_PREFIX = "slot_release_histogram"
+
+    @classmethod
+    def releases(
+        cls,
+        id_recurso: int,
+        id_servicio: Optional[int] = None,
+        since: Optional[datetime.datetime] = None,
+        until: Optional[datetime.datetime] = None,
+    ) -> List[SlotRelease]:
+        """
+        Find the slot releases of a doctor
+
+        Args:
+            id_recurso: Doctor whose searches are analysed
+            id_servicio: Only searches of this service, every service if None
+            since: Only observations from this moment
+            until: Only observations before this moment
+
+        Returns:
+            Releases in the order of their search and time
+        """
+        observations = SlotObservation.objects.filter(id_recurso=id_recurso)
+        if id_servicio is not None:
+            observations = observations.filter(id_servicio=id_servicio)
+        if since is not None:
+            observations = observations.filter(observed_at__gte=since)
+        if until is not None:
+            observations = observations.filter(observed_at__lt=until)
+
+        releases: List[SlotRelease] = []
+        # Last slot seen and the release still showing, per search
+        previous: Dict[int, Optional[datetime.datetime]] = {}
+        showing: Dict[int, SlotRelease] = {}
+        for find_appointment_id, observed_at, slot_datetime in (
+            observations.order_by("find_appointment_id", "observed_at", "id")
+            .values_list("find_appointment_id", "observed_at", "slot_datetime")
+            .iterator()
+        ):
+            release = showing.get(find_appointment_id)
+            if release is not None and slot_datetime != release.slot_datetime:
+                if observed_at < release.slot_datetime:
+                    release.lifetime_minutes = (
+                        observed_at - release.released_at
+                    ).total_seconds() / 60
+                del showing[find_appointment_id]
+
+            # The first observation of a search tells nothing about releases
+            if find_appointment_id in previous and slot_datetime is not None:
+                last_slot = previous[find_appointment_id]
+                if last_slot is None or slot_datetime < last_slot:
+                    release = SlotRelease(
+                        find_appointment_id, observed_at, slot_datetime
+                    )
+                    releases.append(release)
+                    showing[find_appointment_id] = release
+            previous[find_appointment_id] = slot_datetime
+
+        return releases
+
+    @classmethod
+    def release_histogram(
+        cls,
+        id_recurso: int,
+        id_servicio: Optional[int] = None,
+        days: int = 90,
+        now: Optional[datetime.datetime] = None,
+    ) -> ReleaseHistogram:
+        """
+        Histogram of the release times of a doctor, cached for an hour
+
+        Args:
+            id_recurso: Doctor whose releases are counted
+            id_servicio: Only searches of this service, every service if None
+            days: Days of history analysed
+            now: Current time (defaults to timezone.now())
+
+        Returns:
+            ReleaseHistogram of the period
+        """
+        key = f"{cls.CACHE_KEY_PREFIX}:{id_recurso}:{id_servicio}:{days}"
+        cached = cache.get(key)
+        if cached is not None:
+            assert isinstance(cached, ReleaseHistogram)
+            return cached
+
+        since = (now or timezone.now()) - datetime.timedelta(days=days)
+        histogram = ReleaseHistogram(id_recurso, id_servicio, days)
+        lifetimes = []
+        for release in cls.releases(id_recurso, id_servicio, since=since):
+            released_at = timezone.localtime(release.released_at)
+            histogram.releases += 1
+            histogram.by_hour[released_at.hour] += 1
+            histogram.by_weekday[released_at.weekday()] += 1
+            if release.lifetime_minutes is not None:
+                lifetimes.append(release.lifetime_minutes)
+        if lifetimes:
+            histogram.median_lifetime_minutes = statistics.median(lifetimes)
+
+        cache.set(
+            key,
+            histogram,
+            int(getattr(settings, "SLOT_ANALYTICS_CACHE_SECONDS", 3600)),
+        )
+        return histogram
+
+    @classmethod
+    def peak_hours(
+        cls, histogram: ReleaseHistogram, top: int = 3
+    ) -> List[Tuple[int, int]]:
+        """Hours of the day with the most releases, as (hour, releases)"""
+        hours = sorted(
+            enumerate(histogram.by_hour), key=lambda item: (-item[1], item[0])
+        )
+        return [(hour, count) for hour, count in hours[:top] if count]
@@ -0,0 +1,343 @@
+import bisect
+import datetime
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from sanatorio_allende.services.slot_analytics import SlotAnalyticsService, SlotRelease
+
+MINUTES_PER_WEEK = 7 * 24 * 60
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+@dataclass
+class ReleaseWindow:
+    """A slot of the week (local time) in which a doctor usually releases slots"""
+
+    weekday: int
+    start_minute: int
+    # Share of the weeks of history with a release in this slot of the week
+    weekly_rate: float
+    releases: int
+
+    @property
+    def minute_of_week(self) -> int:
+        return self.weekday * 24 * 60 + self.start_minute
+
+    def describe(self) -> str:
+        hours, minutes = divmod(self.start_minute, 60)
+        return f"{WEEKDAYS[self.weekday]} {hours:02d}:{minutes:02d}"
+
+
+@dataclass
+class ReleaseModel:
+    """Predicted release windows of a doctor, for one service or all of them"""
+
+    id_recurso: int
+    id_servicio: Optional[int]
+    windows: List[ReleaseWindow] = field(default_factory=list)
+    bucket_minutes: int = 30
+    # Minutes before a window in which the polls already speed up
+    lead_minutes: int = 10
+
+    @classmethod
+    def _minute_of_week(cls, moment: datetime.datetime) -> float:
+        local = timezone.localtime(moment)
+        return (
+            local.weekday() * 24 * 60
+            + local.hour * 60
+            + local.minute
+            + local.second / 60
+        )
+
+    def window_at(self, moment: datetime.datetime) -> Optional[ReleaseWindow]:
+        """The release window a moment falls in, lead time included"""
+        minute = self._minute_of_week(moment)
+        for window in self.windows:
+            start = window.minute_of_week - self.lead_minutes
+            if (minute - start) % MINUTES_PER_WEEK < (
+                self.lead_minutes + self.bucket_minutes
+            ):
+                return window
+        return None
+
+    def next_window_start(
+        self, moment: datetime.datetime
+    ) -> Optional[datetime.datetime]:
+        """When the next release window starts, lead time included"""
+        if not self.windows:
+            return None
+        minute = self._minute_of_week(moment)
+        wait = min(
+            (window.minute_of_week - self.lead_minutes - minute) % MINUTES_PER_WEEK
+            for window in self.windows
+        )
+        return moment + datetime.timedelta(minutes=wait)
+
+    def poll_interval(
+        self,
+        moment: datetime.datetime,
+        interval: datetime.timedelta,
+        burst_interval: datetime.timedelta,
+        slow_factor: float,
+    ) -> datetime.timedelta:
+        """
+        Adjust the interval of a search to the release windows
+
+        Args:
+            moment: Time of the poll
+            interval: Interval the search would be polled at without the model
+            burst_interval: Interval inside a release window
+            slow_factor: Factor applied to the interval outside the windows
+
+        Returns:
+            burst_interval inside a window, otherwise the slowed down interval
+            cut short to poll at the start of the next window
+        """
+        if not self.windows:
+            return interval
+        if self.window_at(moment) is not None:
+            return burst_interval
+        interval *= slow_factor
+        next_window = self.next_window_start(moment)
+        if next_window is not None:
+            interval = min(interval, next_window - moment)
+        return max(burst_interval, interval)
+
+
+@dataclass
+class PolicyResult:
+    """Outcome of replaying the releases of a period against a polling policy"""
+
+    requests: int = 0
+    releases: int = 0
+    caught: int = 0
+
+    @property
+    def catches_per_1000_requests(self) -> float:
+        return 1000 * self.caught / self.requests if self.requests else 0.0
+
+
+@dataclass
+class Evaluation:
+    """Offline evaluation of the predictor for a doctor and service"""
+
+    model: ReleaseModel
+    baseline: PolicyResult
+    predictive: PolicyResult
+
+
+class SlotReleasePredictor:
+    """
+    Predict when a doctor releases slots from the slot observation log
+
+    The week is split in buckets of BUCKET_MINUTES (local time). A bucket is
+    a release window when enough distinct releases fell in it and they
+    happened in enough of the weeks of history, e.g. "Mon 07:00" for a
+    doctor whose agenda opens on Monday mornings. PollingScheduler polls at
+    the minimum interval around the windows and slower the rest of the time.
+    """
+
+    BUCKET_MINUTES = 30
+    LEAD_MINUTES = 10
+    # A window needs this many releases in this share of the weeks
+    MIN_RELEASES = 3
+    MIN_WEEKLY_RATE = 0.5
+
+    CACHE_KEY_PREFIX = "slot_release_model"
+
+    @classmethod
+    def is_enabled(cls) -> bool:
+        return bool(getattr(settings, "SLOT_PREDICTION_ENABLED", False))
+
+    @classmethod
+    def fit(
+        cls,
+        id_recurso: int,
+        id_servicio: Optional[int],
+        releases: List[SlotRelease],
+        since: datetime.datetime,
+        until: datetime.datetime,
+    ) -> ReleaseModel:
+        """
+        Fit the release windows of a doctor from their releases
+
+        Args:
+            id_recurso: Doctor of the releases
+            id_servicio: Service of the releases, None for every service
+            releases: Releases observed between since and until
+            since: Start of the history
+            until: End of the history
+
+        Returns:
+            ReleaseModel, without windows if no slot of the week qualifies
+        """
+        weeks = max(1.0, (until - since) / datetime.timedelta(weeks=1))
+
+        # Searches of several patients see the same slot being released
+        first_seen: Dict[datetime.datetime, datetime.datetime] = {}
+        for release in releases:
+            seen = first_seen.get(release.slot_datetime)
+            if seen is None or release.released_at < seen:
+                first_seen[release.slot_datetime] = release.released_at
+
+        counts: Dict[Tuple[int, int], int] = {}
+        weeks_seen: Dict[Tuple[int, int], Set[Tuple[int, int]]] = {}
+        for released_at in first_seen.values():
+            local = timezone.localtime(released_at)
+            minute = local.hour * 60 + local.minute
+            bucket = (local.weekday(), minute - minute % cls.BUCKET_MINUTES)
+            counts[bucket] = counts.get(bucket, 0) + 1
+            iso = local.isocalendar()
+            weeks_seen.setdefault(bucket, set()).add((iso[0], iso[1]))
+
+        windows = []
+        for (weekday, start_minute), count in sorted(counts.items()):
+            weekly_rate = min(1.0, len(weeks_seen[(weekday, start_minute)]) / weeks)
+            if count >= cls.MIN_RELEASES and weekly_rate >= cls.MIN_WEEKLY_RATE:
+                windows.append(ReleaseWindow(weekday, start_minute, weekly_rate, count))
+
+        return ReleaseModel(
+            id_recurso,
+            id_servicio,
+            windows,
+            bucket_minutes=cls.BUCKET_MINUTES,
+            lead_minutes=cls.LEAD_MINUTES,
+        )
+
+    @classmethod
+    def predict(
+        cls,
+        id_recurso: int,
+        id_servicio: Optional[int] = None,
+        now: Optional[datetime.datetime] = None,
+    ) -> ReleaseModel:
+        """
+        Release windows of a doctor fitted on the recent history, cached
+
+        Args:
+            id_recurso: Doctor of the search
+            id_servicio: Service of the search
+            now: Current time (defaults to timezone.now())
+
+        Returns:
+            ReleaseModel of the doctor and service
+        """
+        key = f"{cls.CACHE_KEY_PREFIX}:{id_recurso}:{id_servicio}"
+        cached = cache.get(key)
+        if cached is not None:
+            assert isinstance(cached, ReleaseModel)
+            return cached
+
+        until = now or timezone.now()
+        since = until - datetime.timedelta(
+            days=int(getattr(settings, "SLOT_PREDICTION_HISTORY_DAYS", 56))
+        )
+        model = cls.fit(
+            id_recurso,
+            id_servicio,
+            SlotAnalyticsService.releases(id_recurso, id_servicio, since, until),
+            since,
+            until,
+        )
+        cache.set(
+            key,
+            model,
+            int(getattr(settings, "SLOT_PREDICTION_CACHE_SECONDS", 6 * 3600)),
+        )
+        return model
+
+    @classmethod
+    def simulate(
+        cls,
+        releases: List[SlotRelease],
+        since: datetime.datetime,
+        until: datetime.datetime,
+        interval: Callable[[datetime.datetime], datetime.timedelta],
+    ) -> PolicyResult:
+        """
+        Replay a period's releases against the polls of a policy
+
+        A release is caught when a poll happens before it is taken by
+        someone else, a release never taken is caught by any later poll.
+
+        Args:
+            releases: Releases of the period
+            since: Start of the period
+            until: End of the period
+            interval: Time from a poll to the next one
+
+        Returns:
+            PolicyResult with the polls made and the releases caught
+        """
+        polls = []
+        moment = since
+        while moment < until:
+            polls.append(moment)
+            moment += interval(moment)
+
+        result = PolicyResult(requests=len(polls), releases=len(releases))
+        for release in releases:
+            index = bisect.bisect_left(polls, release.released_at)
+            if index == len(polls):
+                continue
+            if release.lifetime_minutes is None or (
+                polls[index] - release.released_at
+                <= datetime.timedelta(minutes=release.lifetime_minutes)
+            ):
+                result.caught += 1
+        return result
+
+    @classmethod
+    def evaluate(
+        cls,
+        id_recurso: int,
+        id_servicio: Optional[int],
+        train_since: datetime.datetime,
+        test_since: datetime.datetime,
+        test_until: datetime.datetime,
+        base_interval: datetime.timedelta,
+        burst_interval: datetime.timedelta,
+        slow_factor: float,
+    ) -> Evaluation:
+        """
+        Evaluate the predictor against the history it was not fitted on
+
+        The model is fitted on [train_since, test_since) and both policies
+        replay [test_since, test_until): polling every base_interval, and
+        polling every burst_interval inside the predicted windows and
+        slow_factor times base_interval outside them.
+
+        Returns:
+            Evaluation with the fitted model and the result of each policy
+        """
+        model = cls.fit(
+            id_recurso,
+            id_servicio,
+            SlotAnalyticsService.releases(
+                id_recurso, id_servicio, train_since, test_since
+            ),
+            train_since,
+            test_since,
+        )
+        test_releases = SlotAnalyticsService.releases(
+            id_recurso, id_servicio, test_since, test_until
+        )
+
+        def predictive_interval(moment: datetime.datetime) -> datetime.timedelta:
+            return model.poll_interval(
+                moment, base_interval, burst_interval, slow_factor
+            )
+
+        return Evaluation(
+            model=model,
+            baseline=cls.simulate(
+                test_releases, test_since, test_until, lambda moment: base_interval
+            ),
+            predictive=cls.simulate(
+                test_releases, test_since, test_until, predictive_interval
+            ),
+        )
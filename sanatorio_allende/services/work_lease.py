@@ -0,0 +1,117 @@
+import datetime
+import os
+import socket
+from typing import Collection, List, Optional
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from sanatorio_allende.models import FindAppointment, PacienteAllende
+from sanatorio_allende.services.polling_scheduler import PollingScheduler
+
+
+class PatientLeaseService:
+    """
+    Service to split patients between search worker replicas
+
+    Each worker claims a batch of patients with SELECT ... FOR UPDATE SKIP LOCKED
+    and stamps them with a lease. Other workers skip leased patients until the
+    lease expires, so the share of a crashed worker is picked up again.
+    """
+
+    @classmethod
+    def default_worker_id(cls) -> str:
+        """Worker ID unique to this process"""
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    @classmethod
+    def claim_patients(
+        cls,
+        worker_id: str,
+        batch_size: int,
+        lease_seconds: int,
+        now: Optional[datetime.datetime] = None,
+        exclude_ids: Collection[int] = (),
+        only_ids: Optional[Collection[int]] = None,
+    ) -> List[PacienteAllende]:
+        """
+        Lease a batch of patients with searches due for polling
+
+        Args:
+            worker_id: ID of the worker claiming the patients
+            batch_size: Maximum number of patients to claim
+            lease_seconds: How long the lease lasts
+            now: Current time of the run
+            exclude_ids: Patients already processed by the worker in this cycle
+            only_ids: Only claim among these patients (None for every patient)
+
+        Returns:
+            The leased PacienteAllende objects
+        """
+        now = now or timezone.now()
+        due_searches = PollingScheduler.due_searches(
+            FindAppointment.objects.filter(patient=OuterRef("pk"), active=True), now
+        )
+
+        patients = PacienteAllende.objects.all()
+        if only_ids is not None:
+            patients = patients.filter(id__in=only_ids)
+
+        with transaction.atomic():
+            patient_ids = list(
+                patients.select_for_update(skip_locked=True)
+                .filter(
+                    Q(lease_expires_at__isnull=True)
+                    | Q(lease_expires_at__lte=now)
+                    | Q(lease_owner=worker_id)
+                )
+                .filter(Exists(due_searches))
+                .exclude(id__in=exclude_ids)
+                .order_by("id")
+                .values_list("id", flat=True)[:batch_size]
+            )
+            # update() leaves updated_at alone, it tracks the token issue time
+            PacienteAllende.objects.filter(id__in=patient_ids).update(
+                lease_owner=worker_id,
+                lease_expires_at=now + datetime.timedelta(seconds=lease_seconds),
+            )
+
+        return list(PacienteAllende.objects.filter(id__in=patient_ids).order_by("id"))
+
+    @classmethod
+    def renew(
+        cls, worker_id: str, patient_ids: Collection[int], lease_seconds: int
+    ) -> int:
+        """
+        Extend the lease of patients still owned by the worker
+
+        Args:
+            worker_id: ID of the worker owning the leases
+            patient_ids: Patients whose lease has to be extended
+            lease_seconds: How long the lease lasts from now
+
+        Returns:
+            Number of leases extended
+        """
+        return PacienteAllende.objects.filter(
+            id__in=patient_ids, lease_owner=worker_id
+        ).update(
+            lease_expires_at=timezone.now() + datetime.timedelta(seconds=lease_seconds)
+        )
+
+    @classmethod
+    def release(cls, worker_id: str, patient_ids: Collection[int]) -> int:
+        """
+        Release the lease of patients owned by the worker
+
+        Args:
+            worker_id: ID of the worker owning the leases
+            patient_ids: Patients to release
+
+        Returns:
+            Number of leases released
+        """
+        return PacienteAllende.objects.filter(
+            id__in=patient_ids, lease_owner=worker_id
+        ).update(lease_owner=None, lease_expires_at=None)
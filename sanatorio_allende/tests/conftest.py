@@ -1,7 +1,13 @@
+import time
+from contextlib import ExitStack
 from datetime import timedelta
+from types import TracebackType
+from typing import Any, Callable, Dict, List, Optional, Type
 
 import pytest
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
 from django.test import Client
 from django.utils import timezone
 
@@ -11,6 +17,7 @@ from sanatorio_allende.models import (
     FindAppointment,
     PacienteAllende,
 )
+from sanatorio_allende.upstream_guard import UpstreamGuard
 
 TEST_PATIENT_ID = 12345
 TEST_SERVICIO_ID = 7
@@ -31,6 +38,96 @@ TEST_ID_PLANTILLA_TURNO = 81268
 TEST_ID_ITEM_PLANTILLA = 767071
 
 
+class QueryBudget:
+    """
+    Record the SQL queries and DB time of a block, e.g. a request to an endpoint
+
+    Every measurement is kept in QueryBudget.records and printed in the test
+    session summary, so query counts can be compared between runs.
+    """
+
+    records: List["QueryBudget"] = []
+
+    def __init__(self, endpoint: str, rows: int):
+        self.endpoint = endpoint
+        self.rows = rows
+        self.count = 0
+        self.db_seconds = 0.0
+        self.sql: List[str] = []
+        self._stack = ExitStack()
+
+    def _record(
+        self,
+        execute: Callable[..., Any],
+        sql: str,
+        params: Any,
+        many: bool,
+        context: Dict[str, Any],
+    ) -> Any:
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_seconds += time.perf_counter() - started
+            self.count += 1
+            self.sql.append(sql)
+
+    def __enter__(self) -> "QueryBudget":
+        self._stack.enter_context(connection.execute_wrapper(self._record))
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self._stack.close()
+        QueryBudget.records.append(self)
+
+    def assert_within(self, budget: int, baseline: "QueryBudget") -> None:
+        """
+        Fail if the block ran more queries than its budget or than the baseline
+
+        Args:
+            budget: Maximum number of queries allowed
+            baseline: The same block measured with a single row
+        """
+        queries = "\n".join(self.sql)
+        assert self.count <= budget, (
+            f"{self.endpoint} ran {self.count} queries with {self.rows} rows, "
+            f"its budget is {budget}:\n{queries}"
+        )
+        assert self.count == baseline.count, (
+            f"{self.endpoint} ran {baseline.count} queries with {baseline.rows} rows "
+            f"and {self.count} with {self.rows} rows:\n{queries}"
+        )
+
+
+def pytest_terminal_summary(terminalreporter: Any) -> None:
+    """Print the query counts and DB time recorded by QueryBudget"""
+    if not QueryBudget.records:
+        return
+    terminalreporter.section("query budgets")
+    for record in QueryBudget.records:
+        terminalreporter.write_line(
+            f"{record.endpoint:<32} rows={record.rows:<6} "
+            f"queries={record.count:<3} db={record.db_seconds * 1000:.2f}ms"
+        )
+
+
+@pytest.fixture(autouse=True)
+def clear_cache() -> None:
+    """Start every test with an empty cache so cached rows never leak between tests"""
+    cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def reset_upstream_guard() -> None:
+    """Start every test with closed circuits and full rate limit buckets"""
+    UpstreamGuard.reset()
+
+
 @pytest.fixture
 def user() -> User:
     """Create a test user"""
@@ -0,0 +1,171 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+from unittest.mock import patch
+
+import pytest
+from conftest import TEST_CONFIRMED_ID_TURNO
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+CONCURRENT_REQUESTS = 8
+
+
+def _booking_response() -> Any:
+    return type(
+        "MockResponse",
+        (),
+        {
+            "status_code": 200,
+            "json": lambda self: {"Entidad": {"Id": TEST_CONFIRMED_ID_TURNO}},
+        },
+    )()
+
+
+class TestAppointmentViewIdempotency:
+    """Test idempotency keys on appointment confirmation and cancellation"""
+
+    @pytest.mark.django_db
+    @patch("sanatorio_allende.allende_api.requests.post")
+    def test_retry_with_same_key_replays_first_response(
+        self, mock_post: Any, client: Any, best_appointment_found: Any
+    ) -> None:
+        """Test that a retried confirm returns the first result without calling Allende"""
+        mock_post.return_value = _booking_response()
+        url = reverse("sanatorio_allende:api_appointment")
+        data = json.dumps({"appointment_id": best_appointment_found.id})
+
+        first = client.post(
+            url, data, content_type="application/json", HTTP_IDEMPOTENCY_KEY="abc"
+        )
+        retry = client.post(
+            url, data, content_type="application/json", HTTP_IDEMPOTENCY_KEY="abc"
+        )
+
+        assert first.status_code == 200
+        assert retry.status_code == 200
+        assert json.loads(retry.content) == json.loads(first.content)
+        mock_post.assert_called_once()
+
+    @pytest.mark.django_db
+    @patch("sanatorio_allende.allende_api.requests.post")
+    def test_key_reused_for_another_appointment_is_rejected(
+        self, mock_post: Any, client: Any, best_appointment_found: Any
+    ) -> None:
+        """Test that a key is not replayed for a request on another appointment"""
+        mock_post.return_value = _booking_response()
+        url = reverse("sanatorio_allende:api_appointment")
+
+        first = client.post(
+            url,
+            json.dumps({"appointment_id": best_appointment_found.id}),
+            content_type="application/json",
+            HTTP_IDEMPOTENCY_KEY="abc",
+        )
+        other = client.post(
+            url,
+            json.dumps({"appointment_id": best_appointment_found.id + 1}),
+            content_type="application/json",
+            HTTP_IDEMPOTENCY_KEY="abc",
+        )
+
+        assert first.status_code == 200
+        assert other.status_code == 422
+        mock_post.assert_called_once()
+
+    @pytest.mark.django_db
+    @patch("sanatorio_allende.allende_api.requests.post")
+    def test_retry_without_key_reports_already_confirmed(
+        self, mock_post: Any, client: Any, best_appointment_found: Any
+    ) -> None:
+        """Test that a second confirm without key is rejected without calling Allende"""
+        mock_post.return_value = _booking_response()
+        url = reverse("sanatorio_allende:api_appointment")
+        data = json.dumps({"appointment_id": best_appointment_found.id})
+
+        client.post(url, data, content_type="application/json")
+        retry = client.post(url, data, content_type="application/json")
+
+        assert retry.status_code == 400
+        assert json.loads(retry.content)["error"] == "Appointment is already confirmed"
+        mock_post.assert_called_once()
+
+
+@pytest.mark.skipif(
+    not connection.features.has_select_for_update,
+    reason="Row-level locking requires a database with SELECT ... FOR UPDATE",
+)
+class TestAppointmentViewConcurrency:
+    """Hammer the confirm endpoint in parallel to check requests collapse"""
+
+    def _confirm_in_parallel(
+        self, user: User, appointment_id: int, idempotency_key: str = ""
+    ) -> List[Tuple[int, dict]]:
+        url = reverse("sanatorio_allende:api_appointment")
+        data = json.dumps({"appointment_id": appointment_id})
+        start = threading.Barrier(CONCURRENT_REQUESTS)
+
+        def confirm() -> Tuple[int, dict]:
+            client = Client()
+            client.force_login(user)
+            headers: Dict[str, Any] = (
+                {"HTTP_IDEMPOTENCY_KEY": idempotency_key} if idempotency_key else {}
+            )
+            start.wait()
+            try:
+                response = client.post(
+                    url, data, content_type="application/json", **headers
+                )
+                return response.status_code, json.loads(response.content)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=CONCURRENT_REQUESTS) as executor:
+            futures = [executor.submit(confirm) for _ in range(CONCURRENT_REQUESTS)]
+            return [future.result() for future in futures]
+
+    @pytest.mark.django_db(transaction=True)
+    @patch("sanatorio_allende.allende_api.requests.post")
+    def test_concurrent_confirms_call_allende_once(
+        self, mock_post: Any, user: User, best_appointment_found: Any
+    ) -> None:
+        """Test that parallel confirms book the slot exactly once"""
+
+        def slow_booking(*args: Any, **kwargs: Any) -> Any:
+            time.sleep(0.2)
+            return _booking_response()
+
+        mock_post.side_effect = slow_booking
+
+        results = self._confirm_in_parallel(user, best_appointment_found.id)
+
+        assert mock_post.call_count == 1
+        statuses = sorted(status for status, _ in results)
+        assert statuses == [200] + [400] * (CONCURRENT_REQUESTS - 1)
+        best_appointment_found.refresh_from_db()
+        assert best_appointment_found.confirmed_id_turno == TEST_CONFIRMED_ID_TURNO
+
+    @pytest.mark.django_db(transaction=True)
+    @patch("sanatorio_allende.allende_api.requests.post")
+    def test_concurrent_confirms_with_key_return_first_result(
+        self, mock_post: Any, user: User, best_appointment_found: Any
+    ) -> None:
+        """Test that parallel confirms sharing a key all get the first call's result"""
+
+        def slow_booking(*args: Any, **kwargs: Any) -> Any:
+            time.sleep(0.2)
+            return _booking_response()
+
+        mock_post.side_effect = slow_booking
+
+        results = self._confirm_in_parallel(
+            user, best_appointment_found.id, idempotency_key="double-tap"
+        )
+
+        assert mock_post.call_count == 1
+        assert all(status == 200 for status, _ in results)
+        assert all(body == results[0][1] for _, body in results)
@@ -10,7 +10,9 @@ from conftest import (
 )
 from django.utils import timezone
 
+from sanatorio_allende.allende_api import Allende
 from sanatorio_allende.models import BestAppointmentFound
+from sanatorio_allende.services.appointment_booking import AppointmentBookingService
 from sanatorio_allende.services.appointment_handler import (
     AppointmentActionType,
     AppointmentHandler,
@@ -653,3 +655,116 @@ class TestAppointmentHandler:
         assert result.action == AppointmentActionType.SKIPPED
         assert result.notification_sent is False
         assert "No new appointment found" in result.message
+
+
+class TestAppointmentHandlerAutoBook:
+    """Test the auto-book fast path of the appointment handler"""
+
+    @staticmethod
+    def _booking_calls(mock_post: Any) -> int:
+        return sum(
+            1 for call in mock_post.call_args_list if "turnos/Asignar" in call[0][0]
+        )
+
+    @pytest.mark.django_db
+    @patch("sanatorio_allende.allende_api.requests.post")
+    def test_auto_book_books_new_appointment_once(
+        self,
+        mock_post: Any,
+        find_appointment: Any,
+        patient: Any,
+        user: Any,
+    ) -> None:
+        """Test that a new slot is booked right away and the search is stopped"""
+        # Allende and Expo share requests.post, answer both with the booking shape
+        mock_post.return_value = type(
+            "MockResponse",
+            (),
+            {"status_code": 200, "json": lambda self: {"Entidad": {"Id": 100}}},
+        )()
+        find_appointment.auto_book = True
+        find_appointment.save()
+
+        appointment_data = {
+            "datetime": timezone.now() + datetime.timedelta(days=5),
+            "duracion_individual": TEST_DURACION_INDIVIDUAL,
+            "id_plantilla_turno": TEST_ID_PLANTILLA_TURNO,
+            "id_item_plantilla": TEST_ID_ITEM_PLANTILLA,
+        }
+
+        result = AppointmentHandler.process_appointment(
+            appointment_to_find=find_appointment,
+            patient=patient,
+            new_appointment_data=appointment_data,
+            user=user,
+            allende=Allende(auth_header=patient.token),
+        )
+
+        assert result.action == AppointmentActionType.CREATED
+        assert result.auto_booked is True
+        assert result.time_to_book is not None
+        best_appointment = BestAppointmentFound.objects.get(
+            appointment_wanted=find_appointment, patient=patient
+        )
+        assert best_appointment.confirmed is True
+        assert best_appointment.confirmed_id_turno == 100
+        find_appointment.refresh_from_db()
+        assert find_appointment.active is False
+        assert self._booking_calls(mock_post) == 1
+
+        # A later, better slot for the same search must not be booked again
+        better_data = dict(
+            appointment_data,
+            datetime=timezone.now() + datetime.timedelta(days=2),
+        )
+        result = AppointmentHandler.process_appointment(
+            appointment_to_find=find_appointment,
+            patient=patient,
+            new_appointment_data=better_data,
+            user=user,
+            allende=Allende(auth_header=patient.token),
+        )
+
+        assert result.auto_booked is False
+        assert self._booking_calls(mock_post) == 1
+
+    @pytest.mark.django_db
+    @patch("sanatorio_allende.allende_api.requests.post")
+    def test_book_rechecks_confirmation_under_lock(
+        self, mock_post: Any, best_appointment_found: Any, patient: Any
+    ) -> None:
+        """Test that a slot confirmed since it was loaded is not booked again"""
+        stale = BestAppointmentFound.objects.get(id=best_appointment_found.id)
+        BestAppointmentFound.objects.filter(id=stale.id).update(confirmed=True)
+
+        booking = AppointmentBookingService.book(
+            stale, Allende(auth_header=patient.token)
+        )
+
+        assert booking.success is False
+        assert booking.error == "Appointment is already confirmed"
+        assert self._booking_calls(mock_post) == 0
+
+    @pytest.mark.django_db
+    @patch("sanatorio_allende.allende_api.requests.post")
+    def test_auto_book_disabled_does_not_book(
+        self,
+        mock_post: Any,
+        find_appointment: Any,
+        patient: Any,
+        user: Any,
+    ) -> None:
+        """Test that searches without auto_book never call the booking endpoint"""
+        result = AppointmentHandler.process_appointment(
+            appointment_to_find=find_appointment,
+            patient=patient,
+            new_appointment_data={
+                "datetime": timezone.now() + datetime.timedelta(days=5)
+            },
+            user=user,
+            allende=Allende(auth_header=patient.token),
+        )
+
+        assert result.action == AppointmentActionType.CREATED
+        assert result.auto_booked is False
+        assert self._booking_calls(mock_post) == 0
@@ -140,3 +140,23 @@ class TestAppointmentProcessor:
         assert result.action == AppointmentAction.REMOVE_EXISTING
         assert result.should_notify is True
         assert result.notification_type == NotificationType.LOST
+
+    def test_timeframe_uses_the_given_now(self) -> None:
+        """Test that the timeframe window is measured from the run's time"""
+        now = datetime.datetime(2025, 9, 1, 12, 0, tzinfo=datetime.timezone.utc)
+        slot = now + datetime.timedelta(days=10)
+
+        assert not AppointmentProcessor.is_within_desired_timeframe(slot, "1 week", now)
+        assert AppointmentProcessor.is_within_desired_timeframe(
+            slot, "1 week", now + datetime.timedelta(days=4)
+        )
+
+    def test_has_slot_in_window(self) -> None:
+        """Test the in-window check of a search response"""
+        now = datetime.datetime(2025, 9, 1, 12, 0, tzinfo=datetime.timezone.utc)
+        slot = {"datetime": now + datetime.timedelta(days=10)}
+
+        assert AppointmentProcessor.has_slot_in_window(slot, "2 weeks", now)
+        assert AppointmentProcessor.has_slot_in_window(slot, None, now)
+        assert not AppointmentProcessor.has_slot_in_window(slot, "1 week", now)
+        assert not AppointmentProcessor.has_slot_in_window(None, "1 week", now)
@@ -0,0 +1,22 @@
+import json
+from typing import Any
+
+import pytest
+from django.core.management import call_command
+
+
+class TestBenchmarkDbConnections:
+    """Test the database connection latency benchmark"""
+
+    @pytest.mark.django_db
+    def test_reports_connect_latency(self, tmp_path: Any) -> None:
+        """Test that every simulated request is measured and written out"""
+        output = tmp_path / "connections.json"
+
+        call_command("benchmark_db_connections", requests=5, output=str(output))
+
+        results = json.loads(output.read_text())
+        assert results[0]["mode"] == "direct"
+        assert results[0]["requests"] == 5
+        assert 0 < results[0]["connect_p50_ms"] <= results[0]["connect_p99_ms"]
+        assert results[0]["request_p50_ms"] >= results[0]["connect_p50_ms"]
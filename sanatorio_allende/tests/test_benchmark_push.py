@@ -0,0 +1,38 @@
+import json
+from io import StringIO
+from typing import Any
+
+import pytest
+from django.core.management import call_command
+
+from sanatorio_allende.models import DeviceRegistration
+
+
+class TestBenchmarkPush:
+    """Test the push notification benchmark against the mock Expo service"""
+
+    @pytest.mark.django_db
+    def test_benchmark_reports_throughput_and_rolls_back(self, tmp_path: Any) -> None:
+        """Test that every batch size is measured, unregistered devices are reported and no rows are left"""
+        output = tmp_path / "benchmark.json"
+
+        call_command(
+            "benchmark_push",
+            devices="10",
+            batch_sizes="1,100",
+            unregistered_devices=0.2,
+            latency_ms=0,
+            jitter_ms=0,
+            output=str(output),
+            stdout=StringIO(),
+        )
+
+        results = json.loads(output.read_text())
+        assert [result["batch_size"] for result in results] == [1, 100]
+        for result in results:
+            assert result["devices"] == 10
+            assert result["sent"] == 8
+            assert result["unregistered"] == 2
+            assert result["send_messages_per_second"] > 0
+            assert result["receipts_per_second"] > 0
+        assert DeviceRegistration.objects.count() == 0
@@ -0,0 +1,47 @@
+import json
+from io import StringIO
+from typing import Any
+
+import pytest
+from django.core.management import call_command
+
+from sanatorio_allende.models import (
+    BestAppointmentFound,
+    FindAppointment,
+    PacienteAllende,
+)
+
+
+class TestBenchmarkSearch:
+    """Test the find_appointments benchmark against the mock Allende backend"""
+
+    @pytest.mark.django_db
+    def test_benchmark_reports_latency_and_rolls_back(
+        self, tmp_path: Any, patient: PacienteAllende, find_appointment: FindAppointment
+    ) -> None:
+        """Test that the benchmark searches only its fixtures and leaves no rows behind"""
+        output = tmp_path / "benchmark.json"
+
+        call_command(
+            "benchmark_search",
+            patients="3",
+            searches_per_patient=2,
+            latency_ms=0,
+            jitter_ms=0,
+            output=str(output),
+            stdout=StringIO(),
+        )
+
+        [result] = json.loads(output.read_text())
+        assert result["patients"] == 3
+        assert result["searches"] == 6
+        assert 0 < result["search_p50_ms"] <= result["search_p99_ms"]
+        # Token probes plus one availability request per search
+        assert result["upstream_calls"] >= 6
+        assert list(PacienteAllende.objects.all()) == [patient]
+        assert BestAppointmentFound.objects.count() == 0
+        # The existing patient was neither leased nor searched
+        patient.refresh_from_db()
+        find_appointment.refresh_from_db()
+        assert patient.lease_owner is None
+        assert find_appointment.next_poll_at is None
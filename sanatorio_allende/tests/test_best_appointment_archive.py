@@ -0,0 +1,108 @@
+from datetime import timedelta
+from io import StringIO
+from typing import List
+
+import pytest
+from django.core.management import call_command
+from django.utils import timezone
+
+from sanatorio_allende.models import (
+    BestAppointmentFound,
+    BestAppointmentFoundArchive,
+    FindAppointment,
+    PacienteAllende,
+)
+from sanatorio_allende.services.best_appointment_archive import (
+    BestAppointmentArchiveService,
+)
+
+
+def create_appointments(
+    find_appointment: FindAppointment,
+    patient: PacienteAllende,
+    days: List[int],
+    not_interested: bool = False,
+) -> List[BestAppointmentFound]:
+    return [
+        BestAppointmentFound.objects.create(
+            appointment_wanted=find_appointment,
+            patient=patient,
+            datetime=timezone.now() + timedelta(days=day),
+            not_interested=not_interested,
+            booking_payload={"IdPaciente": 1},
+        )
+        for day in days
+    ]
+
+
+class TestBestAppointmentArchive:
+    """Test moving past appointments found out of the hot table"""
+
+    @pytest.mark.django_db
+    def test_archive_moves_only_past_rows(
+        self, find_appointment: FindAppointment, patient: PacienteAllende
+    ) -> None:
+        """Test that past rows are archived and future ones, even not interested, stay"""
+        past = create_appointments(find_appointment, patient, [-30, -10, -3])
+        past[0].confirmed = True
+        past[0].confirmed_id_turno = 1234
+        past[0].save()
+        recent = create_appointments(find_appointment, patient, [0])
+        future = create_appointments(
+            find_appointment, patient, [5, 8], not_interested=True
+        )
+
+        result = BestAppointmentArchiveService.archive(pause_seconds=0)
+
+        assert result.archived == 3
+        assert result.complete
+        remaining = set(BestAppointmentFound.objects.values_list("id", flat=True))
+        assert remaining == {row.id for row in recent + future}
+        archived = BestAppointmentFoundArchive.objects.get(original_id=past[0].id)
+        assert archived.patient_id == patient.id
+        assert archived.appointment_wanted_id == find_appointment.id
+        assert archived.datetime == past[0].datetime
+        assert archived.confirmed
+        assert archived.confirmed_id_turno == 1234
+
+    @pytest.mark.django_db
+    def test_archive_works_in_batches(
+        self, find_appointment: FindAppointment, patient: PacienteAllende
+    ) -> None:
+        """Test that the rows are moved in batches and max_batches leaves the rest"""
+        create_appointments(find_appointment, patient, [-9, -8, -7, -6, -5])
+
+        first = BestAppointmentArchiveService.archive(
+            batch_size=2, pause_seconds=0, max_batches=2
+        )
+        assert (first.archived, first.batches, first.complete) == (4, 2, False)
+
+        second = BestAppointmentArchiveService.archive(batch_size=2, pause_seconds=0)
+        assert (second.archived, second.batches, second.complete) == (1, 1, True)
+        assert not BestAppointmentFound.objects.exists()
+        assert BestAppointmentFoundArchive.objects.count() == 5
+
+    @pytest.mark.django_db
+    def test_archive_survives_deleted_patient(
+        self, find_appointment: FindAppointment, patient: PacienteAllende
+    ) -> None:
+        """Test that the archive keeps the history of a patient deleted afterwards"""
+        create_appointments(find_appointment, patient, [-5])
+        BestAppointmentArchiveService.archive(pause_seconds=0)
+
+        patient.delete()
+
+        assert BestAppointmentFoundArchive.objects.count() == 1
+
+    @pytest.mark.django_db
+    def test_command_reports_archived_rows(
+        self, find_appointment: FindAppointment, patient: PacienteAllende
+    ) -> None:
+        """Test the archive_best_appointments command"""
+        create_appointments(find_appointment, patient, [-5, -4, 3])
+        out = StringIO()
+
+        call_command("archive_best_appointments", "--pause", "0", stdout=out)
+
+        assert "Archived 2 best appointments in 1 batches" in out.getvalue()
+        assert BestAppointmentFound.objects.count() == 1
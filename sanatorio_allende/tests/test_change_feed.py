@@ -0,0 +1,215 @@
+import json
+import threading
+from typing import Any, Iterator, List
+from unittest.mock import patch
+
+import psycopg
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.utils import timezone
+
+from sanatorio_allende.change_feed import (
+    NOTIFICATIONS_METRIC,
+    ChangeFeedListener,
+    ChangeNotification,
+    invalidate_patient_version,
+)
+from sanatorio_allende.metrics import Metrics
+from sanatorio_allende.models import FindAppointment, PacienteAllende
+from sanatorio_allende.repositories.patient_version_repository import (
+    PatientVersionRepository,
+)
+
+
+def change_payload(table: str, op: str, row_id: int, patient_id: Any) -> str:
+    return json.dumps(
+        {"table": table, "op": op, "id": row_id, "patient_id": patient_id}
+    )
+
+
+class FakeNotify:
+    def __init__(self, payload: str):
+        self.payload = payload
+
+
+class FakeConnection:
+    """Stands in for a psycopg connection that delivers some notifications"""
+
+    def __init__(self, payloads: List[str], stop_event: threading.Event):
+        self.payloads = payloads
+        self.stop_event = stop_event
+        self.executed: List[str] = []
+        self.closed = False
+
+    def execute(self, query: str) -> None:
+        self.executed.append(query)
+
+    def notifies(self, timeout: float) -> Iterator[FakeNotify]:
+        for payload in self.payloads:
+            yield FakeNotify(payload)
+        self.stop_event.set()
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class TestChangeFeed:
+    """Test the LISTEN/NOTIFY change feed of searches and appointments found"""
+
+    def test_parse_notification(self) -> None:
+        """Test that trigger payloads are parsed and invalid ones rejected"""
+        notification = ChangeNotification.parse(
+            change_payload("sanatorio_allende_findappointment", "UPDATE", 3, 7)
+        )
+
+        assert notification == ChangeNotification(
+            "sanatorio_allende_findappointment", "UPDATE", 3, 7
+        )
+        with pytest.raises(ValueError):
+            ChangeNotification.parse('{"table": "x"}')
+        with pytest.raises(ValueError):
+            ChangeNotification.parse("not json")
+
+    @pytest.mark.django_db
+    def test_notification_invalidates_patient_etag(
+        self, patient: PacienteAllende
+    ) -> None:
+        """Test that a change made outside the API bumps the patient's version"""
+        version = PatientVersionRepository.get(patient.id)
+
+        invalidate_patient_version(
+            ChangeNotification(
+                "sanatorio_allende_bestappointmentfound", "DELETE", 1, patient.id
+            )
+        )
+
+        assert PatientVersionRepository.get(patient.id) > version
+
+    def test_failing_handler_does_not_stop_the_others(self) -> None:
+        """Test that every handler sees the notification and it is counted"""
+        received: List[ChangeNotification] = []
+
+        def broken(notification: ChangeNotification) -> None:
+            raise RuntimeError("boom")
+
+        listener = ChangeFeedListener([broken, received.append])
+        labels = {"table": "sanatorio_allende_findappointment", "operation": "INSERT"}
+        notified_before = Metrics.counter_value(NOTIFICATIONS_METRIC, **labels)
+        listener.dispatch(
+            change_payload("sanatorio_allende_findappointment", "INSERT", 1, 2)
+        )
+        listener.dispatch("garbage")
+
+        assert [notification.id for notification in received] == [1]
+        assert (
+            Metrics.counter_value(NOTIFICATIONS_METRIC, **labels) == notified_before + 1
+        )
+
+    def test_listener_reconnects_after_connection_loss(self) -> None:
+        """Test that a failed connection is retried and LISTEN issued again"""
+        received: List[ChangeNotification] = []
+        stop_event = threading.Event()
+        listener = ChangeFeedListener([received.append], stop_event=stop_event)
+        listener.backoff = 0.01
+        payloads = [
+            change_payload("sanatorio_allende_appointmentevent", "INSERT", 9, 4)
+        ]
+        conn = FakeConnection(payloads, stop_event)
+
+        with patch.object(
+            ChangeFeedListener,
+            "_connect",
+            side_effect=[psycopg.OperationalError("server closed"), conn],
+        ) as connect:
+            listener.run()
+
+        assert connect.call_count == 2
+        assert conn.executed == ["LISTEN turnos_changes"]
+        assert conn.closed
+        assert [notification.id for notification in received] == [9]
+        assert listener.backoff == 1.0
+
+    @pytest.mark.django_db
+    @pytest.mark.skipif(
+        connection.vendor == "postgresql",
+        reason="Checks the error shown on databases without LISTEN/NOTIFY",
+    )
+    def test_command_requires_postgresql(self) -> None:
+        """Test that the listener command refuses to run on SQLite"""
+        with pytest.raises(CommandError):
+            call_command("listen_appointment_changes")
+
+
+@pytest.mark.skipif(
+    connection.vendor != "postgresql",
+    reason="Change notifications are sent by PostgreSQL triggers",
+)
+class TestChangeFeedTriggers:
+    """Check the triggers of migrations 0019 and 0025 against a real database"""
+
+    @pytest.mark.django_db(transaction=True)
+    def test_search_write_is_notified(self, find_appointment: FindAppointment) -> None:
+        """Test that updating a search sends a notification once committed"""
+        received: List[ChangeNotification] = []
+        stop_event = threading.Event()
+
+        def collect(notification: ChangeNotification) -> None:
+            received.append(notification)
+            stop_event.set()
+
+        listener = ChangeFeedListener([collect], stop_event=stop_event)
+        conn = listener._connect()
+        try:
+            conn.execute("LISTEN turnos_changes")
+            FindAppointment.objects.filter(id=find_appointment.id).update(active=False)
+            for notify in conn.notifies(timeout=5, stop_after=1):
+                listener.dispatch(notify.payload)
+        finally:
+            conn.close()
+
+        assert received == [
+            ChangeNotification(
+                "sanatorio_allende_findappointment",
+                "UPDATE",
+                find_appointment.id,
+                find_appointment.patient_id,
+            )
+        ]
+
+    @pytest.mark.django_db(transaction=True)
+    def test_scheduler_only_update_is_not_notified(
+        self, find_appointment: FindAppointment
+    ) -> None:
+        """Test that rescheduling a poll does not invalidate the patient's lists"""
+        received: List[ChangeNotification] = []
+        stop_event = threading.Event()
+
+        def collect(notification: ChangeNotification) -> None:
+            received.append(notification)
+            stop_event.set()
+
+        listener = ChangeFeedListener([collect], stop_event=stop_event)
+        conn = listener._connect()
+        try:
+            conn.execute("LISTEN turnos_changes")
+            FindAppointment.objects.filter(id=find_appointment.id).update(
+                next_poll_at=timezone.now(),
+                last_change_at=timezone.now(),
+                out_of_window_polls=3,
+                last_response_fingerprint="abc",
+            )
+            FindAppointment.objects.filter(id=find_appointment.id).update(
+                desired_timeframe="1 week"
+            )
+            for notify in conn.notifies(timeout=5, stop_after=1):
+                listener.dispatch(notify.payload)
+            # Nothing else is pending behind the user-visible change
+            for notify in conn.notifies(timeout=0.5):
+                listener.dispatch(notify.payload)
+        finally:
+            conn.close()
+
+        assert len(received) == 1
+        assert received[0].operation == "UPDATE"
@@ -0,0 +1,115 @@
+import json
+from datetime import timedelta
+from typing import Any
+from unittest.mock import patch
+
+import pytest
+from conftest import QueryBudget
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from sanatorio_allende.models import BestAppointmentFound, FindAppointment
+from sanatorio_allende.repositories.best_appointment_repository import (
+    BestAppointmentRepository,
+)
+
+WORKER_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "search-worker",
+    }
+}
+
+
+class TestConditionalGet:
+    """Test ETags and 304 responses of the list endpoints polled by the app"""
+
+    @pytest.mark.django_db
+    def test_unchanged_find_appointments_poll_is_not_modified(
+        self, client: Any, find_appointment: FindAppointment
+    ) -> None:
+        """Test that a poll with the current ETag gets a 304 without listing the searches"""
+        url = reverse("sanatorio_allende:api_find_appointments")
+        params = {"patient_id": find_appointment.patient_id}
+        first = client.get(url, params)
+        assert first.status_code == 200
+        etag = first["ETag"]
+
+        with QueryBudget("FindAppointmentView.get (304)", 1) as queries:
+            response = client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == 304
+        assert response["ETag"] == etag
+        assert response.content == b""
+        # Session, user and the patient ownership check
+        assert queries.count == 3
+
+    @pytest.mark.django_db
+    def test_search_change_invalidates_etag(
+        self, client: Any, find_appointment: FindAppointment
+    ) -> None:
+        """Test that disabling a search makes the next poll download the list"""
+        url = reverse("sanatorio_allende:api_find_appointments")
+        params = {"patient_id": find_appointment.patient_id}
+        etag = client.get(url, params)["ETag"]
+
+        client.patch(
+            url,
+            json.dumps({"appointment_id": find_appointment.id, "active": False}),
+            content_type="application/json",
+        )
+        response = client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == 200
+        assert response["ETag"] != etag
+        assert json.loads(response.content)["appointments"][0]["enabled"] is False
+
+    @pytest.mark.django_db
+    def test_etag_depends_on_query_string(
+        self, client: Any, find_appointment: FindAppointment
+    ) -> None:
+        """Test that the ETag of one page is not accepted for another"""
+        url = reverse("sanatorio_allende:api_find_appointments")
+        params = {"patient_id": find_appointment.patient_id}
+        etag = client.get(url, params)["ETag"]
+
+        response = client.get(url, {**params, "limit": 1}, HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == 200
+
+    @pytest.mark.django_db
+    def test_search_worker_writes_invalidate_best_appointments_etag(
+        self, client: Any, best_appointment_found: BestAppointmentFound
+    ) -> None:
+        """Test that an appointment found by the search worker is not hidden by a 304"""
+        url = reverse("sanatorio_allende:api_best_appointments")
+        params = {"patient_id": best_appointment_found.patient_id}
+        etag = client.get(url, params)["ETag"]
+        assert client.get(url, params, HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+        # The worker is another process and does not share the web cache
+        with override_settings(CACHES=WORKER_CACHES):
+            BestAppointmentRepository.update_best_appointment(
+                best_appointment_found, timezone.now() + timedelta(hours=2)
+            )
+        response = client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == 200
+
+    @pytest.mark.django_db
+    def test_best_appointments_etag_expires_with_first_appointment(
+        self, client: Any, best_appointment_found: BestAppointmentFound
+    ) -> None:
+        """Test that the list is sent again once a listed appointment is in the past"""
+        url = reverse("sanatorio_allende:api_best_appointments")
+        params = {"patient_id": best_appointment_found.patient_id}
+        etag = client.get(url, params)["ETag"]
+
+        with patch(
+            "sanatorio_allende.conditional.timezone.now",
+            return_value=best_appointment_found.datetime + timedelta(seconds=1),
+        ):
+            response = client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == 200
@@ -0,0 +1,156 @@
+import json
+from typing import Any, Optional
+from unittest.mock import patch
+
+import pytest
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connections, router
+from django.http import HttpRequest
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from sanatorio_allende.db_router import (
+    REPLICA_ALIAS,
+    PrimaryStickiness,
+    read_from_replica,
+)
+from sanatorio_allende.models import BestAppointmentFound, PacienteAllende
+from sanatorio_allende.repositories.patient_version_repository import (
+    PatientVersionRepository,
+)
+
+REPLICA_DATABASES = {
+    **settings.DATABASES,
+    REPLICA_ALIAS: {**settings.DATABASES["default"]},
+}
+
+
+@read_from_replica
+def read_database(request: HttpRequest) -> Any:
+    """Stand-in view answering with the database its reads are routed to"""
+    return router.db_for_read(BestAppointmentFound)
+
+
+def shared_caches(location: str) -> dict:
+    """A cache shared by processes, like the Redis cache of production"""
+    return {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": location,
+        }
+    }
+
+
+def list_request(user: User, patient_id: Optional[int] = None) -> HttpRequest:
+    params = {"patient_id": patient_id} if patient_id is not None else {}
+    request = RequestFactory().get("/api/best-appointments/", params)
+    request.user = user
+    return request
+
+
+# The replica alias only exists in settings, queries are never run against it
+@pytest.mark.filterwarnings("ignore:Overriding setting DATABASES")
+class TestReadReplicaRouting:
+    """Test sending the reads of the list endpoints to the read replica"""
+
+    @pytest.fixture(autouse=True)
+    def shared_cache(self, settings: Any, tmp_path: Any) -> None:
+        settings.CACHES = shared_caches(str(tmp_path))
+
+    @pytest.mark.django_db
+    @override_settings(DATABASES=REPLICA_DATABASES)
+    @patch("sanatorio_allende.db_router.replica_available", return_value=True)
+    def test_reads_use_primary_without_shared_cache(
+        self, mock_available: Any, settings: Any, user: User
+    ) -> None:
+        """Test that pins private to a process never let reads go to the replica"""
+        settings.CACHES = {
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        }
+
+        assert read_database(list_request(user)) == "default"
+
+    @pytest.mark.django_db
+    def test_reads_use_primary_without_replica(self, user: User) -> None:
+        """Test that every read goes to the primary when no replica is configured"""
+        assert read_database(list_request(user)) == "default"
+
+    @pytest.mark.django_db
+    @override_settings(DATABASES=REPLICA_DATABASES)
+    @patch("sanatorio_allende.db_router.replica_available", return_value=True)
+    def test_decorated_view_reads_from_replica(
+        self, mock_available: Any, user: User
+    ) -> None:
+        """Test that only the decorated view's reads are routed to the replica"""
+        assert read_database(list_request(user)) == REPLICA_ALIAS
+        assert router.db_for_read(BestAppointmentFound) == "default"
+        assert router.db_for_write(BestAppointmentFound) == "default"
+
+    @pytest.mark.django_db
+    @override_settings(DATABASES=REPLICA_DATABASES)
+    @patch("sanatorio_allende.db_router.replica_available", return_value=False)
+    def test_unavailable_replica_falls_back_to_primary(
+        self, mock_available: Any, user: User
+    ) -> None:
+        """Test that the primary serves the reads while the replica is down"""
+        assert read_database(list_request(user)) == "default"
+
+    @pytest.mark.django_db
+    @override_settings(DATABASES=REPLICA_DATABASES)
+    @patch("sanatorio_allende.db_router.replica_available", return_value=True)
+    def test_user_reads_primary_after_write(
+        self, mock_available: Any, client: Any, user: User
+    ) -> None:
+        """Test that a successful write pins the user's next reads to the primary"""
+        url = reverse("sanatorio_allende:api_register_device")
+        rejected = client.post(url, json.dumps({}), content_type="application/json")
+        assert rejected.status_code == 400
+        assert read_database(list_request(user)) == REPLICA_ALIAS
+
+        response = client.post(
+            url,
+            json.dumps({"push_token": "replica_push_token"}),
+            content_type="application/json",
+        )
+
+        assert response.status_code == 200
+        assert read_database(list_request(user)) == "default"
+
+    @pytest.mark.django_db
+    @override_settings(DATABASES=REPLICA_DATABASES)
+    @patch("sanatorio_allende.db_router.replica_available", return_value=True)
+    def test_patient_reads_primary_after_change(
+        self, mock_available: Any, user: User, patient: PacienteAllende
+    ) -> None:
+        """Test that a change to a patient's data, e.g. by the worker, pins their lists"""
+        assert read_database(list_request(user, patient.id)) == REPLICA_ALIAS
+
+        PatientVersionRepository.bump(patient.id)
+
+        assert PrimaryStickiness.is_pinned(None, str(patient.id))
+        assert read_database(list_request(user, patient.id)) == "default"
+        assert read_database(list_request(user, patient.id + 1)) == REPLICA_ALIAS
+
+    def test_replica_is_never_migrated(self) -> None:
+        """Test that the replica only receives the schema through replication"""
+        assert router.allow_migrate(REPLICA_ALIAS, "sanatorio_allende") is False
+        assert router.allow_migrate("default", "sanatorio_allende") is True
+
+    @pytest.mark.skipif(
+        REPLICA_ALIAS not in settings.DATABASES,
+        reason="Requires a replica database (DB_REPLICA_HOST)",
+    )
+    @pytest.mark.django_db(transaction=True, databases=["default", REPLICA_ALIAS])
+    def test_list_endpoint_queries_replica(
+        self, client: Any, patient: PacienteAllende
+    ) -> None:
+        """Test that the appointments list is read from the replica database"""
+        url = reverse("sanatorio_allende:api_best_appointments")
+
+        with CaptureQueriesContext(connections[REPLICA_ALIAS]) as queries:
+            response = client.get(url, {"patient_id": patient.id})
+
+        assert response.status_code == 200
+        assert len(queries) > 0
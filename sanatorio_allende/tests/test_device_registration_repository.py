@@ -0,0 +1,134 @@
+from typing import Any
+from unittest.mock import patch
+
+import pytest
+from django.contrib.admin.sites import site
+from django.contrib.auth.models import User
+from django.test import RequestFactory
+from django.urls import reverse
+
+from sanatorio_allende.models import DeviceRegistration
+from sanatorio_allende.repositories.device_registration_repository import (
+    DeviceRegistrationRepository,
+)
+from sanatorio_allende.services.push_notifications import PushNotificationService
+
+
+class TestDeviceRegistrationRepository:
+    """Test the per-user push token cache"""
+
+    @pytest.mark.django_db
+    def test_get_active_tokens_is_cached(
+        self, user: User, device_registration: Any, django_assert_num_queries: Any
+    ) -> None:
+        """Test that the tokens are loaded once and then served from the cache"""
+        with django_assert_num_queries(1):
+            assert DeviceRegistrationRepository.get_active_tokens(user) == [
+                device_registration.push_token
+            ]
+        with django_assert_num_queries(0):
+            assert DeviceRegistrationRepository.get_active_tokens(user) == [
+                device_registration.push_token
+            ]
+
+    @pytest.mark.django_db
+    def test_prime_active_tokens_loads_all_users_in_one_query(
+        self,
+        user: User,
+        evil_user: User,
+        device_registration: Any,
+        django_assert_num_queries: Any,
+    ) -> None:
+        """Test that the bulk loader fills the cache for every user with one query"""
+        with django_assert_num_queries(1):
+            tokens = DeviceRegistrationRepository.prime_active_tokens(
+                [user.id, evil_user.id]
+            )
+
+        assert tokens == {user.id: [device_registration.push_token], evil_user.id: []}
+        with django_assert_num_queries(0):
+            DeviceRegistrationRepository.get_active_tokens(user)
+            DeviceRegistrationRepository.get_active_tokens(evil_user)
+
+    @pytest.mark.django_db
+    def test_deactivate_tokens_invalidates_cache(
+        self, user: User, device_registration: Any
+    ) -> None:
+        """Test that deactivated tokens disappear from the cached list"""
+        DeviceRegistrationRepository.get_active_tokens(user)
+
+        assert (
+            DeviceRegistrationRepository.deactivate_tokens(
+                [device_registration.push_token]
+            )
+            == 1
+        )
+        assert DeviceRegistrationRepository.get_active_tokens(user) == []
+
+    @pytest.mark.django_db
+    @patch("sanatorio_allende.services.push_notifications.requests.post")
+    def test_send_notification_deactivates_unregistered_devices(
+        self, mock_post: Any, user: User, device_registration: Any
+    ) -> None:
+        """Test that DeviceNotRegistered tickets deactivate the device"""
+        mock_response = type("MockResponse", (), {"status_code": 200})()
+        mock_response.json = lambda: {
+            "data": [
+                {
+                    "status": "error",
+                    "message": "not a registered push notification recipient",
+                    "details": {
+                        "error": "DeviceNotRegistered",
+                        "expoPushToken": device_registration.push_token,
+                    },
+                }
+            ]
+        }
+        mock_post.return_value = mock_response
+
+        result = PushNotificationService.send_notification(
+            title="Test", body="Test", user=user
+        )
+
+        assert result["success"] is True
+        assert result["sent_count"] == 0
+        device_registration.refresh_from_db()
+        assert device_registration.is_active is False
+        assert DeviceRegistrationRepository.get_active_tokens(user) == []
+
+    @pytest.mark.django_db
+    def test_register_device_invalidates_cache(
+        self, client: Any, user: User, device_registration: Any
+    ) -> None:
+        """Test that registering a new device makes it visible immediately"""
+        DeviceRegistrationRepository.get_active_tokens(user)
+
+        response = client.post(
+            reverse("sanatorio_allende:api_register_device"),
+            '{"push_token": "new_push_token"}',
+            content_type="application/json",
+        )
+
+        assert response.status_code == 200
+        assert sorted(DeviceRegistrationRepository.get_active_tokens(user)) == sorted(
+            [device_registration.push_token, "new_push_token"]
+        )
+        assert DeviceRegistration.objects.filter(user=user).count() == 2
+
+    @pytest.mark.django_db
+    def test_admin_delete_invalidates_cache(
+        self, user: User, device_registration: Any
+    ) -> None:
+        """Test that devices deleted from the admin stop receiving pushes"""
+        model_admin = site._registry[DeviceRegistration]
+        request = RequestFactory().post("/")
+        other = DeviceRegistration.objects.create(user=user, push_token="other_token")
+
+        DeviceRegistrationRepository.get_active_tokens(user)
+        model_admin.delete_model(request, device_registration)
+        assert DeviceRegistrationRepository.get_active_tokens(user) == ["other_token"]
+
+        model_admin.delete_queryset(
+            request, DeviceRegistration.objects.filter(pk=other.pk)
+        )
+        assert DeviceRegistrationRepository.get_active_tokens(user) == []
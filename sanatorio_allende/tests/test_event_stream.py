@@ -0,0 +1,323 @@
+import asyncio
+import datetime
+import json
+from typing import Any, AsyncIterator, Iterator, List
+from unittest.mock import patch
+
+import pytest
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import User
+from django.db import OperationalError
+from django.test import AsyncClient, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from sanatorio_allende.event_stream import (
+    AppointmentEventBroadcaster,
+    AppointmentEventStream,
+)
+from sanatorio_allende.models import (
+    AppointmentEvent,
+    BestAppointmentFound,
+    FindAppointment,
+    PacienteAllende,
+)
+from sanatorio_allende.services.appointment_events import AppointmentEventService
+from sanatorio_allende.services.appointment_handler import AppointmentHandler
+
+
+def read_blocks(stream: AppointmentEventStream, count: int) -> List[str]:
+    """Read the first blocks of a stream and disconnect"""
+
+    async def read() -> List[str]:
+        events: AsyncIterator[str] = stream.events()
+        blocks = []
+        try:
+            for _ in range(count):
+                blocks.append(await asyncio.wait_for(events.__anext__(), timeout=5))
+        finally:
+            await events.aclose()  # type: ignore[attr-defined]
+        return blocks
+
+    return async_to_sync(read)()
+
+
+def asgi_get(user: User, path: str, data: dict, **extra: Any) -> Any:
+    """GET through the ASGI handler, as served in production"""
+    client = AsyncClient()
+    client.force_login(user)
+    return async_to_sync(client.get)(path, data, **extra)
+
+
+def parse_block(block: str) -> dict:
+    fields = dict(line.split(": ", 1) for line in block.strip().split("\n"))
+    return {**fields, "data": json.loads(fields["data"])}
+
+
+class TestAppointmentEventStream:
+    """Test the server-sent event stream of appointment changes"""
+
+    @pytest.fixture(autouse=True)
+    def keep_test_connection(self) -> Iterator[None]:
+        # Closing the connection would end the transaction of the test
+        with patch("sanatorio_allende.event_stream.close_old_connections"):
+            yield
+
+    @pytest.mark.django_db
+    @patch("sanatorio_allende.services.push_notifications.requests.post")
+    def test_handler_records_created_and_updated_events(
+        self,
+        mock_post: Any,
+        find_appointment: FindAppointment,
+        patient: PacienteAllende,
+        user: Any,
+    ) -> None:
+        """Test that a found and then improved appointment are both recorded"""
+        later = timezone.now() + datetime.timedelta(days=5)
+        for slot in (later, later - datetime.timedelta(days=2)):
+            AppointmentHandler.process_appointment(
+                appointment_to_find=find_appointment,
+                patient=patient,
+                new_appointment_data={"datetime": slot},
+                user=user,
+            )
+
+        events = list(AppointmentEvent.objects.filter(patient=patient))
+        assert [event.event_type for event in events] == [
+            AppointmentEvent.CREATED,
+            AppointmentEvent.UPDATED,
+        ]
+        best = BestAppointmentFound.objects.get(patient=patient)
+        assert events[1].payload["id"] == best.id
+        assert events[1].payload["best_datetime"] == best.datetime.isoformat()
+        assert events[1].payload["doctor_name"] == find_appointment.doctor_name
+
+    @pytest.mark.django_db
+    def test_stream_replays_events_after_last_event_id(
+        self, best_appointment_found: BestAppointmentFound, evil_user: Any
+    ) -> None:
+        """Test that a reconnecting client gets only the events it missed"""
+        first = AppointmentEventService.record_appointment(
+            AppointmentEvent.CREATED, best_appointment_found
+        )
+        second = AppointmentEventService.record_confirmation(
+            AppointmentEvent.BOOKED, best_appointment_found
+        )
+        other_patient = PacienteAllende.objects.create(user=evil_user, name="Otro")
+        AppointmentEventService.record(
+            other_patient.id, AppointmentEvent.REMOVED, {"ids": []}
+        )
+
+        stream = AppointmentEventStream(best_appointment_found.patient_id, first.id)
+        retry, block = read_blocks(stream, 2)
+
+        assert retry.startswith("retry: ")
+        event = parse_block(block)
+        assert event["id"] == str(second.id)
+        assert event["event"] == AppointmentEvent.BOOKED
+        assert event["data"]["payload"]["id"] == best_appointment_found.id
+
+    @pytest.mark.django_db
+    def test_stream_resets_when_missed_events_were_purged(
+        self, best_appointment_found: BestAppointmentFound
+    ) -> None:
+        """Test that a client resuming from a purged event is told to reload"""
+        old = AppointmentEventService.record_appointment(
+            AppointmentEvent.CREATED, best_appointment_found
+        )
+        AppointmentEventService.record_appointment(
+            AppointmentEvent.UPDATED, best_appointment_found
+        )
+        AppointmentEvent.objects.filter(id=old.id).update(
+            created_at=timezone.now() - datetime.timedelta(hours=48)
+        )
+        assert AppointmentEventService.purge() == 1
+
+        stream = AppointmentEventStream(best_appointment_found.patient_id, old.id - 1)
+        _, reset, block = read_blocks(stream, 3)
+
+        assert reset.startswith("event: reset")
+        assert parse_block(block)["event"] == AppointmentEvent.UPDATED
+
+    @pytest.mark.django_db
+    @override_settings(APPOINTMENT_EVENTS_HEARTBEAT_SECONDS=0.01)
+    def test_idle_stream_sends_heartbeats(self, patient: PacienteAllende) -> None:
+        """Test that an idle connection is kept open with comment lines"""
+        _, heartbeat = read_blocks(AppointmentEventStream(patient.id, None), 2)
+
+        assert heartbeat == ": heartbeat\n\n"
+
+    @pytest.mark.django_db
+    @override_settings(APPOINTMENT_EVENTS_POLL_SECONDS=0.01)
+    def test_live_events_are_delivered_once_to_their_patient(
+        self, best_appointment_found: BestAppointmentFound
+    ) -> None:
+        """Test that events written while connected reach only the patient's streams"""
+        patient_id = best_appointment_found.patient_id
+
+        async def read() -> List[str]:
+            events: AsyncIterator[str] = AppointmentEventStream(
+                patient_id, None
+            ).events()
+            other: AsyncIterator[str] = AppointmentEventStream(
+                patient_id + 1, None
+            ).events()
+            try:
+                await events.__anext__()
+                await other.__anext__()
+                assert AppointmentEventBroadcaster.connection_count() == 2
+
+                record = sync_to_async(AppointmentEventService.record_confirmation)
+                await record(AppointmentEvent.BOOKED, best_appointment_found)
+                AppointmentEventBroadcaster.wake_up()
+                blocks = [await asyncio.wait_for(events.__anext__(), timeout=5)]
+
+                await record(AppointmentEvent.CANCELLED, best_appointment_found)
+                blocks.append(await asyncio.wait_for(events.__anext__(), timeout=5))
+                queues = AppointmentEventBroadcaster._subscribers[patient_id + 1]
+                assert all(queue.empty() for queue in queues)
+            finally:
+                await events.aclose()  # type: ignore[attr-defined]
+                await other.aclose()  # type: ignore[attr-defined]
+            assert AppointmentEventBroadcaster.connection_count() == 0
+            return blocks
+
+        booked, cancelled = async_to_sync(read)()
+
+        assert parse_block(booked)["event"] == AppointmentEvent.BOOKED
+        assert parse_block(cancelled)["event"] == AppointmentEvent.CANCELLED
+        assert int(parse_block(booked)["id"]) < int(parse_block(cancelled)["id"])
+
+    @pytest.mark.django_db
+    @override_settings(APPOINTMENT_EVENTS_POLL_SECONDS=0.01)
+    def test_stream_recovers_from_lost_database_connection(
+        self, best_appointment_found: BestAppointmentFound
+    ) -> None:
+        """Test that a dropped connection is replaced and events keep flowing"""
+        patient_id = best_appointment_found.patient_id
+        events_after = AppointmentEventService.events_after
+        # Like Django, only a connection that failed a query is replaced
+        connection = {"broken": False, "failed": False}
+
+        def read_events(*args: Any, **kwargs: Any) -> List[AppointmentEvent]:
+            if connection["broken"]:
+                connection["failed"] = True
+                raise OperationalError("server closed the connection unexpectedly")
+            return events_after(*args, **kwargs)
+
+        def close_old_connections() -> None:
+            if connection["failed"]:
+                connection["broken"] = connection["failed"] = False
+
+        async def read() -> str:
+            events: AsyncIterator[str] = AppointmentEventStream(
+                patient_id, None
+            ).events()
+            try:
+                await events.__anext__()
+                connection["broken"] = True
+                await sync_to_async(AppointmentEventService.record_confirmation)(
+                    AppointmentEvent.BOOKED, best_appointment_found
+                )
+                return await asyncio.wait_for(events.__anext__(), timeout=5)
+            finally:
+                await events.aclose()  # type: ignore[attr-defined]
+
+        with patch.object(
+            AppointmentEventService, "events_after", side_effect=read_events
+        ), patch(
+            "sanatorio_allende.event_stream.close_old_connections",
+            side_effect=close_old_connections,
+        ):
+            booked = async_to_sync(read)()
+
+        assert parse_block(booked)["event"] == AppointmentEvent.BOOKED
+
+    @pytest.mark.django_db
+    def test_late_committed_events_are_dispatched_once(
+        self, best_appointment_found: BestAppointmentFound
+    ) -> None:
+        """Test that an event below the last dispatched ID is still delivered"""
+        first = AppointmentEventService.record_appointment(
+            AppointmentEvent.CREATED, best_appointment_found
+        )
+        second = AppointmentEventService.record_appointment(
+            AppointmentEvent.UPDATED, best_appointment_found
+        )
+        AppointmentEventBroadcaster._last_id = first.id - 1
+        AppointmentEventBroadcaster._dispatched = {}
+        AppointmentEventBroadcaster.dispatch([second])
+
+        # The first event commits after the second one was read
+        assert [event.id for event in AppointmentEventBroadcaster._read()] == [first.id]
+        AppointmentEventBroadcaster.dispatch([first, second])
+        assert AppointmentEventBroadcaster._read() == []
+
+    @pytest.mark.django_db
+    def test_view_rejects_patient_of_another_user(
+        self, evil_user: User, patient: PacienteAllende
+    ) -> None:
+        """Test that a user cannot subscribe to another user's patient"""
+        response = asgi_get(
+            evil_user,
+            reverse("sanatorio_allende:api_best_appointment_events"),
+            {"patient_id": patient.id},
+        )
+
+        assert response.status_code == 401
+
+    @pytest.mark.django_db
+    def test_view_requires_asgi(self, client: Any, patient: PacienteAllende) -> None:
+        """Test that a WSGI server does not hold a worker per connected app"""
+        response = client.get(
+            reverse("sanatorio_allende:api_best_appointment_events"),
+            {"patient_id": patient.id},
+        )
+
+        assert response.status_code == 501
+        assert not response.streaming
+
+    @pytest.mark.django_db
+    def test_view_opens_event_stream(
+        self, user: User, patient: PacienteAllende
+    ) -> None:
+        """Test that the owner gets an unbuffered event stream"""
+        response = asgi_get(
+            user,
+            reverse("sanatorio_allende:api_best_appointment_events"),
+            {"patient_id": patient.id},
+            HTTP_LAST_EVENT_ID="10",
+        )
+
+        assert response.status_code == 200
+        assert response.streaming
+        assert response["Content-Type"] == "text/event-stream"
+        assert response["Cache-Control"] == "no-cache"
+        assert response["X-Accel-Buffering"] == "no"
+
+    @pytest.mark.django_db
+    def test_not_interested_changes_are_recorded(
+        self, client: Any, best_appointment_found: BestAppointmentFound
+    ) -> None:
+        """Test that hiding and restoring an appointment reach the other apps"""
+        url = reverse("sanatorio_allende:api_best_appointments")
+        for not_interested in (True, False):
+            response = client.patch(
+                url,
+                json.dumps(
+                    {
+                        "appointment_id": best_appointment_found.id,
+                        "not_interested": not_interested,
+                    }
+                ),
+                content_type="application/json",
+            )
+            assert response.status_code == 200
+
+        removed, restored = AppointmentEvent.objects.filter(
+            patient_id=best_appointment_found.patient_id
+        )
+        assert removed.event_type == AppointmentEvent.REMOVED
+        assert removed.payload == {"ids": [best_appointment_found.id]}
+        assert restored.event_type == AppointmentEvent.UPDATED
+        assert restored.payload["id"] == best_appointment_found.id
@@ -0,0 +1,297 @@
+import datetime
+import json
+from typing import Any
+from unittest.mock import MagicMock, patch
+
+import pytest
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+
+from sanatorio_allende.management.commands.find_appointments import Command
+from sanatorio_allende.metrics import Metrics
+from sanatorio_allende.models import (
+    BestAppointmentFound,
+    FindAppointment,
+    PacienteAllende,
+)
+from sanatorio_allende.services.appointment_handler import AppointmentHandler
+from sanatorio_allende.services.polling_scheduler import PollingScheduler
+from sanatorio_allende.services.search_fingerprint import SearchFingerprintService
+
+COMMAND_MODULE = "sanatorio_allende.management.commands.find_appointments"
+
+
+class TestFindAppointmentsDaemon:
+    """Test the long-running mode of the find_appointments command"""
+
+    def _empty_search_response(self) -> Any:
+        return type(
+            "MockResponse",
+            (),
+            {"status_code": 200, "json": lambda self: {}},
+        )()
+
+    @pytest.mark.django_db
+    @patch(f"{COMMAND_MODULE}.AllendeAuthService")
+    @patch("sanatorio_allende.allende_api.requests.Session.post")
+    def test_daemon_reuses_verified_token_between_cycles(
+        self,
+        mock_session_post: Any,
+        mock_auth_service: Any,
+        patient: PacienteAllende,
+        find_appointment: FindAppointment,
+    ) -> None:
+        """Test that a recently verified token is not logged in again"""
+        mock_auth_service.return_value.login.return_value = patient.token
+        mock_session_post.return_value = self._empty_search_response()
+        command = Command()
+        command.daemon = True
+
+        command.run_cycle()
+        FindAppointment.objects.update(next_poll_at=None)
+        command.run_cycle()
+
+        mock_auth_service.return_value.login.assert_called_once()
+        assert mock_session_post.call_count == 2
+        assert list(command.sessions) == [patient.id]
+
+    @pytest.mark.django_db
+    def test_daemon_stops_when_requested(self) -> None:
+        """Test that the tick loop exits after a stop request"""
+        command = Command()
+        session = MagicMock()
+        command.sessions[1] = session
+
+        cycles = []
+
+        def cycle() -> None:
+            cycles.append(1)
+            command.request_stop(15, None)
+
+        with patch.object(command, "run_cycle", side_effect=cycle):
+            command.run_daemon(interval=3600)
+
+        assert len(cycles) == 1
+        session.close.assert_called_once()
+        assert command.sessions == {}
+
+    @pytest.mark.django_db
+    @patch(f"{COMMAND_MODULE}.timezone")
+    @patch(f"{COMMAND_MODULE}.AllendeAuthService")
+    @patch("sanatorio_allende.allende_api.requests.post")
+    def test_next_poll_scheduled_from_cycle_start(
+        self,
+        mock_post: Any,
+        mock_auth_service: Any,
+        mock_timezone: Any,
+        patient: PacienteAllende,
+        find_appointment: FindAppointment,
+    ) -> None:
+        """Test that a slow login does not push the next poll past the next tick"""
+        cycle_start = timezone.now()
+        # The patient is processed four minutes into the cycle
+        mock_timezone.now.side_effect = [
+            cycle_start,
+            cycle_start + datetime.timedelta(minutes=4),
+        ]
+        mock_auth_service.return_value.login.return_value = patient.token
+        mock_post.return_value = self._empty_search_response()
+
+        Command().run_cycle()
+
+        find_appointment.refresh_from_db()
+        assert find_appointment.next_poll_at == cycle_start + (
+            PollingScheduler.compute_interval(find_appointment, cycle_start)
+        )
+
+    @pytest.mark.django_db
+    @patch(f"{COMMAND_MODULE}.timezone")
+    @patch(f"{COMMAND_MODULE}.AllendeAuthService")
+    @patch("sanatorio_allende.allende_api.requests.post")
+    def test_every_patient_of_a_cycle_shares_its_now(
+        self,
+        mock_post: Any,
+        mock_auth_service: Any,
+        mock_timezone: Any,
+        patient: PacienteAllende,
+        find_appointment: FindAppointment,
+    ) -> None:
+        """Test that later patients of a cycle are not searched with a later now"""
+        other_patient = PacienteAllende.objects.get(id=patient.id)
+        other_patient.pk = None
+        other_patient.save()
+        other_search = FindAppointment.objects.get(id=find_appointment.id)
+        other_search.pk = None
+        other_search.patient = other_patient
+        other_search.save()
+
+        cycle_start = timezone.now()
+        mock_timezone.now.side_effect = [
+            cycle_start + datetime.timedelta(minutes=minutes)
+            for minutes in range(0, 60, 4)
+        ]
+        mock_auth_service.return_value.login.return_value = patient.token
+        mock_post.return_value = self._empty_search_response()
+
+        with patch.object(
+            Command,
+            "process_search_result",
+            autospec=True,
+            side_effect=Command.process_search_result,
+        ) as mock_process:
+            Command().run_cycle()
+
+        searched = {call.args[2].id: call.args[4] for call in mock_process.mock_calls}
+        assert searched == {
+            find_appointment.id: cycle_start,
+            other_search.id: cycle_start,
+        }
+
+
+class TestFindAppointmentsProfile:
+    """Test the --profile report of the find_appointments command"""
+
+    @pytest.mark.django_db
+    @patch(f"{COMMAND_MODULE}.AllendeAuthService")
+    @patch("sanatorio_allende.allende_api.requests.post")
+    def test_profile_writes_json_report(
+        self,
+        mock_post: Any,
+        mock_auth_service: Any,
+        tmp_path: Any,
+        patient: PacienteAllende,
+        find_appointment: FindAppointment,
+    ) -> None:
+        """Test that a profiled run reports patient, search and function timings"""
+        mock_post.return_value = type(
+            "MockResponse", (), {"status_code": 200, "json": lambda self: {}}
+        )()
+        report_path = tmp_path / "profile.json"
+
+        call_command("find_appointments", profile=str(report_path), profile_top=5)
+
+        report = json.loads(report_path.read_text())
+        assert report["patient_count"] == 1
+        assert report["upstream_calls"] == {"search": 1}
+        assert report["patients"][0]["searches"][0] == {
+            "find_appointment_id": find_appointment.id,
+            "action": "skipped",
+            "wall_seconds": report["patients"][0]["searches"][0]["wall_seconds"],
+            "upstream_calls": 1,
+        }
+        assert "search" in report["stages"]
+        assert 0 < len(report["top_functions"]) <= 5
+
+
+class TestFindAppointmentsFingerprint:
+    """Test that searches with an unchanged upstream response are not processed"""
+
+    def _slot_response(self, days: int = 5) -> Any:
+        slot = timezone.localtime(timezone.now() + datetime.timedelta(days=days))
+        data = {
+            "PrimerosTurnosDeCadaRecurso": [
+                {
+                    "Fecha": slot.strftime("%Y-%m-%dT00:00:00"),
+                    "Hora": "10:30",
+                    "DuracionIndividual": 15,
+                    "IdPlantillaTurno": 1,
+                    "IdItemDePlantilla": 2,
+                }
+            ]
+        }
+        return type(
+            "MockResponse", (), {"status_code": 200, "json": lambda self: data}
+        )()
+
+    def _run_cycle(self, command: Command) -> None:
+        FindAppointment.objects.update(next_poll_at=None)
+        command.run_cycle()
+
+    @pytest.mark.django_db
+    @patch(f"{COMMAND_MODULE}.AllendeAuthService")
+    @patch("sanatorio_allende.allende_api.requests.post")
+    def test_identical_response_skips_processing(
+        self,
+        mock_post: Any,
+        mock_auth_service: Any,
+        patient: PacienteAllende,
+        find_appointment: FindAppointment,
+    ) -> None:
+        """Test that the second identical poll skips the handler and is counted"""
+        mock_auth_service.return_value.login.return_value = patient.token
+        mock_post.return_value = self._slot_response()
+        command = Command()
+        unchanged_before = Metrics.counter_value(
+            "turnos_searches_total", action="unchanged"
+        )
+
+        with patch(
+            f"{COMMAND_MODULE}.AppointmentHandler.process_appointment",
+            wraps=AppointmentHandler.process_appointment,
+        ) as process_appointment:
+            self._run_cycle(command)
+            self._run_cycle(command)
+
+        process_appointment.assert_called_once()
+        assert BestAppointmentFound.objects.filter(patient=patient).count() == 1
+        find_appointment.refresh_from_db()
+        assert find_appointment.last_response_fingerprint
+        assert (
+            Metrics.counter_value("turnos_searches_total", action="unchanged")
+            == unchanged_before + 1
+        )
+
+    @pytest.mark.django_db
+    @patch(f"{COMMAND_MODULE}.AllendeAuthService")
+    @patch("sanatorio_allende.allende_api.requests.post")
+    def test_not_interested_change_processes_same_response_again(
+        self,
+        mock_post: Any,
+        mock_auth_service: Any,
+        client: Any,
+        patient: PacienteAllende,
+        find_appointment: FindAppointment,
+    ) -> None:
+        """Test that marking the slot as not interested resets the fingerprint"""
+        mock_auth_service.return_value.login.return_value = patient.token
+        mock_post.return_value = self._slot_response()
+        command = Command()
+        self._run_cycle(command)
+        best = BestAppointmentFound.objects.get(patient=patient)
+
+        client.patch(
+            reverse("sanatorio_allende:api_best_appointments"),
+            json.dumps({"appointment_id": best.id, "not_interested": True}),
+            content_type="application/json",
+        )
+        find_appointment.refresh_from_db()
+        assert find_appointment.last_response_fingerprint == ""
+
+        with patch(
+            f"{COMMAND_MODULE}.AppointmentHandler.process_appointment",
+            wraps=AppointmentHandler.process_appointment,
+        ) as process_appointment:
+            self._run_cycle(command)
+
+        process_appointment.assert_called_once()
+
+    @pytest.mark.django_db
+    def test_fingerprint_includes_window_status(
+        self, find_appointment: FindAppointment
+    ) -> None:
+        """Test that the same slot entering the desired window changes the fingerprint"""
+        slot = {"datetime": timezone.now() + datetime.timedelta(days=10)}
+
+        with patch(
+            "sanatorio_allende.services.search_fingerprint.AppointmentProcessor"
+            ".is_within_desired_timeframe",
+            side_effect=[False, True],
+        ):
+            outside = SearchFingerprintService.compute(find_appointment, slot)
+            inside = SearchFingerprintService.compute(find_appointment, slot)
+
+        assert outside != inside
+        assert SearchFingerprintService.compute(
+            find_appointment, None
+        ) == SearchFingerprintService.compute(find_appointment, {"datetime": None})
@@ -0,0 +1,87 @@
+from typing import Any
+from unittest.mock import patch
+
+import pytest
+from django.test import Client
+from django.urls import reverse
+
+from sanatorio_allende.allende_api import Allende
+from sanatorio_allende.metrics import STAGE_DURATION, Metrics
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics() -> None:
+    Metrics.reset()
+
+
+class TestMetrics:
+    """Test the search pipeline metrics registry"""
+
+    def test_timed_stage_is_exported_as_histogram(self) -> None:
+        """Test that timed stages are rendered in the Prometheus text format"""
+        with Metrics.timed("search"):
+            pass
+
+        page = Metrics.render()
+
+        assert f"# TYPE {STAGE_DURATION} histogram" in page
+        assert f'{STAGE_DURATION}_bucket{{stage="search",le="+Inf"}} 1' in page
+        assert f'{STAGE_DURATION}_count{{stage="search"}} 1' in page
+        assert Metrics.stage_totals()["search"][0] == 1
+
+    def test_timed_stage_counts_errors(self) -> None:
+        """Test that a failing stage is timed and counted as an error"""
+        with pytest.raises(ValueError):
+            with Metrics.timed("login"):
+                raise ValueError()
+
+        assert Metrics.counter_value("turnos_stage_errors_total", stage="login") == 1
+        assert Metrics.stage_totals()["login"][0] == 1
+
+    @patch("sanatorio_allende.allende_api.requests.post")
+    def test_search_records_stages_and_upstream_outcome(self, mock_post: Any) -> None:
+        """Test that an Allende search records the search and parse stages"""
+        mock_post.return_value = type(
+            "MockResponse", (), {"status_code": 200, "json": lambda self: {}}
+        )()
+
+        Allende("token").search_best_date_appointment({})
+
+        assert {"search", "parse"} <= set(Metrics.stage_totals())
+        assert (
+            Metrics.counter_value(
+                "turnos_allende_requests_total", endpoint="search", outcome="ok"
+            )
+            == 1
+        )
+
+    def test_write_file(self, tmp_path: Any) -> None:
+        """Test that metrics can be exported for the textfile collector"""
+        Metrics.inc("turnos_searches_total", action="created")
+        path = tmp_path / "turnos.prom"
+
+        Metrics.write_file(str(path))
+
+        assert 'turnos_searches_total{action="created"} 1' in path.read_text()
+
+
+class TestMetricsView:
+    """Test the /metrics/ endpoint"""
+
+    def test_metrics_view_serves_local_requests(self) -> None:
+        """Test that the metrics page is served to local scrapers"""
+        Metrics.inc("turnos_searches_total", action="skipped")
+
+        response = Client().get(reverse("sanatorio_allende:metrics"))
+
+        assert response.status_code == 200
+        assert response["Content-Type"].startswith("text/plain")
+        assert b'turnos_searches_total{action="skipped"} 1' in response.content
+
+    def test_metrics_view_hidden_from_remote_addresses(self) -> None:
+        """Test that the metrics page is not exposed publicly"""
+        response = Client().get(
+            reverse("sanatorio_allende:metrics"), REMOTE_ADDR="203.0.113.7"
+        )
+
+        assert response.status_code == 404
@@ -0,0 +1,162 @@
+import json
+from datetime import timedelta
+from typing import Any, Dict, List
+
+import pytest
+from conftest import (
+    TEST_DURACION_INDIVIDUAL,
+    TEST_ESPECIALIDAD_ID,
+    TEST_ITEM_PLANTILLA_ID,
+    TEST_PLANTILLA_TURNO_ID,
+    TEST_PRESTACION_ID,
+    TEST_SERVICIO_ID,
+    TEST_SUCURSAL_ID,
+    TEST_TIPO_PRESTACION_ID,
+    TEST_TIPO_RECURSO_ID,
+)
+from django.contrib.auth.models import User
+from django.urls import reverse
+from django.utils import timezone
+
+from sanatorio_allende.models import (
+    BestAppointmentFound,
+    FindAppointment,
+    PacienteAllende,
+)
+
+
+def get_json(client: Any, url: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    response = client.get(url, params)
+    assert response.status_code == 200
+    if response.streaming:
+        return json.loads(b"".join(response.streaming_content))  # type: ignore
+    return json.loads(response.content)  # type: ignore
+
+
+def fetch_pages(
+    client: Any, url: str, key: str, params: Dict[str, Any]
+) -> List[Dict[str, Any]]:
+    """Follow next_cursor until the last page and return every row"""
+    rows: List[Dict[str, Any]] = []
+    cursor = None
+    while True:
+        page = get_json(
+            client, url, {**params, **({"after": cursor} if cursor else {})}
+        )
+        rows.extend(page[key])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return rows
+
+
+class TestKeysetPagination:
+    """Test keyset pagination and streaming of the list endpoints"""
+
+    @pytest.mark.django_db
+    def test_find_appointments_pages_follow_doctor_name_order(
+        self, client: Any, patient: PacienteAllende
+    ) -> None:
+        """Test that paging returns every search once in doctor name order"""
+        FindAppointment.objects.bulk_create(
+            FindAppointment(
+                patient=patient,
+                # Repeated names, the id breaks the ties
+                doctor_name=f"Dr. {index % 3}",
+                id_servicio=TEST_SERVICIO_ID,
+                servicio="Cardiología",
+                id_sucursal=TEST_SUCURSAL_ID,
+                sucursal="Centro",
+                id_especialidad=TEST_ESPECIALIDAD_ID,
+                especialidad="Cardiología",
+                id_recurso=index,
+                id_tipo_recurso=TEST_TIPO_RECURSO_ID,
+                id_prestacion=TEST_PRESTACION_ID,
+                id_tipo_prestacion=TEST_TIPO_PRESTACION_ID,
+                nombre_tipo_prestacion="CONSULTA",
+            )
+            for index in range(7)
+        )
+        url = reverse("sanatorio_allende:api_find_appointments")
+
+        first_page = get_json(client, url, {"patient_id": patient.id, "limit": 3})
+        assert len(first_page["appointments"]) == 3
+        assert first_page["next_cursor"] is not None
+
+        rows = fetch_pages(
+            client, url, "appointments", {"patient_id": patient.id, "limit": 3}
+        )
+        expected = list(
+            FindAppointment.objects.order_by("doctor_name", "id").values_list(
+                "id", flat=True
+            )
+        )
+        assert [row["id"] for row in rows] == expected
+
+    @pytest.mark.django_db
+    def test_best_appointments_stream_matches_regular_response(
+        self, client: Any, find_appointment: FindAppointment
+    ) -> None:
+        """Test that streamed pages have the same body as the regular ones"""
+        now = timezone.now()
+        BestAppointmentFound.objects.bulk_create(
+            BestAppointmentFound(
+                appointment_wanted=find_appointment,
+                patient=find_appointment.patient,
+                datetime=now + timedelta(days=1, hours=index),
+                duracion_individual=TEST_DURACION_INDIVIDUAL,
+                id_plantilla_turno=TEST_PLANTILLA_TURNO_ID,
+                id_item_plantilla=TEST_ITEM_PLANTILLA_ID,
+            )
+            for index in range(5)
+        )
+        url = reverse("sanatorio_allende:api_best_appointments")
+        params = {"patient_id": find_appointment.patient_id}
+
+        assert get_json(client, url, {**params, "stream": 1}) == get_json(
+            client, url, params
+        )
+        paged = {**params, "limit": 2}
+        assert get_json(client, url, {**paged, "stream": 1}) == get_json(
+            client, url, paged
+        )
+        streamed_rows = fetch_pages(
+            client, url, "best_appointments", {**paged, "stream": 1}
+        )
+        assert [row["best_datetime"] for row in streamed_rows] == sorted(
+            row["best_datetime"] for row in streamed_rows
+        )
+        assert len(streamed_rows) == 5
+
+    @pytest.mark.django_db
+    def test_patients_without_parameters_are_not_paginated(
+        self, client: Any, user: User
+    ) -> None:
+        """Test that the default response keeps returning every patient"""
+        PacienteAllende.objects.bulk_create(
+            PacienteAllende(
+                user=user, name=f"Paciente {index}", docid=str(index), password="x"
+            )
+            for index in range(60)
+        )
+        url = reverse("sanatorio_allende:api_patients")
+
+        body = get_json(client, url, {})
+
+        assert len(body["patients"]) == 60
+        assert "next_cursor" not in body
+
+    @pytest.mark.django_db
+    @pytest.mark.parametrize(
+        "params",
+        [{"limit": 0}, {"limit": "ten"}, {"after": "not-a-cursor"}],
+    )
+    def test_invalid_pagination_parameters(
+        self, client: Any, params: Dict[str, Any]
+    ) -> None:
+        """Test that invalid limits and cursors are rejected"""
+        url = reverse("sanatorio_allende:api_patients")
+
+        response = client.get(url, params)
+
+        assert response.status_code == 400
+        assert json.loads(response.content)["success"] is False
@@ -0,0 +1,110 @@
+import datetime
+from typing import Any
+
+import pytest
+from django.utils import timezone
+
+from sanatorio_allende.models import FindAppointment
+from sanatorio_allende.services.polling_scheduler import PollingScheduler
+
+# Local noon, outside of the quiet hours
+NOON = timezone.make_aware(datetime.datetime(2025, 9, 1, 12, 0))
+
+
+class TestPollingScheduler:
+    """Test the adaptive per-search polling intervals"""
+
+    def _find_appointment(
+        self,
+        desired_timeframe: str = "anytime",
+        last_change_at: Any = None,
+        out_of_window_polls: int = 0,
+    ) -> FindAppointment:
+        return FindAppointment(
+            desired_timeframe=desired_timeframe,
+            last_change_at=last_change_at,
+            out_of_window_polls=out_of_window_polls,
+        )
+
+    def test_tighter_timeframes_are_polled_more_often(self) -> None:
+        """Test that short timeframes get shorter intervals"""
+        one_week = PollingScheduler.compute_interval(
+            self._find_appointment("1 week", NOON), NOON
+        )
+        anytime = PollingScheduler.compute_interval(
+            self._find_appointment("anytime", NOON), NOON
+        )
+
+        assert one_week < anytime
+
+    def test_recent_churn_shortens_interval(self) -> None:
+        """Test that searches that changed recently are polled more often"""
+        recent = PollingScheduler.compute_interval(
+            self._find_appointment("2 weeks", NOON - datetime.timedelta(hours=1)),
+            NOON,
+        )
+        stale = PollingScheduler.compute_interval(
+            self._find_appointment("2 weeks", NOON - datetime.timedelta(days=30)),
+            NOON,
+        )
+
+        assert recent < stale
+
+    def test_quiet_hours_lengthen_interval(self) -> None:
+        """Test that searches are polled less often at night"""
+        night = NOON.replace(hour=3)
+        find_appointment = self._find_appointment("2 weeks", None)
+
+        assert PollingScheduler.compute_interval(
+            find_appointment, night
+        ) > PollingScheduler.compute_interval(find_appointment, NOON)
+
+    def test_searches_without_slots_in_window_back_off(self) -> None:
+        """Test that repeated polls with nothing in the window lengthen the interval"""
+        intervals = [
+            PollingScheduler.compute_interval(
+                self._find_appointment("1 week", NOON, misses), NOON
+            )
+            for misses in (0, PollingScheduler.OUT_OF_WINDOW_STEP - 1, 6, 12, 1000)
+        ]
+
+        assert intervals[0] == intervals[1]
+        assert intervals[2] == 2 * intervals[0]
+        assert intervals[3] == 4 * intervals[0]
+        assert intervals[4] == PollingScheduler.OUT_OF_WINDOW_MAX_FACTOR * intervals[0]
+
+    @pytest.mark.django_db
+    def test_schedule_counts_out_of_window_polls(
+        self, find_appointment: FindAppointment
+    ) -> None:
+        """Test that misses accumulate and a slot in the window resets them"""
+        now = timezone.now()
+
+        PollingScheduler.schedule_next_poll(find_appointment, now, in_window=False)
+        PollingScheduler.schedule_next_poll(find_appointment, now, in_window=False)
+        PollingScheduler.schedule_next_poll(find_appointment, now)
+        find_appointment.refresh_from_db()
+        assert find_appointment.out_of_window_polls == 2
+
+        PollingScheduler.schedule_next_poll(find_appointment, now, in_window=True)
+        find_appointment.refresh_from_db()
+        assert find_appointment.out_of_window_polls == 0
+
+    @pytest.mark.django_db
+    def test_due_searches_skips_scheduled_searches(
+        self, find_appointment: FindAppointment
+    ) -> None:
+        """Test that searches scheduled in the future are not due"""
+        now = timezone.now()
+        queryset = FindAppointment.objects.filter(id=find_appointment.id)
+        assert PollingScheduler.due_searches(queryset, now).count() == 1
+
+        next_poll_at = PollingScheduler.schedule_next_poll(
+            find_appointment, now, changed=True
+        )
+
+        assert next_poll_at > now
+        assert PollingScheduler.due_searches(queryset, now).count() == 0
+        assert PollingScheduler.due_searches(queryset, next_poll_at).count() == 1
+        find_appointment.refresh_from_db()
+        assert find_appointment.last_change_at == now
@@ -0,0 +1,235 @@
+import json
+from datetime import timedelta
+from typing import Any
+from unittest.mock import patch
+
+import pytest
+from conftest import (
+    TEST_CONFIRMED_ID_TURNO,
+    TEST_DURACION_INDIVIDUAL,
+    TEST_ESPECIALIDAD_ID,
+    TEST_ITEM_PLANTILLA_ID,
+    TEST_PLANTILLA_TURNO_ID,
+    TEST_PRESTACION_ID,
+    TEST_SERVICIO_ID,
+    TEST_SUCURSAL_ID,
+    TEST_TIPO_PRESTACION_ID,
+    TEST_TIPO_RECURSO_ID,
+    QueryBudget,
+)
+from django.contrib.auth.models import User
+from django.urls import reverse
+from django.utils import timezone
+
+from sanatorio_allende.models import (
+    BestAppointmentFound,
+    DeviceRegistration,
+    FindAppointment,
+    PacienteAllende,
+)
+
+# Maximum queries per request, including the session and user lookups and the
+# savepoints of atomic blocks nested in the test transaction
+QUERY_BUDGETS = {
+    "FindAppointmentView.get": 4,
+    "BestAppointmentListView.get": 4,
+    "PatientListView.get": 3,
+    "AppointmentView.post": 8,
+    "DeviceRegistrationView.post": 6,
+}
+
+ROW_COUNTS = [1, 100, pytest.param(10000, marks=pytest.mark.slow)]
+
+
+def create_find_appointments(patient: PacienteAllende, count: int) -> None:
+    FindAppointment.objects.bulk_create(
+        FindAppointment(
+            patient=patient,
+            doctor_name=f"Dr. {index}",
+            id_servicio=TEST_SERVICIO_ID,
+            servicio="Cardiología",
+            id_sucursal=TEST_SUCURSAL_ID,
+            sucursal="Centro",
+            id_especialidad=TEST_ESPECIALIDAD_ID,
+            especialidad="Cardiología",
+            id_recurso=index,
+            id_tipo_recurso=TEST_TIPO_RECURSO_ID,
+            id_prestacion=TEST_PRESTACION_ID,
+            id_tipo_prestacion=TEST_TIPO_PRESTACION_ID,
+            nombre_tipo_prestacion="CONSULTA",
+            active=True,
+        )
+        for index in range(count)
+    )
+
+
+def create_best_appointments(
+    find_appointment: FindAppointment, count: int, offset: int = 0
+) -> None:
+    now = timezone.now()
+    BestAppointmentFound.objects.bulk_create(
+        BestAppointmentFound(
+            appointment_wanted=find_appointment,
+            patient=find_appointment.patient,
+            datetime=now + timedelta(days=1, minutes=offset + index),
+            duracion_individual=TEST_DURACION_INDIVIDUAL,
+            id_plantilla_turno=TEST_PLANTILLA_TURNO_ID,
+            id_item_plantilla=TEST_ITEM_PLANTILLA_ID,
+            # Prebuilt by the search worker, confirming is a single upstream call
+            booking_payload={"TurnoElegidoDto": {"IdItemDePlantilla": index}},
+        )
+        for index in range(count)
+    )
+
+
+class TestQueryBudgets:
+    """
+    Check that the API views stay within their query budget
+
+    Each endpoint is measured with one row and again with N rows, the number
+    of queries must be within the budget and must not grow with N.
+    """
+
+    @pytest.mark.django_db
+    @pytest.mark.parametrize("rows", ROW_COUNTS)
+    def test_find_appointment_list(
+        self, rows: int, client: Any, patient: PacienteAllende
+    ) -> None:
+        """Test the queries of listing the searches of a patient"""
+        url = reverse("sanatorio_allende:api_find_appointments")
+        endpoint = "FindAppointmentView.get"
+
+        create_find_appointments(patient, 1)
+        with QueryBudget(endpoint, 1) as baseline:
+            response = client.get(url, {"patient_id": patient.id})
+        assert response.status_code == 200
+
+        create_find_appointments(patient, rows - 1)
+        with QueryBudget(endpoint, rows) as measured:
+            response = client.get(url, {"patient_id": patient.id})
+        assert len(json.loads(response.content)["appointments"]) == rows
+
+        measured.assert_within(QUERY_BUDGETS[endpoint], baseline)
+
+    @pytest.mark.django_db
+    @pytest.mark.parametrize("rows", ROW_COUNTS)
+    def test_best_appointment_list(
+        self, rows: int, client: Any, find_appointment: FindAppointment
+    ) -> None:
+        """Test the queries of listing the appointments found for a patient"""
+        url = reverse("sanatorio_allende:api_best_appointments")
+        endpoint = "BestAppointmentListView.get"
+        patient_id = find_appointment.patient_id
+
+        create_best_appointments(find_appointment, 1)
+        with QueryBudget(endpoint, 1) as baseline:
+            response = client.get(url, {"patient_id": patient_id})
+        assert response.status_code == 200
+
+        create_best_appointments(find_appointment, rows - 1, offset=1)
+        with QueryBudget(endpoint, rows) as measured:
+            response = client.get(url, {"patient_id": patient_id})
+        assert len(json.loads(response.content)["best_appointments"]) == rows
+
+        measured.assert_within(QUERY_BUDGETS[endpoint], baseline)
+
+    @pytest.mark.django_db
+    @pytest.mark.parametrize("rows", ROW_COUNTS)
+    def test_patient_list(self, rows: int, client: Any, user: User) -> None:
+        """Test the queries of listing the patients of a user"""
+        url = reverse("sanatorio_allende:api_patients")
+        endpoint = "PatientListView.get"
+
+        def create_patients(count: int, offset: int = 0) -> None:
+            PacienteAllende.objects.bulk_create(
+                PacienteAllende(
+                    user=user,
+                    name=f"Paciente {offset + index}",
+                    docid=str(offset + index),
+                    password="testpass123",
+                )
+                for index in range(count)
+            )
+
+        create_patients(1)
+        with QueryBudget(endpoint, 1) as baseline:
+            response = client.get(url)
+        assert response.status_code == 200
+
+        create_patients(rows - 1, offset=1)
+        with QueryBudget(endpoint, rows) as measured:
+            response = client.get(url)
+        assert len(json.loads(response.content)["patients"]) == rows
+
+        measured.assert_within(QUERY_BUDGETS[endpoint], baseline)
+
+    @pytest.mark.django_db
+    @pytest.mark.parametrize("rows", ROW_COUNTS)
+    @patch("sanatorio_allende.allende_api.requests.post")
+    def test_appointment_confirm(
+        self,
+        mock_post: Any,
+        rows: int,
+        client: Any,
+        find_appointment: FindAppointment,
+    ) -> None:
+        """Test the queries of confirming one of many appointments found"""
+        mock_post.return_value = type(
+            "MockResponse",
+            (),
+            {
+                "status_code": 200,
+                "json": lambda self: {"Entidad": {"Id": TEST_CONFIRMED_ID_TURNO}},
+            },
+        )()
+        url = reverse("sanatorio_allende:api_appointment")
+        endpoint = "AppointmentView.post"
+
+        def confirm(appointment_id: int) -> Any:
+            return client.post(
+                url,
+                json.dumps({"appointment_id": appointment_id}),
+                content_type="application/json",
+            )
+
+        create_best_appointments(find_appointment, 1)
+        first = BestAppointmentFound.objects.get()
+        with QueryBudget(endpoint, 1) as baseline:
+            response = confirm(first.id)
+        assert response.status_code == 200
+
+        create_best_appointments(find_appointment, rows, offset=1)
+        last = BestAppointmentFound.objects.latest("id")
+        with QueryBudget(endpoint, rows) as measured:
+            response = confirm(last.id)
+        assert response.status_code == 200
+
+        measured.assert_within(QUERY_BUDGETS[endpoint], baseline)
+
+    @pytest.mark.django_db
+    @pytest.mark.parametrize("rows", ROW_COUNTS)
+    def test_device_registration(self, rows: int, client: Any, user: User) -> None:
+        """Test the queries of registering a device for a user with many devices"""
+        url = reverse("sanatorio_allende:api_register_device")
+        endpoint = "DeviceRegistrationView.post"
+
+        def register(push_token: str) -> Any:
+            return client.post(
+                url,
+                json.dumps({"push_token": push_token}),
+                content_type="application/json",
+            )
+
+        with QueryBudget(endpoint, 1) as baseline:
+            response = register("ExponentPushToken[baseline]")
+        assert response.status_code == 200
+
+        DeviceRegistration.objects.bulk_create(
+            DeviceRegistration(user=user, push_token=f"ExponentPushToken[{index}]")
+            for index in range(rows - 1)
+        )
+        with QueryBudget(endpoint, rows) as measured:
+            response = register("ExponentPushToken[new]")
+        assert response.status_code == 200
+
+        measured.assert_within(QUERY_BUDGETS[endpoint], baseline)
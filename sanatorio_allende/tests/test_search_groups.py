@@ -0,0 +1,182 @@
+import datetime
+from typing import Any, List
+from unittest.mock import patch
+
+import pytest
+import requests
+from conftest import TEST_RECURSO_ID
+from django.test import override_settings
+from django.utils import timezone
+
+from sanatorio_allende.allende_api import Allende
+from sanatorio_allende.management.commands.find_appointments import Command
+from sanatorio_allende.models import (
+    BestAppointmentFound,
+    FindAppointment,
+    PacienteAllende,
+)
+from sanatorio_allende.services.search_groups import (
+    ANY_RESOURCE,
+    SearchGroupService,
+)
+
+COMMAND_MODULE = "sanatorio_allende.management.commands.find_appointments"
+OTHER_RECURSO_ID = TEST_RECURSO_ID + 1
+
+
+def slots_response(slots: List[dict]) -> Any:
+    data = {"PrimerosTurnosDeCadaRecurso": slots}
+    return type("MockResponse", (), {"status_code": 200, "json": lambda self: data})()
+
+
+def slot(id_recurso: int, days: int, hora: str = "10:30") -> dict:
+    day = timezone.localtime(timezone.now() + datetime.timedelta(days=days))
+    return {
+        "Fecha": day.strftime("%Y-%m-%dT00:00:00"),
+        "Hora": hora,
+        "DuracionIndividual": 20,
+        "IdPlantillaTurno": 100 + id_recurso,
+        "IdItemDePlantilla": 200 + id_recurso,
+        "IdRecurso": id_recurso,
+    }
+
+
+@pytest.fixture
+def other_doctor_search(find_appointment: FindAppointment) -> FindAppointment:
+    """Same specialty, branch and service as find_appointment, another doctor"""
+    other = FindAppointment.objects.get(id=find_appointment.id)
+    other.pk = None
+    other.id_recurso = OTHER_RECURSO_ID
+    other.doctor_name = "Dra. Ana Gómez"
+    other.save()
+    return other
+
+
+class TestSearchGroups:
+    """Test polling the searches of a specialty and branch with one request"""
+
+    @pytest.mark.django_db
+    def test_group_by_everything_but_the_doctor(
+        self, find_appointment: FindAppointment, other_doctor_search: FindAppointment
+    ) -> None:
+        """Test that searches only differing in the doctor share a group"""
+        other_branch = FindAppointment.objects.get(id=find_appointment.id)
+        other_branch.pk = None
+        other_branch.id_sucursal += 1
+        other_branch.save()
+
+        groups = SearchGroupService.group(
+            [find_appointment, other_branch, other_doctor_search]
+        )
+
+        assert [[member.id for member in group.members] for group in groups] == [
+            [find_appointment.id, other_doctor_search.id],
+            [other_branch.id],
+        ]
+
+    @pytest.mark.django_db
+    @patch("sanatorio_allende.allende_api.requests.post")
+    def test_fetch_group_splits_response_by_doctor(
+        self,
+        mock_post: Any,
+        patient: PacienteAllende,
+        find_appointment: FindAppointment,
+        other_doctor_search: FindAppointment,
+    ) -> None:
+        """Test that each doctor gets its earliest slot and missing ones none"""
+        mock_post.return_value = slots_response(
+            [slot(TEST_RECURSO_ID, 9), slot(TEST_RECURSO_ID, 4), slot(99, 1)]
+        )
+        group = SearchGroupService.group([find_appointment, other_doctor_search])[0]
+
+        answered = SearchGroupService.fetch_group(Allende("token"), patient, group)
+
+        assert answered[other_doctor_search.id] is None
+        first_slot = answered[find_appointment.id]
+        assert first_slot is not None
+        assert first_slot["datetime"].date() == (
+            timezone.localtime(timezone.now() + datetime.timedelta(days=4)).date()
+        )
+        assert mock_post.call_args.kwargs["json"]["IdRecurso"] == ANY_RESOURCE
+
+    @pytest.mark.django_db
+    @patch("sanatorio_allende.allende_api.requests.post")
+    def test_fetch_group_failure_falls_back(
+        self,
+        mock_post: Any,
+        patient: PacienteAllende,
+        find_appointment: FindAppointment,
+        other_doctor_search: FindAppointment,
+    ) -> None:
+        """Test that a failed grouped request leaves every search to its own request"""
+        mock_post.side_effect = requests.ConnectionError("reset")
+        group = SearchGroupService.group([find_appointment, other_doctor_search])[0]
+
+        assert SearchGroupService.fetch_group(Allende("token"), patient, group) == {}
+
+    @pytest.mark.django_db
+    @override_settings(SEARCH_GROUPS_ENABLED=True)
+    @patch(f"{COMMAND_MODULE}.AllendeAuthService")
+    @patch("sanatorio_allende.allende_api.requests.post")
+    def test_cycle_uses_one_request_for_doctors_with_slots(
+        self,
+        mock_post: Any,
+        mock_auth_service: Any,
+        patient: PacienteAllende,
+        find_appointment: FindAppointment,
+        other_doctor_search: FindAppointment,
+    ) -> None:
+        """Test that a group with slots for every doctor is searched once"""
+        mock_auth_service.return_value.login.return_value = patient.token
+        mock_post.return_value = slots_response(
+            [slot(TEST_RECURSO_ID, 3), slot(OTHER_RECURSO_ID, 6)]
+        )
+
+        Command().run_cycle()
+
+        search_calls = [
+            call
+            for call in mock_post.call_args_list
+            if "ObtenerPrimerTurnoAsignable" in call.args[0]
+        ]
+        assert len(search_calls) == 1
+        best = {
+            best.appointment_wanted_id: best.id_plantilla_turno
+            for best in BestAppointmentFound.objects.filter(patient=patient)
+        }
+        assert best == {
+            find_appointment.id: 100 + TEST_RECURSO_ID,
+            other_doctor_search.id: 100 + OTHER_RECURSO_ID,
+        }
+
+    @pytest.mark.django_db
+    @override_settings(SEARCH_GROUPS_ENABLED=True)
+    @patch(f"{COMMAND_MODULE}.AllendeAuthService")
+    @patch("sanatorio_allende.allende_api.requests.post")
+    def test_cycle_treats_doctor_missing_from_answer_as_no_slot(
+        self,
+        mock_post: Any,
+        mock_auth_service: Any,
+        patient: PacienteAllende,
+        find_appointment: FindAppointment,
+        other_doctor_search: FindAppointment,
+        best_appointment_found: BestAppointmentFound,
+    ) -> None:
+        """Test that a doctor without slots is not searched again on its own"""
+        mock_auth_service.return_value.login.return_value = patient.token
+        mock_post.return_value = slots_response([slot(OTHER_RECURSO_ID, 6)])
+
+        Command().run_cycle()
+
+        search_calls = [
+            call
+            for call in mock_post.call_args_list
+            if "ObtenerPrimerTurnoAsignable" in call.args[0]
+        ]
+        assert len(search_calls) == 1
+        assert not BestAppointmentFound.objects.filter(
+            appointment_wanted=find_appointment
+        ).exists()
+        assert BestAppointmentFound.objects.filter(
+            appointment_wanted=other_doctor_search
+        ).exists()
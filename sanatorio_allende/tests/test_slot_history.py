@@ -0,0 +1,261 @@
+import datetime
+from typing import Any, List, Optional
+from unittest.mock import patch
+
+import pytest
+from conftest import TEST_RECURSO_ID
+from django.db import DatabaseError, connection
+from django.urls import reverse
+from django.utils import timezone
+
+from sanatorio_allende.management.commands.find_appointments import Command
+from sanatorio_allende.models import (
+    FindAppointment,
+    PacienteAllende,
+    SlotObservation,
+)
+from sanatorio_allende.repositories.slot_observation_repository import (
+    SlotObservationRepository,
+)
+from sanatorio_allende.services.slot_analytics import SlotAnalyticsService
+
+COMMAND_MODULE = "sanatorio_allende.management.commands.find_appointments"
+REPOSITORY_MODULE = "sanatorio_allende.repositories.slot_observation_repository"
+TEST_SERVICIO_ID = 7
+
+
+def local_time(days: int, hour: int) -> datetime.datetime:
+    """A moment at an hour of the local day, days from now"""
+    day = timezone.localtime(timezone.now()) + datetime.timedelta(days=days)
+    return day.replace(hour=hour, minute=0, second=0, microsecond=0)
+
+
+def observe(
+    find_appointment_id: int,
+    observations: List[tuple],
+    id_recurso: int = TEST_RECURSO_ID,
+) -> None:
+    """Write (observed_at, slot_datetime) observations of a search"""
+    SlotObservationRepository.record(
+        [
+            SlotObservation(
+                observed_at=observed_at,
+                find_appointment_id=find_appointment_id,
+                id_servicio=TEST_SERVICIO_ID,
+                id_recurso=id_recurso,
+                slot_datetime=slot_datetime,
+            )
+            for observed_at, slot_datetime in observations
+        ]
+    )
+
+
+def slot_response(days: Optional[int]) -> Any:
+    slots = []
+    if days is not None:
+        slot = timezone.localtime(timezone.now() + datetime.timedelta(days=days))
+        slots.append(
+            {
+                "Fecha": slot.strftime("%Y-%m-%dT00:00:00"),
+                "Hora": "10:30",
+                "DuracionIndividual": 15,
+                "IdPlantillaTurno": 1,
+                "IdItemDePlantilla": 2,
+            }
+        )
+    data = {"PrimerosTurnosDeCadaRecurso": slots}
+    return type("MockResponse", (), {"status_code": 200, "json": lambda self: data})()
+
+
+class TestSlotHistory:
+    """Test the slot observation log and the release analytics built on it"""
+
+    @pytest.mark.django_db
+    def test_releases_and_lifetimes(self) -> None:
+        """Test that earlier slots are releases and the time until they vanish is kept"""
+        late_slot = local_time(20, 10)
+        early_slot = local_time(5, 9)
+        observe(
+            1,
+            [
+                # First sight of the search, not a release
+                (local_time(-6, 6), late_slot),
+                (local_time(-5, 7), early_slot),
+                # Taken 30 minutes later
+                (local_time(-5, 7) + datetime.timedelta(minutes=30), late_slot),
+                (local_time(-4, 8), None),
+                (local_time(-3, 7), late_slot),
+            ],
+        )
+        observe(2, [(local_time(-2, 6), late_slot)], id_recurso=TEST_RECURSO_ID + 1)
+
+        releases = SlotAnalyticsService.releases(TEST_RECURSO_ID)
+
+        assert [release.slot_datetime for release in releases] == [
+            early_slot,
+            late_slot,
+        ]
+        assert releases[0].lifetime_minutes == 30
+        assert releases[1].lifetime_minutes is None
+
+        histogram = SlotAnalyticsService.release_histogram(TEST_RECURSO_ID)
+        assert histogram.releases == 2
+        assert histogram.by_hour[7] == 2
+        assert sum(histogram.by_weekday) == 2
+        assert histogram.median_lifetime_minutes == 30
+        assert SlotAnalyticsService.peak_hours(histogram) == [(7, 2)]
+
+    @pytest.mark.django_db
+    def test_purge_drops_expired_observations(self) -> None:
+        """Test that observations older than the retention are removed"""
+        now = timezone.now()
+        observe(
+            1,
+            [
+                (now - datetime.timedelta(days=500), None),
+                (now - datetime.timedelta(days=1), None),
+            ],
+        )
+
+        SlotObservationRepository.purge(now)
+
+        assert SlotObservation.objects.count() == 1
+
+    @pytest.mark.django_db
+    def test_failed_partition_creation_still_purges(self) -> None:
+        """Test that expired observations are dropped while partitions fail"""
+        now = timezone.now()
+        month = SlotObservationRepository._month_start(now)
+        with patch.object(
+            SlotObservationRepository, "_prepared_months", set()
+        ), patch.object(SlotObservationRepository, "_purged_months", set()), patch(
+            f"{REPOSITORY_MODULE}.connection"
+        ) as mock_connection, patch.object(
+            SlotObservationRepository,
+            "create_partition",
+            side_effect=DatabaseError("rows in the default partition"),
+        ) as mock_create, patch.object(
+            SlotObservationRepository, "purge"
+        ) as mock_purge:
+            mock_connection.vendor = "postgresql"
+            SlotObservationRepository.prepare(now)
+            SlotObservationRepository.prepare(now)
+
+            assert mock_purge.call_count == 1
+            # Creating the partitions is retried on the next write
+            assert mock_create.call_count == 2
+            assert (
+                month.year,
+                month.month,
+            ) not in SlotObservationRepository._prepared_months
+
+    @pytest.mark.django_db
+    @patch(f"{COMMAND_MODULE}.AllendeAuthService")
+    @patch("sanatorio_allende.allende_api.requests.post")
+    def test_cycle_logs_only_slot_changes(
+        self,
+        mock_post: Any,
+        mock_auth_service: Any,
+        patient: PacienteAllende,
+        find_appointment: FindAppointment,
+    ) -> None:
+        """Test that a search cycle logs its first slot when it changes"""
+        mock_auth_service.return_value.login.return_value = patient.token
+        command = Command()
+
+        for days in (9, 9, 4):
+            mock_post.return_value = slot_response(days)
+            FindAppointment.objects.update(next_poll_at=None)
+            command.run_cycle()
+
+        observations = list(
+            SlotObservation.objects.filter(
+                find_appointment_id=find_appointment.id
+            ).order_by("observed_at")
+        )
+        assert len(observations) == 2
+        assert observations[0].id_recurso == find_appointment.id_recurso
+        assert observations[0].id_servicio == find_appointment.id_servicio
+        assert observations[0].slot_datetime is not None
+        assert observations[1].slot_datetime is not None
+        assert observations[1].slot_datetime < observations[0].slot_datetime
+
+    @pytest.mark.django_db
+    def test_release_stats_endpoint(self, client: Any) -> None:
+        """Test the release-time histogram of a doctor over the API"""
+        observe(
+            1,
+            [
+                (local_time(-3, 6), local_time(10, 10)),
+                (local_time(-2, 7), local_time(4, 10)),
+            ],
+        )
+        url = reverse("sanatorio_allende:api_doctor_release_stats")
+
+        response = client.get(url, {"id_recurso": TEST_RECURSO_ID, "days": 30})
+        missing = client.get(url)
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["releases"] == 1
+        assert data["by_hour"][7] == 1
+        assert data["peak_hours"] == [{"hour": 7, "releases": 1}]
+        assert missing.status_code == 400
+
+    @pytest.mark.skipif(
+        connection.vendor != "postgresql", reason="Partitioning requires PostgreSQL"
+    )
+    @pytest.mark.django_db
+    def test_monthly_partitions(self) -> None:
+        """Test that observations go to monthly partitions and expired ones are dropped"""
+        now = timezone.now()
+        expired = SlotObservationRepository.retention_cutoff(now) - datetime.timedelta(
+            days=1
+        )
+        SlotObservationRepository.create_partition(
+            SlotObservationRepository._month_start(expired)
+        )
+        observe(1, [(now, None)])
+
+        partitions = [name for name, _ in SlotObservationRepository.partitions()]
+        this_month = SlotObservationRepository._month_start(now)
+        assert SlotObservationRepository._partition_name(this_month) in partitions
+
+        SlotObservationRepository.purge(now)
+
+        partitions = [name for name, _ in SlotObservationRepository.partitions()]
+        assert (
+            SlotObservationRepository._partition_name(
+                SlotObservationRepository._month_start(expired)
+            )
+            not in partitions
+        )
+        assert SlotObservation.objects.count() == 1
+
+    @pytest.mark.skipif(
+        connection.vendor != "postgresql", reason="Partitioning requires PostgreSQL"
+    )
+    @pytest.mark.django_db
+    def test_partition_takes_rows_from_default_partition(self) -> None:
+        """Test that a month written to the default partition still gets its own"""
+        month = SlotObservationRepository._add_months(
+            SlotObservationRepository._month_start(timezone.now()), 3
+        )
+        SlotObservation.objects.create(
+            observed_at=month + datetime.timedelta(days=2),
+            find_appointment_id=1,
+            id_servicio=TEST_SERVICIO_ID,
+            id_recurso=TEST_RECURSO_ID,
+        )
+
+        SlotObservationRepository.create_partition(month)
+
+        name = SlotObservationRepository._partition_name(month)
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT count(*) FROM {name}")
+            assert cursor.fetchone()[0] == 1
+            cursor.execute(
+                f"SELECT count(*) FROM {SlotObservationRepository.DEFAULT_PARTITION}"
+            )
+            assert cursor.fetchone()[0] == 0
+        assert SlotObservation.objects.count() == 1
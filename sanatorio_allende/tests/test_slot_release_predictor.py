@@ -0,0 +1,163 @@
+import datetime
+import json
+from io import StringIO
+from typing import Any, List
+
+import pytest
+from conftest import TEST_RECURSO_ID
+from django.core.management import call_command
+from django.test import override_settings
+from django.utils import timezone
+
+from sanatorio_allende.models import FindAppointment, SlotObservation
+from sanatorio_allende.repositories.slot_observation_repository import (
+    SlotObservationRepository,
+)
+from sanatorio_allende.services.polling_scheduler import PollingScheduler
+from sanatorio_allende.services.slot_analytics import SlotRelease
+from sanatorio_allende.services.slot_release_predictor import SlotReleasePredictor
+
+TEST_SERVICIO_ID = 1
+
+
+def this_monday() -> datetime.datetime:
+    """Midnight (local time) of the Monday of the current week"""
+    today = timezone.localtime(timezone.now())
+    monday = today - datetime.timedelta(days=today.weekday())
+    return monday.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def record_monday_releases(weeks: List[int], id_servicio: int) -> None:
+    """
+    Log a slot released on Monday at 07:05 and taken 5 minutes later
+
+    Args:
+        weeks: Weeks before the current one with a release
+        id_servicio: Service of the logged search
+    """
+    observations = []
+    for week in weeks:
+        monday = this_monday() - datetime.timedelta(weeks=week)
+        late_slot = monday + datetime.timedelta(days=60)
+        early_slot = monday + datetime.timedelta(days=20)
+        for observed_at, slot_datetime in (
+            (monday + datetime.timedelta(hours=6), late_slot),
+            (monday + datetime.timedelta(hours=7, minutes=5), early_slot),
+            (monday + datetime.timedelta(hours=7, minutes=10), late_slot),
+        ):
+            observations.append(
+                SlotObservation(
+                    observed_at=observed_at,
+                    find_appointment_id=1,
+                    id_servicio=id_servicio,
+                    id_recurso=TEST_RECURSO_ID,
+                    slot_datetime=slot_datetime,
+                )
+            )
+    SlotObservationRepository.record(observations)
+
+
+class TestSlotReleasePredictor:
+    """Test predicting release windows and polling around them"""
+
+    def test_fit_finds_weekly_release_window(self) -> None:
+        """Test that a release most weeks in the same half hour becomes a window"""
+        monday = this_monday()
+        releases = [
+            SlotRelease(
+                1,
+                monday - datetime.timedelta(weeks=week, hours=-7, minutes=-5),
+                monday + datetime.timedelta(days=week),
+            )
+            for week in range(1, 6)
+        ]
+        # A one-off release on a Thursday is not a pattern
+        releases.append(
+            SlotRelease(
+                1,
+                monday - datetime.timedelta(days=4, hours=-15),
+                monday + datetime.timedelta(days=30),
+            )
+        )
+
+        model = SlotReleasePredictor.fit(
+            TEST_RECURSO_ID,
+            None,
+            releases,
+            monday - datetime.timedelta(weeks=6),
+            monday,
+        )
+
+        assert [window.describe() for window in model.windows] == ["Mon 07:00"]
+        assert model.windows[0].releases == 5
+        assert model.window_at(monday + datetime.timedelta(hours=6, minutes=55))
+        assert model.window_at(monday + datetime.timedelta(hours=7, minutes=35)) is None
+        assert model.next_window_start(
+            monday + datetime.timedelta(hours=8)
+        ) == monday + datetime.timedelta(days=7, hours=6, minutes=50)
+
+    @pytest.mark.django_db
+    @override_settings(SLOT_PREDICTION_ENABLED=True, POLL_MIN_INTERVAL_SECONDS=60)
+    def test_scheduler_bursts_around_predicted_windows(
+        self, find_appointment: FindAppointment
+    ) -> None:
+        """Test that searches are polled fast in a window and slowly elsewhere"""
+        record_monday_releases([1, 2, 3, 4, 5], find_appointment.id_servicio)
+        monday = this_monday() + datetime.timedelta(weeks=1)
+
+        in_window = PollingScheduler.compute_interval(
+            find_appointment, monday + datetime.timedelta(hours=7, minutes=5)
+        )
+        before_window = PollingScheduler.compute_interval(
+            find_appointment, monday + datetime.timedelta(hours=6, minutes=40)
+        )
+        outside = PollingScheduler.compute_interval(
+            find_appointment, monday + datetime.timedelta(hours=12)
+        )
+        with override_settings(SLOT_PREDICTION_ENABLED=False):
+            without_model = PollingScheduler.compute_interval(
+                find_appointment, monday + datetime.timedelta(hours=12)
+            )
+
+        assert in_window == datetime.timedelta(seconds=60)
+        assert before_window == datetime.timedelta(minutes=10)
+        assert outside == without_model * PollingScheduler.OUTSIDE_RELEASE_WINDOW_FACTOR
+
+    @pytest.mark.django_db
+    @override_settings(SLOT_PREDICTION_ENABLED=True)
+    def test_scheduler_unchanged_without_windows(
+        self, find_appointment: FindAppointment
+    ) -> None:
+        """Test that doctors without a release pattern keep the adaptive interval"""
+        now = this_monday() + datetime.timedelta(hours=12)
+        with override_settings(SLOT_PREDICTION_ENABLED=False):
+            without_model = PollingScheduler.compute_interval(find_appointment, now)
+
+        assert PollingScheduler.compute_interval(find_appointment, now) == without_model
+
+    @pytest.mark.django_db
+    def test_offline_evaluation_command(self, tmp_path: Any) -> None:
+        """Test that predictive polling catches more releases per request"""
+        record_monday_releases(list(range(0, 8)), TEST_SERVICIO_ID)
+        output = tmp_path / "predictor.json"
+        out = StringIO()
+
+        call_command(
+            "evaluate_release_predictor",
+            "--train-days",
+            "42",
+            "--test-days",
+            "14",
+            "--output",
+            str(output),
+            stdout=out,
+        )
+
+        results = json.loads(output.read_text())
+        assert results["doctors"][0]["windows"] == ["Mon 07:00"]
+        fixed, predictive = results["fixed"], results["predictive"]
+        assert predictive["caught"] == predictive["releases"] > 0
+        assert (
+            predictive["catches_per_1000_requests"] > fixed["catches_per_1000_requests"]
+        )
+        assert "Catches per 1000 requests" in out.getvalue()
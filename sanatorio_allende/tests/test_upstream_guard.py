@@ -0,0 +1,139 @@
+import time
+from typing import Any
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+from django.test import override_settings
+
+from sanatorio_allende.allende_api import Allende
+from sanatorio_allende.upstream_guard import (
+    CircuitBreaker,
+    CircuitOpenException,
+    RateLimitedException,
+    TokenBucket,
+    UpstreamGuard,
+)
+
+FAST_FAILING_LIMITS = {
+    "default": {
+        "failure_threshold": 2,
+        "recovery_timeout": 60,
+        "timeout": 3,
+    }
+}
+
+
+def _response(status_code: int) -> Any:
+    return type(
+        "MockResponse",
+        (),
+        {"status_code": status_code, "json": lambda self: {}},
+    )()
+
+
+class TestTokenBucket:
+    """Test the token bucket rate limiter"""
+
+    def test_bucket_fails_fast_when_wait_exceeds_limit(self) -> None:
+        """Test that callers are rejected instead of queueing for too long"""
+        bucket = TokenBucket(rate=1.0, capacity=2)
+
+        assert bucket.acquire(max_wait=0)
+        assert bucket.acquire(max_wait=0)
+        assert not bucket.acquire(max_wait=0)
+
+
+class TestCircuitBreaker:
+    """Test the circuit breaker state machine"""
+
+    def test_half_open_probe_closes_circuit_on_success(self) -> None:
+        """Test that the circuit lets one probe through after recovery"""
+        breaker = CircuitBreaker(
+            "search", failure_threshold=1, recovery_timeout=0, half_open_max_calls=1
+        )
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+
+        assert breaker.allow()
+        assert not breaker.allow()
+        breaker.record_success()
+
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert breaker.allow()
+
+    def test_half_open_probe_released_on_unexpected_error(self) -> None:
+        """Test that a probe failing outside the HTTP call does not wedge the circuit"""
+        guard = UpstreamGuard.get("search")
+        guard.breaker.recovery_timeout = 0
+        guard.breaker.state = CircuitBreaker.OPEN
+
+        with pytest.raises(ValueError):
+            UpstreamGuard.call("search", MagicMock(side_effect=ValueError()), "url")
+
+        assert guard.breaker.state == CircuitBreaker.HALF_OPEN
+        assert guard.breaker.allow()
+
+
+class TestAllendeUpstreamGuard:
+    """Test the guards wrapped around the Allende endpoints"""
+
+    @override_settings(ALLENDE_UPSTREAM_LIMITS=FAST_FAILING_LIMITS)
+    @patch("sanatorio_allende.allende_api.requests.post")
+    def test_search_circuit_opens_after_server_errors(self, mock_post: Any) -> None:
+        """Test that a failing endpoint is no longer called once the circuit opens"""
+        mock_post.return_value = _response(503)
+        allende = Allende("token")
+
+        for _ in range(2):
+            allende.search_best_date_appointment({})
+
+        with pytest.raises(CircuitOpenException):
+            allende.search_best_date_appointment({})
+        assert mock_post.call_count == 2
+        # Other endpoints have their own circuit
+        mock_post.return_value = _response(200)
+        assert allende.get_doctors("cardio") == {}
+
+    @override_settings(ALLENDE_UPSTREAM_LIMITS=FAST_FAILING_LIMITS)
+    @patch("sanatorio_allende.allende_api.requests.post")
+    def test_upstream_calls_use_configured_timeout(self, mock_post: Any) -> None:
+        """Test that upstream calls can no longer hang forever"""
+        mock_post.side_effect = requests.Timeout()
+
+        with pytest.raises(requests.Timeout):
+            Allende("token").search_best_date_appointment({})
+
+        assert mock_post.call_args[1]["timeout"] == 3
+
+    @override_settings(
+        ALLENDE_UPSTREAM_LIMITS={"book": {"rate": 0.001, "burst": 1, "max_wait": 0}}
+    )
+    def test_rate_limited_call_is_rejected(self) -> None:
+        """Test that calls beyond the rate limit fail without reaching Allende"""
+        func = MagicMock(return_value=_response(200))
+
+        UpstreamGuard.call("book", func, "url")
+        with pytest.raises(RateLimitedException):
+            UpstreamGuard.call("book", func, "url")
+
+        func.assert_called_once()
+
+    @override_settings(
+        ALLENDE_UPSTREAM_LIMITS={
+            "book": {"rate": 0.001, "burst": 1, "max_wait": 0, "recovery_timeout": 60}
+        }
+    )
+    def test_open_circuit_does_not_use_request_slots(self) -> None:
+        """Test that calls rejected by an open circuit keep the rate limit tokens"""
+        func = MagicMock(return_value=_response(200))
+        guard = UpstreamGuard.get("book")
+        guard.breaker.state = CircuitBreaker.OPEN
+        guard.breaker.opened_at = time.monotonic()
+
+        with pytest.raises(CircuitOpenException):
+            UpstreamGuard.call("book", func, "url")
+
+        guard.breaker.state = CircuitBreaker.CLOSED
+        UpstreamGuard.call("book", func, "url")
+        func.assert_called_once()
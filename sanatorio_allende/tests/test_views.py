@@ -31,6 +31,10 @@ from sanatorio_allende.models import (
     FindAppointment,
     PacienteAllende,
 )
+from sanatorio_allende.repositories.best_appointment_repository import (
+    BestAppointmentRepository,
+)
+from sanatorio_allende.services.appointment_booking import AppointmentBookingService
 
 
 class TestDoctorListView:
@@ -1265,6 +1269,56 @@ class TestConfirmAppointmentView:
             "Observaciones": None,
         }
 
+    @pytest.mark.django_db
+    @patch("sanatorio_allende.allende_api.requests.post")
+    def test_post_confirm_appointment_uses_prebuilt_payload(
+        self,
+        mock_post: Any,
+        client: Any,
+        find_appointment: Any,
+        patient: Any,
+    ) -> None:
+        """Test that the payload materialized by the repository is sent as is"""
+        mock_post.return_value = type(
+            "MockResponse",
+            (),
+            {
+                "status_code": 200,
+                "json": lambda self: {"Entidad": {"Id": TEST_CONFIRMED_ID_TURNO}},
+            },
+        )()
+        best_appointment = BestAppointmentRepository.create_best_appointment(
+            find_appointment,
+            patient,
+            timezone.now() + timedelta(days=1),
+            duracion_individual=TEST_DURACION_INDIVIDUAL,
+            id_plantilla_turno=TEST_PLANTILLA_TURNO_ID,
+            id_item_plantilla=TEST_ITEM_PLANTILLA_ID,
+        )
+        assert best_appointment.booking_payload is not None
+
+        url = reverse("sanatorio_allende:api_appointment")
+        data = {"appointment_id": best_appointment.id}
+        response = client.post(url, json.dumps(data), content_type="application/json")
+
+        assert response.status_code == 200
+        assert mock_post.call_args[1]["json"] == best_appointment.booking_payload
+
+    @pytest.mark.django_db
+    def test_booking_payload_invalidated_on_coverage_change(
+        self, find_appointment: Any, patient: Any
+    ) -> None:
+        """Test that payloads are dropped when the patient coverage changes"""
+        best_appointment = BestAppointmentRepository.create_best_appointment(
+            find_appointment, patient, timezone.now() + timedelta(days=1)
+        )
+        assert best_appointment.booking_payload is not None
+
+        AppointmentBookingService.invalidate_booking_payloads(patient_id=patient.id)
+
+        best_appointment.refresh_from_db()
+        assert best_appointment.booking_payload is None
+
 
 class TestAppointmentViewDelete:
     """Test cases for AppointmentView delete endpoint"""
@@ -0,0 +1,84 @@
+import datetime
+from typing import List
+
+import pytest
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from sanatorio_allende.models import FindAppointment, PacienteAllende
+from sanatorio_allende.services.work_lease import PatientLeaseService
+
+LEASE_SECONDS = 300
+
+
+class TestPatientLeaseService:
+    """Test the lease-based split of patients between search workers"""
+
+    def _patients_with_searches(
+        self, user: User, find_appointment: FindAppointment, count: int
+    ) -> List[PacienteAllende]:
+        patients = []
+        for index in range(count):
+            patient = PacienteAllende.objects.create(
+                user=user, name=f"Paciente {index}", docid=str(index), password="x"
+            )
+            find_appointment.pk = None
+            find_appointment.patient = patient
+            find_appointment.save()
+            patients.append(patient)
+        return patients
+
+    @pytest.mark.django_db
+    def test_workers_claim_disjoint_patients(
+        self, user: User, find_appointment: FindAppointment
+    ) -> None:
+        """Test that a patient leased by one worker is skipped by the others"""
+        self._patients_with_searches(user, find_appointment, 3)
+
+        first = PatientLeaseService.claim_patients("worker-1", 2, LEASE_SECONDS)
+        second = PatientLeaseService.claim_patients("worker-2", 10, LEASE_SECONDS)
+
+        assert len(first) == 2
+        assert len(second) == 2
+        assert not {p.id for p in first} & {p.id for p in second}
+        assert all(p.lease_owner == "worker-1" for p in first)
+
+    @pytest.mark.django_db
+    def test_expired_lease_is_reclaimed(
+        self, patient: PacienteAllende, find_appointment: FindAppointment
+    ) -> None:
+        """Test that the patients of a crashed worker are claimed again"""
+        now = timezone.now()
+        PatientLeaseService.claim_patients("crashed", 10, LEASE_SECONDS, now=now)
+
+        assert PatientLeaseService.claim_patients("worker", 10, LEASE_SECONDS) == []
+        reclaimed = PatientLeaseService.claim_patients(
+            "worker",
+            10,
+            LEASE_SECONDS,
+            now=now + datetime.timedelta(seconds=LEASE_SECONDS + 1),
+        )
+
+        assert [p.id for p in reclaimed] == [patient.id]
+
+    @pytest.mark.django_db
+    def test_only_patients_with_due_searches_are_claimed(
+        self, patient: PacienteAllende, find_appointment: FindAppointment
+    ) -> None:
+        """Test that patients without due searches are not leased"""
+        find_appointment.next_poll_at = timezone.now() + datetime.timedelta(hours=1)
+        find_appointment.save()
+
+        assert PatientLeaseService.claim_patients("worker", 10, LEASE_SECONDS) == []
+
+    @pytest.mark.django_db
+    def test_release_frees_patient_for_other_workers(
+        self, patient: PacienteAllende, find_appointment: FindAppointment
+    ) -> None:
+        """Test that released patients can be claimed by another worker"""
+        PatientLeaseService.claim_patients("worker-1", 10, LEASE_SECONDS)
+
+        assert PatientLeaseService.release("worker-2", [patient.id]) == 0
+        assert PatientLeaseService.release("worker-1", [patient.id]) == 1
+        claimed = PatientLeaseService.claim_patients("worker-2", 10, LEASE_SECONDS)
+        assert [p.id for p in claimed] == [patient.id]
@@ -0,0 +1,263 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict
+
+import requests
+from django.conf import settings
+
+from sanatorio_allende.metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+HTTP_TOO_MANY_REQUESTS = 429
+HTTP_SERVER_ERROR = 500
+
+REQUESTS_METRIC = "turnos_allende_requests_total"
+
+DEFAULT_ENDPOINT_LIMITS: Dict[str, Any] = {
+    # Sustained requests per second and burst size of the token bucket
+    "rate": 5.0,
+    "burst": 10,
+    # Longest a caller waits for a token before failing fast
+    "max_wait": 5.0,
+    # Consecutive failures that open the circuit
+    "failure_threshold": 5,
+    # Seconds the circuit stays open before letting probes through
+    "recovery_timeout": 30.0,
+    # Probes allowed while half-open, one success closes the circuit again
+    "half_open_max_calls": 1,
+    # Seconds before an upstream call is abandoned
+    "timeout": 10.0,
+}
+
+
+class CircuitOpenException(requests.RequestException):
+    """The upstream endpoint is failing and calls are rejected without trying"""
+
+
+class RateLimitedException(requests.RequestException):
+    """No request slot for the upstream endpoint was available in time"""
+
+
+class TokenBucket:
+    """Thread-safe token bucket, callers wait for a token up to a limit"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, max_wait: float) -> bool:
+        """
+        Take a token, sleeping until one is available
+
+        Args:
+            max_wait: Longest time to wait for a token
+
+        Returns:
+            True if a token was taken, False if it would take longer than max_wait
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated_at) * self.rate
+            )
+            self.updated_at = now
+
+            wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+            if wait > max_wait:
+                return False
+            # Reserve the token now so concurrent callers queue behind this one
+            self.tokens -= 1
+
+        if wait > 0:
+            time.sleep(wait)
+        return True
+
+
+class CircuitBreaker:
+    """Closed/open/half-open circuit breaker counting consecutive failures"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int,
+        recovery_timeout: float,
+        half_open_max_calls: int,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.half_open_calls = 0
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Check if a call may go through, moving to half-open after recovery"""
+        with self.lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.recovery_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self.half_open_calls = 0
+
+            if self.state == self.HALF_OPEN:
+                if self.half_open_calls >= self.half_open_max_calls:
+                    return False
+                self.half_open_calls += 1
+
+            return True
+
+    def release(self) -> None:
+        """Give back a half-open probe that ended without an upstream outcome"""
+        with self.lock:
+            if self.state == self.HALF_OPEN and self.half_open_calls > 0:
+                self.half_open_calls -= 1
+
+    def record_success(self) -> None:
+        with self.lock:
+            if self.state != self.CLOSED:
+                logger.info(f"Allende {self.name} circuit closed")
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and self.failures >= self.failure_threshold
+            ):
+                logger.warning(
+                    f"Allende {self.name} circuit opened after {self.failures} failures"
+                )
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+@dataclass
+class EndpointGuard:
+    """Rate limiter and circuit breaker of a single upstream endpoint"""
+
+    bucket: TokenBucket
+    breaker: CircuitBreaker
+    max_wait: float
+    timeout: float
+
+
+class UpstreamGuard:
+    """
+    Per-process registry of the guards wrapped around each Allende endpoint
+
+    Limits come from settings.ALLENDE_UPSTREAM_LIMITS, where "default" applies
+    to every endpoint and each endpoint name can override some of the values.
+    """
+
+    _guards: Dict[str, EndpointGuard] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_limits(cls, endpoint: str) -> Dict[str, Any]:
+        configured = getattr(settings, "ALLENDE_UPSTREAM_LIMITS", {})
+        return {
+            **DEFAULT_ENDPOINT_LIMITS,
+            **configured.get("default", {}),
+            **configured.get(endpoint, {}),
+        }
+
+    @classmethod
+    def get(cls, endpoint: str) -> EndpointGuard:
+        with cls._lock:
+            guard = cls._guards.get(endpoint)
+            if guard is None:
+                limits = cls.get_limits(endpoint)
+                guard = cls._guards[endpoint] = EndpointGuard(
+                    bucket=TokenBucket(float(limits["rate"]), float(limits["burst"])),
+                    breaker=CircuitBreaker(
+                        endpoint,
+                        int(limits["failure_threshold"]),
+                        float(limits["recovery_timeout"]),
+                        int(limits["half_open_max_calls"]),
+                    ),
+                    max_wait=float(limits["max_wait"]),
+                    timeout=float(limits["timeout"]),
+                )
+            return guard
+
+    @classmethod
+    def reset(cls) -> None:
+        """Forget all limiter and breaker state (e.g. after changing settings)"""
+        with cls._lock:
+            cls._guards.clear()
+
+    @classmethod
+    def _is_failure(cls, response: Any) -> bool:
+        status_code = getattr(response, "status_code", None)
+        return isinstance(status_code, int) and (
+            status_code == HTTP_TOO_MANY_REQUESTS or status_code >= HTTP_SERVER_ERROR
+        )
+
+    @classmethod
+    def call(
+        cls, endpoint: str, func: Callable[..., Any], *args: Any, **kwargs: Any
+    ) -> Any:
+        """
+        Call an upstream endpoint through its rate limiter and circuit breaker
+
+        Args:
+            endpoint: Name of the endpoint (e.g. "search", "book", "auth")
+            func: The HTTP function to call (e.g. requests.post)
+            *args: Positional arguments for func
+            **kwargs: Keyword arguments for func, a default timeout is added
+
+        Returns:
+            The response returned by func
+
+        Raises:
+            RateLimitedException: If no request slot was available in time
+            CircuitOpenException: If the endpoint is failing
+            requests.RequestException: If the call itself fails
+        """
+        guard = cls.get(endpoint)
+
+        # Calls rejected by an open circuit must not use up request slots
+        if not guard.breaker.allow():
+            Metrics.inc(REQUESTS_METRIC, endpoint=endpoint, outcome="circuit_open")
+            raise CircuitOpenException(f"Allende {endpoint} endpoint circuit open")
+        if not guard.bucket.acquire(guard.max_wait):
+            guard.breaker.release()
+            Metrics.inc(REQUESTS_METRIC, endpoint=endpoint, outcome="rate_limited")
+            raise RateLimitedException(f"Allende {endpoint} endpoint rate limited")
+
+        kwargs.setdefault("timeout", guard.timeout)
+        settled = False
+        try:
+            response = func(*args, **kwargs)
+            settled = True
+        except requests.RequestException:
+            settled = True
+            guard.breaker.record_failure()
+            Metrics.inc(REQUESTS_METRIC, endpoint=endpoint, outcome="error")
+            raise
+        finally:
+            if not settled:
+                # Not an upstream failure (e.g. a bug), free the half-open probe
+                guard.breaker.release()
+
+        if cls._is_failure(response):
+            guard.breaker.record_failure()
+            Metrics.inc(REQUESTS_METRIC, endpoint=endpoint, outcome="server_error")
+        else:
+            guard.breaker.record_success()
+            Metrics.inc(REQUESTS_METRIC, endpoint=endpoint, outcome="ok")
+        return response
@@ -7,12 +7,18 @@ app_name = "sanatorio_allende"
 urlpatterns = [
     path("login/", views.LoginView.as_view(), name="login"),
     path("auth/callback/", views.AuthCallbackView.as_view(), name="auth_callback"),
+    path("metrics/", views.MetricsView.as_view(), name="metrics"),
     path("api/doctors/", views.DoctorListView.as_view(), name="api_doctors"),
     path(
         "api/appointment-types/",
         views.AppointmentTypeListView.as_view(),
         name="api_appointment_types",
     ),
+    path(
+        "api/doctors/release-stats/",
+        views.SlotReleaseStatsView.as_view(),
+        name="api_doctor_release_stats",
+    ),
     path(
         "api/patients/",
         views.PatientListView.as_view(),
@@ -28,6 +34,11 @@ urlpatterns = [
         views.BestAppointmentListView.as_view(),
         name="api_best_appointments",
     ),
+    path(
+        "api/best-appointments/events/",
+        views.AppointmentEventStreamView.as_view(),
+        name="api_best_appointment_events",
+    ),
     path(
         "api/appointment/",
         views.AppointmentView.as_view(),
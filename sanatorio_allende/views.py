@@ -1,10 +1,23 @@
 import json
+from dataclasses import asdict
+from typing import Any, Callable, Dict
 
 import requests
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.contrib.auth import get_user
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.models import User
-from django.http import HttpRequest, HttpResponse, JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import (
+    Http404,
+    HttpRequest,
+    HttpResponse,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.http.response import HttpResponseBase
 from django.shortcuts import get_object_or_404, render
 from django.utils import timezone
 from django.utils.decorators import method_decorator
@@ -12,8 +25,25 @@ from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 
 from sanatorio_allende.allende_api import Allende, UnauthorizedException
+from sanatorio_allende.conditional import PatientListETag
+from sanatorio_allende.db_router import read_from_replica
+from sanatorio_allende.event_stream import AppointmentEventStream
+from sanatorio_allende.metrics import Metrics
+from sanatorio_allende.pagination import KeysetPagination
+from sanatorio_allende.repositories.device_registration_repository import (
+    DeviceRegistrationRepository,
+)
+from sanatorio_allende.repositories.patient_version_repository import (
+    PatientVersionRepository,
+)
+from sanatorio_allende.services.appointment_booking import AppointmentBookingService
+from sanatorio_allende.services.appointment_events import AppointmentEventService
+from sanatorio_allende.services.idempotency import IdempotencyService
+from sanatorio_allende.services.search_fingerprint import SearchFingerprintService
+from sanatorio_allende.services.slot_analytics import SlotAnalyticsService
 
 from .models import (
+    AppointmentEvent,
     BestAppointmentFound,
     DeviceRegistration,
     FindAppointment,
@@ -51,6 +81,19 @@ class AuthCallbackView(View):
         )
 
 
+class MetricsView(View):
+    """Prometheus metrics of this process, only reachable from local addresses"""
+
+    def get(self, request: HttpRequest) -> HttpResponse:
+        allowed_ips = getattr(settings, "METRICS_ALLOWED_IPS", ["127.0.0.1", "::1"])
+        if request.META.get("REMOTE_ADDR") not in allowed_ips:
+            raise Http404()
+
+        return HttpResponse(
+            Metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
+
+
 @method_decorator(csrf_exempt, name="dispatch")
 class DoctorListView(LoginRequiredMixin, View):
     """Class-based view for listing doctors"""
@@ -163,17 +206,64 @@ class AppointmentTypeListView(LoginRequiredMixin, View):
             )
 
 
+@method_decorator(csrf_exempt, name="dispatch")
+class SlotReleaseStatsView(LoginRequiredMixin, View):
+    """Class-based view for the release times of a doctor's slots"""
+
+    @method_decorator(read_from_replica)
+    def get(self, request: HttpRequest) -> JsonResponse:
+        """Get the release-time histogram of a doctor from the slot history"""
+        try:
+            id_recurso = int(request.GET["id_recurso"])
+            id_servicio = (
+                int(request.GET["id_servicio"])
+                if request.GET.get("id_servicio")
+                else None
+            )
+            days = int(request.GET.get("days", 90))
+        except (KeyError, ValueError):
+            return JsonResponse(
+                {
+                    "success": False,
+                    "error": "id_recurso is required, id_recurso, id_servicio and days must be integers",
+                },
+                status=400,
+            )
+        if not 1 <= days <= 365:
+            return JsonResponse(
+                {"success": False, "error": "days must be between 1 and 365"},
+                status=400,
+            )
+
+        histogram = SlotAnalyticsService.release_histogram(
+            id_recurso, id_servicio, days=days
+        )
+        return JsonResponse(
+            {
+                "success": True,
+                **asdict(histogram),
+                "peak_hours": [
+                    {"hour": hour, "releases": releases}
+                    for hour, releases in SlotAnalyticsService.peak_hours(histogram)
+                ],
+            }
+        )
+
+
 @method_decorator(csrf_exempt, name="dispatch")
 class FindAppointmentView(LoginRequiredMixin, View):
     """Class-based view for FindAppointment CRUD operations"""
 
-    def get(self, request: HttpRequest) -> JsonResponse:
+    @method_decorator(read_from_replica)
+    def get(self, request: HttpRequest) -> HttpResponseBase:
         """Get all FindAppointment objects with optional time filtering"""
         # Get optional seconds parameter for filtering recent appointments
         patient_id = request.GET.get("patient_id")
         # Optimized: Use select_related to fetch user in one query
         patient = get_object_or_404(
-            PacienteAllende.objects.select_related("user").only("id", "user__id"),
+            PatientVersionRepository.with_version(
+                PacienteAllende.objects.select_related("user").only("id", "user__id")
+            ),
             id=patient_id,
         )
         if patient.user != request.user:
@@ -185,6 +275,14 @@ class FindAppointmentView(LoginRequiredMixin, View):
                 status=401,
             )
 
+        # Answer unchanged polls before querying the searches
+        etag = PatientListETag(
+            request, patient.id, patient.list_version  # type: ignore
+        )
+        not_modified = etag.not_modified()
+        if not_modified is not None:
+            return not_modified
+
         # Optimized: Fetch all required fields in one query
         find_appointments = FindAppointment.objects.filter(patient=patient).only(
             "id",
@@ -196,25 +294,32 @@ class FindAppointmentView(LoginRequiredMixin, View):
             "id_recurso",
             "id_tipo_prestacion",
             "desired_timeframe",
+            "auto_book",
         )
 
-        appointments_data = []
-        for appointment in find_appointments:
-            appointments_data.append(
-                {
-                    "id": appointment.id,
-                    "name": appointment.doctor_name,
-                    "especialidad": appointment.especialidad,
-                    "location": appointment.sucursal,
-                    "enabled": appointment.active,
-                    "tipo_de_turno": appointment.nombre_tipo_prestacion,
-                    "doctor_id": appointment.id_recurso,
-                    "tipo_de_turno_id": appointment.id_tipo_prestacion,
-                    "desired_timeframe": appointment.desired_timeframe,
-                }
+        return etag.apply(
+            KeysetPagination.response(
+                request,
+                find_appointments,
+                "appointments",
+                self._serialize,
+                ordering=("doctor_name", "id"),
             )
+        )
 
-        return JsonResponse({"success": True, "appointments": appointments_data})
+    def _serialize(self, appointment: FindAppointment) -> Dict[str, Any]:
+        return {
+            "id": appointment.id,
+            "name": appointment.doctor_name,
+            "especialidad": appointment.especialidad,
+            "location": appointment.sucursal,
+            "enabled": appointment.active,
+            "tipo_de_turno": appointment.nombre_tipo_prestacion,
+            "doctor_id": appointment.id_recurso,
+            "tipo_de_turno_id": appointment.id_tipo_prestacion,
+            "desired_timeframe": appointment.desired_timeframe,
+            "auto_book": appointment.auto_book,
+        }
 
     def post(self, request: HttpRequest) -> JsonResponse:
         """Create a new FindAppointment"""
@@ -266,6 +371,7 @@ class FindAppointmentView(LoginRequiredMixin, View):
         desired_timeframe = data.get(
             "desired_timeframe", FindAppointment.DEFAULT_DESIRED_TIMEFRAME
         )
+        auto_book = bool(data.get("auto_book", False))
 
         if patient.user != request.user:
             return JsonResponse(
@@ -294,17 +400,34 @@ class FindAppointmentView(LoginRequiredMixin, View):
                 "nombre_tipo_prestacion": nombre_tipo_prestacion,
                 "active": True,
                 "desired_timeframe": desired_timeframe,
+                "auto_book": auto_book,
             },
         )
 
         if not created:
-            # Update only the desired_timeframe field
+            # Update only the user editable fields
             existing_appointment.desired_timeframe = desired_timeframe
-            existing_appointment.save(update_fields=["desired_timeframe"])
+            existing_appointment.auto_book = auto_book
+            # Poll and process the edited search in the next run
+            existing_appointment.next_poll_at = None
+            existing_appointment.last_response_fingerprint = ""
+            # Misses counted against the previous timeframe no longer apply
+            existing_appointment.out_of_window_polls = 0
+            existing_appointment.save(
+                update_fields=[
+                    "desired_timeframe",
+                    "auto_book",
+                    "next_poll_at",
+                    "last_response_fingerprint",
+                    "out_of_window_polls",
+                ]
+            )
+            PatientVersionRepository.bump(patient.id)
             return JsonResponse(
                 {"success": True, "message": "Appointment updated successfully"}
             )
 
+        PatientVersionRepository.bump(patient.id)
         return JsonResponse(
             {
                 "success": True,
@@ -353,7 +476,13 @@ class FindAppointmentView(LoginRequiredMixin, View):
                 status=401,
             )
         appointment.active = active
-        appointment.save(update_fields=["active"])
+        # Poll and process the re-enabled search in the next run
+        appointment.next_poll_at = None
+        appointment.last_response_fingerprint = ""
+        appointment.save(
+            update_fields=["active", "next_poll_at", "last_response_fingerprint"]
+        )
+        PatientVersionRepository.bump(appointment.patient.id)
 
         return JsonResponse(
             {
@@ -367,11 +496,14 @@ class FindAppointmentView(LoginRequiredMixin, View):
 class BestAppointmentListView(LoginRequiredMixin, View):
     """Class-based view for listing BestAppointmentFound objects"""
 
-    def get(self, request: HttpRequest) -> JsonResponse:
+    @method_decorator(read_from_replica)
+    def get(self, request: HttpRequest) -> HttpResponseBase:
         """Get all BestAppointmentFound objects (excluding not_interested ones)"""
         patient_id = request.GET.get("patient_id")
         patient = get_object_or_404(
-            PacienteAllende.objects.select_related("user").only("id", "user__id"),
+            PatientVersionRepository.with_version(
+                PacienteAllende.objects.select_related("user").only("id", "user__id")
+            ),
             id=patient_id,
         )
         if patient.user != request.user:
@@ -383,6 +515,14 @@ class BestAppointmentListView(LoginRequiredMixin, View):
                 status=401,
             )
 
+        # Answer unchanged polls before querying the appointments
+        etag = PatientListETag(
+            request, patient.id, patient.list_version  # type: ignore
+        )
+        not_modified = etag.not_modified()
+        if not_modified is not None:
+            return not_modified
+
         # Optimized: Use select_related and only() to fetch specific fields efficiently
         best_appointments = (
             BestAppointmentFound.objects.select_related(
@@ -406,30 +546,24 @@ class BestAppointmentListView(LoginRequiredMixin, View):
             )
         )
 
-        appointments_data = []
-        for best_appointment in best_appointments:
-            appointment = best_appointment.appointment_wanted
-            appointments_data.append(
-                {
-                    "id": best_appointment.id,
-                    "doctor_name": appointment.doctor_name,
-                    "especialidad": appointment.especialidad,
-                    "location": appointment.sucursal,
-                    "tipo_de_turno": appointment.nombre_tipo_prestacion,
-                    "best_datetime": best_appointment.datetime.isoformat(),
-                    "duracion_individual": best_appointment.duracion_individual,
-                    "id_plantilla_turno": best_appointment.id_plantilla_turno,
-                    "id_item_plantilla": best_appointment.id_item_plantilla,
-                    "confirmed": best_appointment.confirmed,
-                    "confirmed_at": (
-                        best_appointment.confirmed_at.isoformat()
-                        if best_appointment.confirmed_at
-                        else None
-                    ),
-                }
+        def serialize(best_appointment: BestAppointmentFound) -> Dict[str, Any]:
+            # A listed appointment drops out of the list once it is in the past
+            etag.expires(best_appointment.datetime)
+            return self._serialize(best_appointment)
+
+        return etag.apply(
+            KeysetPagination.response(
+                request,
+                best_appointments,
+                "best_appointments",
+                serialize,
+                ordering=("datetime", "id"),
             )
+        )
 
-        return JsonResponse({"success": True, "best_appointments": appointments_data})
+    def _serialize(self, best_appointment: BestAppointmentFound) -> Dict[str, Any]:
+        # Same rows as the created/updated events of the event stream
+        return AppointmentEventService.serialize(best_appointment)
 
     def patch(self, request: HttpRequest) -> JsonResponse:
         """Mark an appointment as not interested"""
@@ -455,7 +589,7 @@ class BestAppointmentListView(LoginRequiredMixin, View):
         try:
             best_appointment = (
                 BestAppointmentFound.objects.select_related("patient__user")
-                .only("id", "patient__user__id")
+                .only("id", "appointment_wanted_id", "patient__user__id")
                 .get(id=appointment_id)
             )
             if best_appointment.patient.user != request.user:
@@ -469,6 +603,23 @@ class BestAppointmentListView(LoginRequiredMixin, View):
 
             best_appointment.not_interested = not_interested
             best_appointment.save(update_fields=["not_interested"])
+            PatientVersionRepository.bump(best_appointment.patient_id)
+            # The same slot has to be compared again against the new list
+            SearchFingerprintService.reset(best_appointment.appointment_wanted_id)
+            if not_interested:
+                AppointmentEventService.record(
+                    best_appointment.patient_id,
+                    AppointmentEvent.REMOVED,
+                    {"ids": [best_appointment.id]},
+                )
+            else:
+                # Back in the list, send the full row like a found appointment
+                AppointmentEventService.record_appointment(
+                    AppointmentEvent.UPDATED,
+                    BestAppointmentFound.objects.select_related(
+                        "appointment_wanted"
+                    ).get(id=best_appointment.id),
+                )
 
             return JsonResponse(
                 {
@@ -486,11 +637,72 @@ class BestAppointmentListView(LoginRequiredMixin, View):
             )
 
 
+class AppointmentEventStreamView(View):
+    """
+    Server-sent event stream of the appointment changes of a patient
+
+    Replaces polling api/best-appointments/ when served by an ASGI server,
+    under WSGI it answers 501 and the app keeps polling. Clients resume with
+    the Last-Event-ID header after a reconnect.
+    """
+
+    async def get(self, request: HttpRequest) -> HttpResponseBase:
+        # Under WSGI the endless stream would hold a worker per connected app
+        if not isinstance(request, ASGIRequest):
+            return JsonResponse(
+                {"success": False, "error": "Event stream requires an ASGI server"},
+                status=501,
+            )
+
+        user = await sync_to_async(get_user)(request)
+        if not user.is_authenticated:
+            return JsonResponse(
+                {"success": False, "error": "Authentication required"}, status=401
+            )
+
+        try:
+            patient_id = int(request.GET.get("patient_id", ""))
+        except ValueError:
+            return JsonResponse(
+                {"success": False, "error": "patient_id is required"}, status=400
+            )
+        if not await PacienteAllende.objects.filter(
+            id=patient_id, user_id=user.pk
+        ).aexists():
+            return JsonResponse(
+                {
+                    "success": False,
+                    "error": "Patient does not belong to the current user",
+                },
+                status=401,
+            )
+
+        resume_from = request.headers.get("Last-Event-ID") or request.GET.get(
+            "last_event_id"
+        )
+        try:
+            last_event_id = int(resume_from) if resume_from else None
+        except ValueError:
+            return JsonResponse(
+                {"success": False, "error": "Invalid Last-Event-ID"}, status=400
+            )
+
+        stream = AppointmentEventStream(patient_id, last_event_id)
+        response = StreamingHttpResponse(
+            stream.events(), content_type="text/event-stream"
+        )
+        response["Cache-Control"] = "no-cache"
+        # Keep nginx from buffering the stream
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+
 @method_decorator(csrf_exempt, name="dispatch")
 class PatientListView(LoginRequiredMixin, View):
     """Class-based view for listing patients"""
 
-    def get(self, request: HttpRequest) -> JsonResponse:
+    @method_decorator(read_from_replica)
+    def get(self, request: HttpRequest) -> HttpResponseBase:
         """Get all patients"""
         assert isinstance(request.user, User)
         # Optimized: Use only() to fetch specific fields
@@ -498,21 +710,18 @@ class PatientListView(LoginRequiredMixin, View):
             "id", "name", "id_paciente", "docid", "updated_at"
         )
 
-        patients_data = []
-        for patient in patients:
-            patients_data.append(
-                {
-                    "id": patient.id,
-                    "name": patient.name,
-                    "id_paciente": patient.id_paciente,
-                    "docid": patient.docid,
-                    "updated_at": (
-                        patient.updated_at.isoformat() if patient.updated_at else None
-                    ),
-                }
-            )
+        return KeysetPagination.response(request, patients, "patients", self._serialize)
 
-        return JsonResponse({"success": True, "patients": patients_data})
+    def _serialize(self, patient: PacienteAllende) -> Dict[str, Any]:
+        return {
+            "id": patient.id,
+            "name": patient.name,
+            "id_paciente": patient.id_paciente,
+            "docid": patient.docid,
+            "updated_at": (
+                patient.updated_at.isoformat() if patient.updated_at else None
+            ),
+        }
 
     def post(self, request: HttpRequest) -> JsonResponse:
         """Create a new patient"""
@@ -658,6 +867,9 @@ class DeviceRegistrationView(LoginRequiredMixin, View):
             device.is_active = True
             device.save(update_fields=["platform", "is_active"])
 
+        # Drop the owner's cached tokens so the next notification reaches this device
+        DeviceRegistrationRepository.invalidate(device.user_id)
+
         return JsonResponse(
             {
                 "success": True,
@@ -669,7 +881,12 @@ class DeviceRegistrationView(LoginRequiredMixin, View):
 
 @method_decorator(csrf_exempt, name="dispatch")
 class AppointmentView(LoginRequiredMixin, View):
-    """Class-based view for confirming appointments"""
+    """Class-based view for confirming appointments
+
+    Confirm and cancel lock the appointment row for the whole upstream call, so
+    concurrent double-taps collapse into a single Allende request. Clients may
+    send an Idempotency-Key header to get the first call's response replayed.
+    """
 
     def post(self, request: HttpRequest) -> JsonResponse:
         """Confirm an appointment by calling the Allende reservar endpoint"""
@@ -681,96 +898,97 @@ class AppointmentView(LoginRequiredMixin, View):
                 status=400,
             )
 
-        appointment_id = data.get("appointment_id")
-        # Optimized: Use select_related to fetch patient and appointment_wanted in one query
-        appointment = get_object_or_404(
-            BestAppointmentFound.objects.select_related(
-                "patient", "appointment_wanted"
-            ).only(
-                "id",
-                "confirmed",
-                "confirmed_id_turno",
-                "confirmed_at",
-                "patient__id_paciente",
-                "patient__id_financiador",
-                "patient__id_plan",
-                "patient__token",
-                "appointment_wanted__id_servicio",
-                "appointment_wanted__id_sucursal",
-                "appointment_wanted__id_recurso",
-                "appointment_wanted__id_especialidad",
-                "appointment_wanted__id_tipo_prestacion",
-                "appointment_wanted__id_tipo_recurso",
-                "appointment_wanted__id_prestacion",
-            ),
-            id=appointment_id,
-        )
+        return self._run_locked(request, data, "confirm", self._confirm)
 
-        if appointment.confirmed:
+    def delete(self, request: HttpRequest) -> JsonResponse:
+        """Cancel an appointment by calling the Allende cancel_appointment endpoint"""
+        try:
+            data = json.loads(request.body)
+        except json.JSONDecodeError:
             return JsonResponse(
-                {"success": False, "error": "Appointment is already confirmed"},
+                {"success": False, "error": "Invalid JSON"},
                 status=400,
             )
 
-        patient = appointment.patient
-        assert isinstance(patient.id_paciente, str)
-        assert isinstance(patient.id_financiador, int)
-        assert isinstance(patient.id_plan, int)
-        allende = Allende(auth_header=patient.token)
+        return self._run_locked(request, data, "cancel", self._cancel)
 
-        appointment_data = {
-            "CriterioBusquedaDto": {
-                "IdPaciente": int(patient.id_paciente),
-                "IdServicio": appointment.appointment_wanted.id_servicio,
-                "IdSucursal": appointment.appointment_wanted.id_sucursal,
-                "IdRecurso": appointment.appointment_wanted.id_recurso,
-                "IdEspecialidad": appointment.appointment_wanted.id_especialidad,
-                "ControlarEdad": False,
-                "IdTipoDeTurno": appointment.appointment_wanted.id_tipo_prestacion,
-                "IdFinanciador": int(patient.id_financiador),
-                "IdTipoRecurso": appointment.appointment_wanted.id_tipo_recurso,
-                "IdPlan": int(patient.id_plan),
-                "Prestaciones": [
-                    {
-                        "IdPrestacion": appointment.appointment_wanted.id_prestacion,
-                        "IdItemSolicitudEstudios": 0,
-                    }
-                ],
-            },
-            "TurnoElegidoDto": {
-                "Fecha": timezone.localtime(appointment.datetime).strftime(
-                    "%Y-%m-%dT00:00:00"
+    def _run_locked(
+        self,
+        request: HttpRequest,
+        data: dict,
+        scope: str,
+        operation: Callable[[HttpRequest, Any], JsonResponse],
+    ) -> JsonResponse:
+        """Run the operation holding the appointment row lock, replaying stored responses"""
+        assert isinstance(request.user, User)
+        idempotency_key = IdempotencyService.get_key(request, data)
+        appointment_id = data.get("appointment_id")
+        replay = IdempotencyService.get_response(
+            request.user.id, scope, idempotency_key, appointment_id
+        )
+        if replay is not None:
+            return replay
+
+        with transaction.atomic():
+            # Optimized: Lock only the appointment row, the patient is just read
+            appointment = get_object_or_404(
+                BestAppointmentFound.objects.select_for_update(of=("self",))
+                .select_related("patient")
+                .only(
+                    "id",
+                    "appointment_wanted_id",
+                    "booking_payload",
+                    "confirmed",
+                    "confirmed_id_turno",
+                    "confirmed_at",
+                    "patient__user_id",
+                    "patient__token",
                 ),
-                "Hora": timezone.localtime(appointment.datetime).strftime("%H:%M"),
-                "IdItemDePlantilla": appointment.id_item_plantilla,
-                "IdPlantillaTurno": appointment.id_plantilla_turno,
-                "IdSucursal": appointment.appointment_wanted.id_sucursal,
-                "DuracionIndividual": appointment.duracion_individual,
-                "RequisitoAdministrativoAlOtorgar": "DNI\nCredencial Financiador\n AUTORIZACION: Con autorización online",
-            },
-            "Observaciones": None,
-        }
+                id=appointment_id,
+            )
 
-        try:
-            result = allende.book_appointment(appointment_data)
-            if result.id_turno is None:
-                print(result.data)
+            # A concurrent request with the same key may have finished while we waited
+            replay = IdempotencyService.get_response(
+                request.user.id, scope, idempotency_key, appointment_id
+            )
+            if replay is not None:
+                return replay
+
+            if appointment.patient.user_id != request.user.id:
                 return JsonResponse(
                     {
                         "success": False,
-                        "error": "No se pudo obtener el ID del turno",
+                        "error": "Appointment does not belong to the current user",
                     },
-                    status=400,
+                    status=401,
                 )
 
-            # Optimized: Update only specific fields
-            appointment.confirmed_id_turno = result.id_turno
-            appointment.confirmed = True
-            appointment.confirmed_at = timezone.now()
-            appointment.save(
-                update_fields=["confirmed_id_turno", "confirmed", "confirmed_at"]
+            response = operation(request, appointment)
+            IdempotencyService.store_response(
+                request.user.id, scope, idempotency_key, appointment_id, response
+            )
+            return response
+
+    def _confirm(
+        self, request: HttpRequest, appointment: BestAppointmentFound
+    ) -> JsonResponse:
+        """Book the locked appointment using its prebuilt payload"""
+        if appointment.confirmed:
+            return JsonResponse(
+                {"success": False, "error": "Appointment is already confirmed"},
+                status=400,
             )
 
+        allende = Allende(auth_header=appointment.patient.token)
+
+        try:
+            result = AppointmentBookingService.book(appointment, allende, locked=True)
+            if not result.success:
+                return JsonResponse(
+                    {"success": False, "error": result.error},
+                    status=400,
+                )
+
             return JsonResponse(
                 {"success": True, "message": "Appointment confirmed successfully"}
             )
@@ -792,44 +1010,18 @@ class AppointmentView(LoginRequiredMixin, View):
                 status=503,
             )
 
-    def delete(self, request: HttpRequest) -> JsonResponse:
-        """Cancel an appointment by calling the Allende cancel_appointment endpoint"""
-        try:
-            data = json.loads(request.body)
-        except json.JSONDecodeError:
-            return JsonResponse(
-                {"success": False, "error": "Invalid JSON"},
-                status=400,
-            )
-
-        appointment_id = data.get("appointment_id")
-        # Optimized: Use select_related to fetch patient in one query
-        appointment = get_object_or_404(
-            BestAppointmentFound.objects.select_related("patient").only(
-                "id",
-                "confirmed",
-                "confirmed_id_turno",
-                "confirmed_at",
-                "patient__id_paciente",
-                "patient__id_financiador",
-                "patient__id_plan",
-                "patient__token",
-            ),
-            id=appointment_id,
-        )
-
+    def _cancel(
+        self, request: HttpRequest, appointment: BestAppointmentFound
+    ) -> JsonResponse:
+        """Cancel the locked appointment in Allende"""
         if not appointment.confirmed:
             return JsonResponse(
                 {"success": False, "error": "Appointment is not confirmed"},
                 status=400,
             )
 
-        patient = appointment.patient
-        assert isinstance(patient.id_paciente, str)
-        assert isinstance(patient.id_financiador, int)
-        assert isinstance(patient.id_plan, int)
         assert isinstance(appointment.confirmed_id_turno, int)
-        allende = Allende(auth_header=patient.token)
+        allende = Allende(auth_header=appointment.patient.token)
 
         try:
             response = allende.cancel_appointment(appointment.confirmed_id_turno)
@@ -846,6 +1038,11 @@ class AppointmentView(LoginRequiredMixin, View):
             appointment.save(
                 update_fields=["confirmed", "confirmed_id_turno", "confirmed_at"]
             )
+            PatientVersionRepository.bump(appointment.patient_id)
+            SearchFingerprintService.reset(appointment.appointment_wanted_id)
+            AppointmentEventService.record_confirmation(
+                AppointmentEvent.CANCELLED, appointment
+            )
 
             return JsonResponse(
                 {"success": True, "message": "Appointment cancelled successfully"}